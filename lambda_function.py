@@ -3,17 +3,156 @@
 Lambda para processar e-mails de parcelas Credilly via SendGrid.
 """
 
-from typing import Dict, List, Optional, Tuple
+from typing import Any, Dict, List, Optional, Tuple, TypedDict
 import requests
-from datetime import datetime, timedelta, date
+from datetime import datetime, timedelta, timezone, date
 import json
 import logging
+import logging.handlers
+import queue
 import time
 import os
-import pytz
 import random
+import hashlib
+import re
+import socket
+import string
+import threading
+import sqlite3
+import tracemalloc
+import zlib
+from collections import OrderedDict, deque
+from itertools import islice
+from collections.abc import Mapping, Sequence
+from contextlib import contextmanager
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlparse
+from concurrent.futures import ThreadPoolExecutor, wait
 
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+try:
+    import numpy as np
+except ImportError:  # numpy é opcional (não faz parte do pacote padrão da Lambda)
+    np = None
+
+try:
+    import orjson
+except ImportError:  # orjson é opcional: só acelera a serialização JSON quando empacotado
+    orjson = None
+
+try:
+    import msgspec
+except ImportError:  # msgspec é opcional: serialização e decodificação tipada das vendas Tenex
+    msgspec = None
+
+try:
+    import dns.resolver
+    import dns.exception
+except ImportError:  # dnspython é opcional: sem ele, VALIDACAO_EMAIL_DNS só verifica se o domínio resolve para um host
+    dns = None
+
+try:
+    import boto3
+    from botocore import __version__ as VERSAO_BOTOCORE
+    from botocore.config import Config as ConfigBotocore
+    from botocore.exceptions import ClientError
+except ImportError:  # boto3 vem no runtime da Lambda; só o cache compartilhado em S3 depende dele
+    boto3 = None
+    VERSAO_BOTOCORE = None
+    ClientError = Exception
+
+try:
+    from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+except ImportError:  # pragma: no cover - runtimes sem zoneinfo
+    ZoneInfo = None
+    ZoneInfoNotFoundError = Exception
+
+# Logging: nível, formato (json estruturado ou texto), amostragem das mensagens por item e modo resumo
+LOG_NIVEL = os.environ.get('LOG_NIVEL', 'INFO').upper()
+# texto (padrão) mantém o formato atual do handler; json troca o formato por uma linha JSON estruturada
+LOG_FORMATO = os.environ.get('LOG_FORMATO', 'texto').lower()  # texto | json
+# Escrita dos logs numa thread à parte (QueueHandler/QueueListener), em qualquer formato; false = escrita síncrona
+LOG_ASSINCRONO = os.environ.get('LOG_ASSINCRONO', 'true').lower() == 'true'
+# Fração das mensagens por item (sem e-mail, e-mail inválido, ...) que chega ao log; erros nunca são amostrados
+LOG_AMOSTRAGEM_ITEM = float(os.environ.get('LOG_AMOSTRAGEM_ITEM', '1'))
+# Dias de alto volume: mensagens por item viram só contadores em METRICAS ("log.<chave>") no relatório final
+LOG_RESUMO = os.environ.get('LOG_RESUMO', 'false').lower() == 'true'
+
+class FormatadorJSON(logging.Formatter):
+    """Uma linha JSON por registro; campos estruturados vêm de extra={'campos': {...}}."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        registro = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            "nivel": record.levelname,
+            "msg": record.getMessage(),
+        }
+        campos = getattr(record, 'campos', None)
+        if campos:
+            registro.update(campos)
+        if record.exc_info:
+            registro["exc"] = self.formatException(record.exc_info)
+        return json.dumps(registro, ensure_ascii=False, default=str)
+
+class HandlerFilaLogs(logging.handlers.QueueHandler):
+    """
+    Enfileira o registro sem formatá-lo: a mensagem (e os argumentos preguiçosos) só é montada
+    na thread do QueueListener, fora do caminho de envio.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+FILA_LOGS: "queue.Queue[logging.LogRecord]" = queue.Queue(-1)
+_OUVINTE_LOGS: Optional[logging.handlers.QueueListener] = None
+
+def configurar_logging() -> None:
+    """
+    Mantém os handlers da raiz (o da Lambda, ou o StreamHandler local no formato de sempre); com
+    LOG_FORMATO=json troca o formatador deles pelo FormatadorJSON. Com LOG_ASSINCRONO, move esses
+    handlers para trás de um QueueListener e deixa na raiz só o HandlerFilaLogs: quem loga só
+    enfileira. Idempotente entre invocações do mesmo container.
+    """
+    global _OUVINTE_LOGS
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    raiz = logging.getLogger()
+    raiz.setLevel(getattr(logging, LOG_NIVEL, logging.INFO))
+    if _OUVINTE_LOGS is not None:
+        return
+    handlers = [h for h in raiz.handlers if not isinstance(h, HandlerFilaLogs)]
+    if LOG_FORMATO == 'json':
+        formatador = FormatadorJSON()
+        for handler in handlers:
+            handler.setFormatter(formatador)
+    if not LOG_ASSINCRONO:
+        return
+    for handler in handlers:
+        raiz.removeHandler(handler)
+    raiz.addHandler(HandlerFilaLogs(FILA_LOGS))
+    _OUVINTE_LOGS = logging.handlers.QueueListener(FILA_LOGS, *handlers, respect_handler_level=True)
+    _OUVINTE_LOGS.start()
+
+def descarregar_logs(timeout: float = 2.0) -> None:
+    """
+    Espera o QueueListener escrever tudo; chamado antes de a Lambda devolver (o container congela em
+    seguida). A espera é limitada: se a thread do listener morreu, a invocação não fica presa na fila.
+    """
+    if _OUVINTE_LOGS is None:
+        return
+    limite = time.monotonic() + timeout
+    while FILA_LOGS.unfinished_tasks and time.monotonic() < limite:
+        time.sleep(0.01)
+
+def log_item(nivel: int, chave: str, mensagem: str, *args, campos: Optional[Dict] = None) -> None:
+    """
+    Mensagem por item do laço de envio: sempre contada em METRICAS ("log.<chave>"); emitida conforme
+    LOG_RESUMO e LOG_AMOSTRAGEM_ITEM (erros sempre emitidos). Argumentos preguiçosos, estilo %s.
+    """
+    registrar_metrica(f"log.{chave}")
+    if nivel < logging.ERROR and (LOG_RESUMO or random.random() >= LOG_AMOSTRAGEM_ITEM):
+        return
+    logging.log(nivel, mensagem, *args, extra={"campos": dict(campos or {}, evento=chave)})
+
+configurar_logging()
 
 # Configurações via Environment Variables
 AIRTABLE_API_KEY = os.environ.get('AIRTABLE_API_KEY', 'patiRLOfTIk9sv0td.7a4659adf17b1c464b25f4a07e176a36218757391d396be5afc4d6181c3dc429')
@@ -29,6 +168,26 @@ SENDGRID_TEMPLATE_VENCEU = os.environ.get('SENDGRID_TEMPLATE_VENCEU', '')
 SENDGRID_TEMPLATE_VENCE_HOJE = os.environ.get('SENDGRID_TEMPLATE_VENCE_HOJE', '')
 SENDGRID_TEMPLATE_VENCE_AMANHA = os.environ.get('SENDGRID_TEMPLATE_VENCE_AMANHA', '')
 SENDGRID_TEMPLATE_FIELD_MAP = os.environ.get('SENDGRID_TEMPLATE_FIELD_MAP', '')  # JSON opcional p/ mapear chaves
+SENDGRID_API_URL = os.environ.get('SENDGRID_API_URL', 'https://api.sendgrid.com/v3')
+# Validação de e-mails antes do envio (opt-in). A consulta remota (Email Validation API) exige uma chave própria.
+VALIDAR_EMAILS = os.environ.get('VALIDAR_EMAILS', 'false').lower() == 'true'
+SENDGRID_VALIDATION_API_KEY = os.environ.get('SENDGRID_VALIDATION_API_KEY', '')
+VALIDACAO_EMAIL_MAX_REMOTAS = int(os.environ.get('VALIDACAO_EMAIL_MAX_REMOTAS', '500'))  # por execução
+VALIDACAO_EMAIL_CONCORRENCIA = int(os.environ.get('VALIDACAO_EMAIL_CONCORRENCIA', '8'))  # consultas remotas simultâneas
+# Tempo máximo da etapa de consultas remotas; o que não tiver resposta até lá é aceito (enviado)
+VALIDACAO_EMAIL_PRAZO_SEGUNDOS = float(os.environ.get('VALIDACAO_EMAIL_PRAZO_SEGUNDOS', '30'))
+# Checa o domínio no DNS: registros MX com dnspython instalado; sem ele, só se o domínio resolve para um host (A/AAAA)
+VALIDACAO_EMAIL_DNS = os.environ.get('VALIDACAO_EMAIL_DNS', 'false').lower() == 'true'
+VALIDACAO_EMAIL_CACHE_TTL = int(os.environ.get('VALIDACAO_EMAIL_CACHE_TTL', str(30 * 24 * 3600)))  # segundos
+VALIDACAO_EMAIL_CACHE_ARQUIVO = os.environ.get('VALIDACAO_EMAIL_CACHE_ARQUIVO', '/tmp/email_vereditos.json')
+# Preparação antecipada (acao=preparar_envios): os envios são agendados com send_at a partir do
+# início da janela, espalhados por este número de minutos
+AGENDAMENTO_ESPALHAR_MINUTOS = int(os.environ.get('AGENDAMENTO_ESPALHAR_MINUTOS', '120'))
+# Antecedência mínima do send_at em relação ao momento da preparação
+AGENDAMENTO_ANTECEDENCIA_MIN = int(os.environ.get('AGENDAMENTO_ANTECEDENCIA_MIN', '300'))  # segundos
+# Marca do dia já preparado (data + batch_id): a invocação normal na janela não reenvia o que foi agendado.
+# Com CACHE_COMPARTILHADO_URL a marca também vale para os outros containers.
+AGENDAMENTO_MARCADOR_ARQUIVO = os.environ.get('AGENDAMENTO_MARCADOR_ARQUIVO', '/tmp/envios_preparados.json')
 
 # Observabilidade de conteúdo: BCC opcional para arquivamento/validação
 BCC_ARQUIVO_EMAIL = os.environ.get('BCC_ARQUIVO_EMAIL', '')
@@ -36,6 +195,9 @@ BCC_SAMPLE_PERCENT = float(os.environ.get('BCC_SAMPLE_PERCENT', '0'))  # 0 = des
 
 # Modo teste: controlado por env var. Produção por padrão.
 MODO_TESTE = os.environ.get('MODO_TESTE', 'false').lower() == 'true'
+# Modo carga: executa o pipeline inteiro, inclusive os envios, contra endpoints de ensaio
+# (ver simulador_local.py). Exige que nenhuma URL base aponte para produção.
+MODO_CARGA = os.environ.get('MODO_CARGA', 'false').lower() == 'true'
 PROCESSAR_CREDILLY = True
 # Habilite Turing via ENV: PROCESSAR_TURING=true
 PROCESSAR_TURING = os.environ.get('PROCESSAR_TURING', 'true').lower() == 'true'
@@ -43,35 +205,736 @@ LIMITE_VENCIDAS, LIMITE_HOJE, LIMITE_AMANHA = None, None, None
 # Horário permitido (padrão 9-20) com possibilidade de override por ENV
 HORARIO_INICIO = int(os.environ.get('HORARIO_INICIO', '9'))
 HORARIO_FIM = int(os.environ.get('HORARIO_FIM', '20'))
-PAUSAR_ENTRE_ENVIO = float(os.environ.get('PAUSAR_ENTRE_ENVIO', '0.05'))
-NOTIFICATION_FINALIZADO_URL = "https://api.pushcut.io/-KVMKI_4PP5GMnuH0M9oz/notifications/Envio_Email_Finalizado"
+PAUSAR_ENTRE_ENVIO = float(os.environ.get('PAUSAR_ENTRE_ENVIO', '0.05'))  # por worker
+# Fila única de envios: peso por período (JSON opcional) e, opcionalmente, ordenação pelo valor da parcela
+def carregar_pesos_periodo(bruto: str) -> Dict[str, float]:
+    """
+    Pesos padrão sobrescritos pelo JSON de PESOS_PERIODO. JSON malformado, períodos desconhecidos ou
+    pesos não numéricos são ignorados com um aviso: uma env var errada não pode derrubar o cold start.
+    """
+    pesos = {"venceu_ontem": 3.0, "vence_hoje": 2.0, "vence_amanha": 1.0}
+    if not bruto:
+        return pesos
+    try:
+        informados = json.loads(bruto)
+        if not isinstance(informados, dict):
+            raise ValueError("esperado um objeto JSON")
+    except ValueError as e:
+        logging.warning(f"PESOS_PERIODO inválido ({str(e)}); usando os pesos padrão")
+        return pesos
+    for periodo, peso in informados.items():
+        if periodo not in pesos:
+            logging.warning(f"PESOS_PERIODO: período desconhecido '{periodo}' ignorado (use {', '.join(pesos)})")
+        elif isinstance(peso, bool) or not isinstance(peso, (int, float)):
+            logging.warning(f"PESOS_PERIODO: peso não numérico para '{periodo}' ignorado: {peso!r}")
+        else:
+            pesos[periodo] = float(peso)
+    return pesos
+
+PESOS_PERIODO = carregar_pesos_periodo(os.environ.get('PESOS_PERIODO', ''))
+ORDENAR_POR_VALOR = os.environ.get('ORDENAR_POR_VALOR', 'false').lower() == 'true'
+ENVIO_CONCORRENCIA = int(os.environ.get('ENVIO_CONCORRENCIA', '1'))
+# Concorrência adaptativa (AIMD): ENVIO_CONCORRENCIA passa a ser o teto. O limite de envios simultâneos parte de
+# ENVIO_CONCORRENCIA_INICIAL, sobe enquanto a latência do SendGrid fica estável sem 429/5xx e é multiplicado por
+# ENVIO_FATOR_REDUCAO em 429, 5xx, falha de conexão ou latência sustentada acima de ENVIO_LATENCIA_TOLERANCIA x a de base
+ENVIO_CONCORRENCIA_ADAPTATIVA = os.environ.get('ENVIO_CONCORRENCIA_ADAPTATIVA', 'false').lower() == 'true'
+ENVIO_CONCORRENCIA_INICIAL = int(os.environ.get('ENVIO_CONCORRENCIA_INICIAL', '2'))
+ENVIO_LATENCIA_TOLERANCIA = float(os.environ.get('ENVIO_LATENCIA_TOLERANCIA', '2'))
+ENVIO_FATOR_REDUCAO = float(os.environ.get('ENVIO_FATOR_REDUCAO', '0.7'))
+# Pico de latência só conta em janelas de ENVIO_LATENCIA_JANELA respostas: a janela está congestionada se o p90
+# passar de ENVIO_LATENCIA_TOLERANCIA x a base (média móvel exponencial das medianas) e da base + ENVIO_LATENCIA_FOLGA_S;
+# o limite só cai depois de ENVIO_JANELAS_CONGESTIONADAS janelas seguidas
+ENVIO_LATENCIA_JANELA = int(os.environ.get('ENVIO_LATENCIA_JANELA', '20'))
+ENVIO_LATENCIA_FOLGA_S = float(os.environ.get('ENVIO_LATENCIA_FOLGA_S', '0.05'))
+ENVIO_JANELAS_CONGESTIONADAS = int(os.environ.get('ENVIO_JANELAS_CONGESTIONADAS', '2'))
+# Um e-mail por destinatário e período listando todas as parcelas (o template precisa usar "parcelas"/"valor_total")
+CONSOLIDAR_POR_DESTINATARIO = os.environ.get('CONSOLIDAR_POR_DESTINATARIO', 'false').lower() == 'true'
+# Folga mantida antes do timeout da Lambda: o que não couber vai para o checkpoint
+ENVIO_MARGEM_SEGUNDOS = float(os.environ.get('ENVIO_MARGEM_SEGUNDOS', '30'))
+# Lotes Tenex adaptativos: o tamanho cresce/encolhe conforme latência, bytes da resposta e timeouts
+TENEX_LOTE_INICIAL = int(os.environ.get('TENEX_LOTE_INICIAL', '100'))
+TENEX_LOTE_MIN = int(os.environ.get('TENEX_LOTE_MIN', '10'))
+TENEX_LOTE_MAX = int(os.environ.get('TENEX_LOTE_MAX', '250'))
+TENEX_LATENCIA_ALVO = float(os.environ.get('TENEX_LATENCIA_ALVO', '15'))  # segundos por lote
+TENEX_BYTES_ALVO = int(os.environ.get('TENEX_BYTES_ALVO', str(5 * 1024 * 1024)))  # bytes por resposta
+TENEX_TIMEOUT = float(os.environ.get('TENEX_TIMEOUT', '60'))
+TENEX_MAX_TENTATIVAS = int(os.environ.get('TENEX_MAX_TENTATIVAS', '2'))
+# Com o circuito da Tenex aberto, espera o fim do intervalo e manda a sondagem (half-open) em vez de
+# desistir do sistema; limite em segundos somando as esperas da busca de um sistema
+TENEX_ESPERA_CIRCUITO_MAX = float(os.environ.get('TENEX_ESPERA_CIRCUITO_MAX', '90'))
+# Cache por cliente das parcelas Tenex (sobrevive entre invocações no mesmo container).
+# TTL em segundos; 0 = desabilitado. Com TENEX_CACHE_ARQUIVO (ex.: /tmp/tenex_cache.json) também é persistido em disco.
+TENEX_CACHE_TTL = int(os.environ.get('TENEX_CACHE_TTL', '0'))
+TENEX_CACHE_MAX_CLIENTES = int(os.environ.get('TENEX_CACHE_MAX_CLIENTES', '200000'))
+TENEX_CACHE_ARQUIVO = os.environ.get('TENEX_CACHE_ARQUIVO', '')
+# Cache negativo: por cliente, o dia em que ele volta a ter parcela pendente em alguma janela (derivado da lista
+# completa de parcelas que a Tenex devolve). Até lá o cliente não é consultado. Cada entrada vale de 1 a N dias
+# (escalonado por cliente) e então o cliente é consultado de novo, pegando vendas novas e renegociações. 0 = desabilitado.
+PROXIMO_VENCIMENTO_REVALIDAR_DIAS = int(os.environ.get('PROXIMO_VENCIMENTO_REVALIDAR_DIAS', '0'))
+PROXIMO_VENCIMENTO_ARQUIVO = os.environ.get('PROXIMO_VENCIMENTO_ARQUIVO', '/tmp/proximos_vencimentos.json')
+NOTIFICATION_FINALIZADO_URL = os.environ.get('NOTIFICATION_FINALIZADO_URL', "https://api.pushcut.io/-KVMKI_4PP5GMnuH0M9oz/notifications/Envio_Email_Finalizado")
 AIRTABLE_BASE_ID = 'app3SiNzJv7q5BDkV'
 CLIENTES_TABLE_ID = 'tbl8YhBey4l9cOqLT'
-TENEX_URL_CREDILLY = "https://credilly.tenex.com.br/api/v2/vendas/"
-TENEX_URL_TURING = "https://turing.tenex.com.br/api/v2/vendas/"
-AIRTABLE_BASE_URL = f"https://api.airtable.com/v0/{AIRTABLE_BASE_ID}"
+TENEX_URL_CREDILLY = os.environ.get('TENEX_URL_CREDILLY', "https://credilly.tenex.com.br/api/v2/vendas/")
+TENEX_URL_TURING = os.environ.get('TENEX_URL_TURING', "https://turing.tenex.com.br/api/v2/vendas/")
+AIRTABLE_API_URL = os.environ.get('AIRTABLE_API_URL', 'https://api.airtable.com/v0')
+# Fatias da tabela de clientes paginadas em paralelo (1 = paginação sequencial única) e teto de
+# requisições por segundo somando todas as fatias (o Airtable limita a 5/s por base)
+AIRTABLE_PARTICOES = int(os.environ.get('AIRTABLE_PARTICOES', '1'))
+AIRTABLE_REQ_POR_SEGUNDO = float(os.environ.get('AIRTABLE_REQ_POR_SEGUNDO', '5'))
+# Deixa fora do índice (e portanto da Tenex) os clientes sem e-mail no Airtable; em vez de um
+# "sem_email" por parcela, a execução registra um único resumo com o total e uma amostra de IDs
+IGNORAR_CLIENTES_SEM_EMAIL = os.environ.get('IGNORAR_CLIENTES_SEM_EMAIL', 'false').lower() == 'true'
+AIRTABLE_BASE_URL = f"{AIRTABLE_API_URL}/{AIRTABLE_BASE_ID}"
+
+# Circuit breaker por serviço externo: abre quando a taxa de falhas na janela recente passa do limite
+DISJUNTOR_JANELA = int(os.environ.get('DISJUNTOR_JANELA', '20'))  # últimas N chamadas consideradas
+DISJUNTOR_MIN_CHAMADAS = int(os.environ.get('DISJUNTOR_MIN_CHAMADAS', '5'))
+DISJUNTOR_TAXA_FALHA = float(os.environ.get('DISJUNTOR_TAXA_FALHA', '0.5'))
+DISJUNTOR_TEMPO_ABERTO = float(os.environ.get('DISJUNTOR_TEMPO_ABERTO', '30'))  # segundos até a sondagem (half-open)
+# Retry: tempo máximo gasto esperando entre tentativas somando todas as chamadas da execução
+RETRY_ORCAMENTO_EXECUCAO = float(os.environ.get('RETRY_ORCAMENTO_EXECUCAO', '120'))
+# Envios adiados (circuito SendGrid aberto) ficam aqui para a próxima invocação do mesmo dia
+CHECKPOINT_ARQUIVO = os.environ.get('CHECKPOINT_ARQUIVO', '/tmp/envio_checkpoint.json')
+# Biblioteca JSON de payloads, logs, respostas e armazém: auto (orjson > msgspec > json), orjson, msgspec ou json
+SERIALIZADOR_JSON = os.environ.get('SERIALIZADOR_JSON', 'auto').lower()
+# Orçamento de memória (MB de RSS). Acima dele, índice de clientes e parcelas classificadas passam para SQLite em /tmp.
+# Padrão: 70% da memória configurada na Lambda; 0 desabilita.
+MEMORIA_LIMITE_MB = float(os.environ.get('MEMORIA_LIMITE_MB', str(int(os.environ.get('AWS_LAMBDA_FUNCTION_MEMORY_SIZE', '0')) * 0.7)))
+MEMORIA_DIRETORIO_DESCARGA = os.environ.get('MEMORIA_DIRETORIO_DESCARGA', '/tmp')
+# Armazém SQLite da execução (clientes, parcelas, desfechos de envio). Serve de checkpoint para retomar
+# a execução do dia e fica em /tmp como artefato de depuração. Opt-in: ARMAZEM_EXECUCAO_ARQUIVO=/tmp/execucao.sqlite.
+# Vazio (padrão) = pipeline em memória + CHECKPOINT_ARQUIVO.
+ARMAZEM_EXECUCAO_ARQUIVO = os.environ.get('ARMAZEM_EXECUCAO_ARQUIVO', '')
+# Liga o tracemalloc para registrar o pico de alocações Python por estágio (tem custo de CPU; usar em diagnóstico)
+MEMORIA_TRACEMALLOC = os.environ.get('MEMORIA_TRACEMALLOC', 'false').lower() == 'true'
+# Cache compartilhado entre containers: s3://bucket/prefixo (S3 ou compatível) ou file:///diretorio (stand-in local).
+# Guarda o snapshot de clientes do Airtable, o cache Tenex, os próximos vencimentos, os vereditos de e-mail e
+# as parcelas já enviadas no dia, para que containers novos e invocações paralelas comecem quentes. Vazio = desligado.
+# O backend s3:// usa escrita condicional no PutObject (IfMatch / IfNoneMatch), que exige boto3/botocore >= 1.36;
+# com um boto3 ausente ou mais antigo o cache compartilhado é desligado no início da execução, com um aviso.
+CACHE_COMPARTILHADO_URL = os.environ.get('CACHE_COMPARTILHADO_URL', '')
+CACHE_COMPARTILHADO_ENDPOINT = os.environ.get('CACHE_COMPARTILHADO_ENDPOINT', '')  # ex.: http://localhost:9000; vazio = AWS
+# Idade máxima (s) do snapshot de clientes do Airtable reaproveitado; 0 = sempre pagina o Airtable (e publica o snapshot)
+CACHE_COMPARTILHADO_AIRTABLE_TTL = int(os.environ.get('CACHE_COMPARTILHADO_AIRTABLE_TTL', '900'))
 
 # Supabase (logs)
 SUPABASE_URL = os.environ.get('SUPABASE_URL', '')
 SUPABASE_KEY = os.environ.get('SUPABASE_KEY', '')  # service role ou anon conforme sua política
+# Logs que o Supabase não aceitou (falha, timeout, circuito aberto) vão para este NDJSON e são reenviados
+# em bloco no fim da execução (a desta ou a da próxima invocação). Vazio = sem spool: o log se perde.
+SUPABASE_SPOOL_ARQUIVO = os.environ.get('SUPABASE_SPOOL_ARQUIVO', '/tmp/supabase_spool.ndjson')
+# Com spool, o insert por e-mail é uma tentativa só com este timeout, para não segurar o envio
+SUPABASE_TIMEOUT = float(os.environ.get('SUPABASE_TIMEOUT', '5'))
+SUPABASE_LOTE_REENVIO = int(os.environ.get('SUPABASE_LOTE_REENVIO', '500'))
 
 # Headers
 headers_airtable = {"Authorization": f"Bearer {AIRTABLE_API_KEY}", "Content-Type": "application/json"}
 headers_sendgrid = {"Authorization": f"Bearer {SENDGRID_API_KEY}", "Content-Type": "application/json"}
 
-STATUS_PENDENTES = [1, 3, 5]
+STATUS_PENDENTES = frozenset({1, 3, 5})
+# Períodos de envio e seu deslocamento em dias a partir de hoje. Uma nova janela
+# (ex.: "vence_em_3_dias": 3) entra aqui, com template e assunto em montar_email_sendgrid.
+JANELAS_PERIODO = {"venceu_ontem": -1, "vence_hoje": 0, "vence_amanha": 1}
+# A partir de quantas parcelas em um lote a classificação usa o caminho colunar (NumPy, se instalado).
+# 0 = desabilitado: o caminho por lookup de string costuma ser mais rápido, pois achatar as colunas domina o custo.
+CLASSIFICACAO_COLUNAR_MIN = int(os.environ.get('CLASSIFICACAO_COLUNAR_MIN', '0'))
+
+def _carregar_fuso_sao_paulo():
+    """Carrega o fuso America/Sao_Paulo via zoneinfo. Sem base tz no runtime, usa UTC-3 fixo (sem horário de verão desde 2019)."""
+    if ZoneInfo is not None:
+        try:
+            return ZoneInfo('America/Sao_Paulo')
+        except ZoneInfoNotFoundError:
+            logging.warning("Base de fusos indisponível; usando UTC-3 fixo para America/Sao_Paulo.")
+    return timezone(timedelta(hours=-3), 'America/Sao_Paulo')
+
+FUSO_SAO_PAULO = _carregar_fuso_sao_paulo()
+
+# Relógio da execução: calculado uma vez por invocação (ver iniciar_relogio_execucao)
+_RELOGIO_EXECUCAO: Optional[Dict] = None
+
+class DisjuntorServico:
+    """
+    Circuit breaker de um serviço externo. Fechado: tudo passa e o resultado de cada chamada
+    entra numa janela deslizante. Se a taxa de falhas da janela atingir o limite, abre e recusa
+    chamadas por DISJUNTOR_TEMPO_ABERTO segundos; depois deixa passar uma única sondagem
+    (half-open), que fecha o circuito se der certo ou o reabre se falhar.
+    """
+
+    FECHADO, ABERTO, SEMIABERTO = "fechado", "aberto", "semiaberto"
+
+    def __init__(self, nome: str, janela: int = DISJUNTOR_JANELA, min_chamadas: int = DISJUNTOR_MIN_CHAMADAS,
+                 taxa_falha: float = DISJUNTOR_TAXA_FALHA, tempo_aberto: float = DISJUNTOR_TEMPO_ABERTO):
+        self.nome = nome
+        self.min_chamadas = min_chamadas
+        self.taxa_falha = taxa_falha
+        self.tempo_aberto = tempo_aberto
+        self.estado = self.FECHADO
+        self._resultados: deque = deque(maxlen=max(janela, 1))
+        self._aberto_em = 0.0
+        self._sondando = False
+        self._lock = threading.Lock()
+
+    def disponivel(self) -> bool:
+        """Indica, sem reservar nada, se uma chamada seria permitida agora."""
+        with self._lock:
+            if self.estado == self.ABERTO:
+                return time.monotonic() - self._aberto_em >= self.tempo_aberto
+            return not (self.estado == self.SEMIABERTO and self._sondando)
+
+    def segundos_para_sondagem(self) -> float:
+        """Quanto falta para o circuito aberto liberar a sondagem (0 se já liberaria)."""
+        with self._lock:
+            if self.estado != self.ABERTO:
+                return 0.0
+            return max(0.0, self.tempo_aberto - (time.monotonic() - self._aberto_em))
+
+    def permitir(self) -> bool:
+        """Deve ser chamado antes de cada chamada ao serviço; no half-open reserva a sondagem."""
+        with self._lock:
+            if self.estado == self.ABERTO:
+                if time.monotonic() - self._aberto_em < self.tempo_aberto:
+                    return False
+                self.estado = self.SEMIABERTO
+                self._sondando = False
+                logging.info(f"[DISJUNTOR] {self.nome}: semiaberto, enviando sondagem")
+            if self.estado == self.SEMIABERTO:
+                if self._sondando:
+                    return False
+                self._sondando = True
+            return True
+
+    def registrar_sucesso(self) -> None:
+        with self._lock:
+            if self.estado != self.FECHADO:
+                logging.info(f"[DISJUNTOR] {self.nome}: sondagem ok, circuito fechado")
+                self.estado = self.FECHADO
+                self._resultados.clear()
+            self._sondando = False
+            self._resultados.append(True)
+
+    def registrar_falha(self) -> None:
+        with self._lock:
+            self._sondando = False
+            if self.estado == self.SEMIABERTO:
+                self._abrir()
+                return
+            self._resultados.append(False)
+            falhas = self._resultados.count(False)
+            if self.estado == self.FECHADO and len(self._resultados) >= self.min_chamadas \
+                    and falhas / len(self._resultados) >= self.taxa_falha:
+                self._abrir()
+
+    def _abrir(self) -> None:
+        self.estado = self.ABERTO
+        self._aberto_em = time.monotonic()
+        logging.warning(f"[DISJUNTOR] {self.nome}: circuito ABERTO por {self.tempo_aberto:.0f}s")
+
+DISJUNTORES = {servico: DisjuntorServico(servico) for servico in ("sendgrid", "sendgrid_validacao", "tenex", "airtable", "supabase")}
+
+# Métricas da execução (contadores e gauges), zeradas a cada invocação e emitidas no relatório final
+METRICAS: Dict[str, float] = {}
+_METRICAS_LOCK = threading.Lock()
+
+def registrar_metrica(nome: str, valor: float = 1) -> None:
+    with _METRICAS_LOCK:
+        METRICAS[nome] = METRICAS.get(nome, 0) + valor
+
+def definir_metrica(nome: str, valor: float) -> None:
+    with _METRICAS_LOCK:
+        METRICAS[nome] = valor
+
+def reiniciar_metricas() -> None:
+    with _METRICAS_LOCK:
+        METRICAS.clear()
+
+def emitir_metricas() -> None:
+    with _METRICAS_LOCK:
+        snapshot = dict(sorted(METRICAS.items()))
+    logging.info(f"[METRICAS] {json.dumps(snapshot)}")
+
+def memoria_rss_mb() -> float:
+    """RSS atual do processo em MB (lido de /proc; 0 onde não houver /proc)."""
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            paginas = int(f.read().split()[1])
+        return paginas * os.sysconf('SC_PAGE_SIZE') / (1024 * 1024)
+    except (OSError, ValueError, IndexError):
+        return 0.0
+
+@contextmanager
+def medir_estagio(nome: str):
+    """
+    Mede um estágio do pipeline e registra em METRICAS: duração (estagio.<nome>.segundos), RSS ao
+    final (estagio.<nome>.rss_mb) e, com o tracemalloc ligado, o pico de alocações (estagio.<nome>.pico_mb).
+    """
+    if tracemalloc.is_tracing():
+        tracemalloc.reset_peak()
+    inicio = time.monotonic()
+    try:
+        yield
+    finally:
+        duracao = time.monotonic() - inicio
+        rss = memoria_rss_mb()
+        registrar_metrica(f"estagio.{nome}.segundos", round(duracao, 3))
+        definir_metrica(f"estagio.{nome}.rss_mb", round(rss, 1))
+        detalhe_pico = ""
+        if tracemalloc.is_tracing():
+            pico = tracemalloc.get_traced_memory()[1] / (1024 * 1024)
+            definir_metrica(f"estagio.{nome}.pico_mb", round(pico, 1))
+            detalhe_pico = f", pico Python {pico:.1f} MB"
+        logging.info(f"⏱️ Estágio {nome}: {duracao:.2f}s, RSS {rss:.1f} MB{detalhe_pico}")
+
+def memoria_acima_do_limite() -> bool:
+    return MEMORIA_LIMITE_MB > 0 and memoria_rss_mb() > MEMORIA_LIMITE_MB
+
+# Hosts de produção que o modo carga nunca pode atingir
+HOSTS_PRODUCAO = ("api.sendgrid.com", "api.airtable.com", "tenex.com.br", "pushcut.io", "supabase.co")
+
+def urls_producao_configuradas() -> List[str]:
+    """Lista as URLs base que ainda apontam para produção (usado para travar o modo carga)."""
+    urls = [SENDGRID_API_URL, AIRTABLE_API_URL, TENEX_URL_CREDILLY, TENEX_URL_TURING, NOTIFICATION_FINALIZADO_URL, SUPABASE_URL]
+    return [url for url in urls if url and any(host in url for host in HOSTS_PRODUCAO)]
+
+def interpretar_retry_after(valor: Optional[str]) -> Optional[float]:
+    """Converte o header Retry-After (segundos ou HTTP-date) em segundos de espera."""
+    if not valor:
+        return None
+    valor = valor.strip()
+    try:
+        return max(0.0, float(valor))
+    except ValueError:
+        pass
+    try:
+        quando = parsedate_to_datetime(valor)
+    except (TypeError, ValueError, IndexError):
+        return None
+    if quando is None:
+        return None
+    if quando.tzinfo is None:
+        quando = quando.replace(tzinfo=timezone.utc)
+    return max(0.0, (quando - datetime.now(timezone.utc)).total_seconds())
+
+class PoliticaRetry:
+    """
+    Política de retry de um serviço: backoff com jitter decorrelacionado, respeito ao Retry-After,
+    prazo por chamada e orçamento de espera compartilhado pela execução inteira.
+    """
+
+    # Tempo total de espera já consumido na execução (todas as políticas); zerado em reiniciar_orcamento
+    _gasto_execucao = 0.0
+    _lock = threading.Lock()
+
+    def __init__(self, servico: str, max_tentativas: int = 5, base: float = 1.0, teto: float = 30.0,
+                 prazo: float = 120.0, status_retentaveis: frozenset = frozenset({429, 500, 502, 503, 504}),
+                 usa_orcamento: bool = True):
+        self.servico = servico
+        self.max_tentativas = max_tentativas
+        self.base = base
+        self.teto = teto
+        self.prazo = prazo
+        self.status_retentaveis = status_retentaveis
+        # False: as esperas desta política não consomem (nem são limitadas por) RETRY_ORCAMENTO_EXECUCAO
+        self.usa_orcamento = usa_orcamento
+
+    @classmethod
+    def reiniciar_orcamento(cls) -> None:
+        with cls._lock:
+            cls._gasto_execucao = 0.0
+
+    @classmethod
+    def _reservar_orcamento(cls, espera: float) -> bool:
+        with cls._lock:
+            if cls._gasto_execucao + espera > RETRY_ORCAMENTO_EXECUCAO:
+                return False
+            cls._gasto_execucao += espera
+            return True
+
+    def proxima_espera(self, espera_anterior: float, retry_after: Optional[float] = None) -> float:
+        if retry_after is not None:
+            # O servidor pediu esse tempo: nunca encurtar (quem chama desiste se passar do teto ou do prazo)
+            return retry_after
+        # Decorrelated jitter: sorteia entre a base e 3x a espera anterior, limitado ao teto
+        return min(self.teto, random.uniform(self.base, max(self.base, espera_anterior * 3)))
+
+POLITICAS_RETRY = {
+    "sendgrid": PoliticaRetry("sendgrid", max_tentativas=5, base=1.0, teto=20.0, prazo=60.0),
+    # Validação de e-mail é acessória: poucas tentativas, sem gastar o orçamento de retry dos envios
+    "sendgrid_validacao": PoliticaRetry("sendgrid_validacao", max_tentativas=2, base=0.5, teto=2.0, prazo=10.0, usa_orcamento=False),
+    "tenex": PoliticaRetry("tenex", max_tentativas=TENEX_MAX_TENTATIVAS, base=1.0, teto=10.0, prazo=TENEX_TIMEOUT * TENEX_MAX_TENTATIVAS,
+                           status_retentaveis=frozenset({429, 502, 503})),
+    # Airtable pede 30s de espera após 429
+    "airtable": PoliticaRetry("airtable", max_tentativas=5, base=1.0, teto=30.0, prazo=120.0),
+    "supabase": PoliticaRetry("supabase", max_tentativas=2, base=0.5, teto=5.0, prazo=20.0),
+    "pushcut": PoliticaRetry("pushcut", max_tentativas=3, base=1.0, teto=5.0, prazo=20.0),
+}
+
+def _json_stdlib_codificar(obj) -> bytes:
+    return json.dumps(obj, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+
+def _escolher_serializador_json():
+    """(nome, codificar, decodificar) conforme SERIALIZADOR_JSON e as bibliotecas instaladas; cai no json da stdlib."""
+    if SERIALIZADOR_JSON in ('auto', 'orjson') and orjson is not None:
+        return "orjson", orjson.dumps, orjson.loads
+    if SERIALIZADOR_JSON in ('auto', 'msgspec') and msgspec is not None:
+        return "msgspec", msgspec.json.encode, msgspec.json.decode
+    return "json", _json_stdlib_codificar, json.loads
+
+# json_codificar(obj) -> bytes UTF-8 compactos; json_decodificar(bytes | str) -> objeto
+SERIALIZADOR_JSON_ATIVO, json_codificar, json_decodificar = _escolher_serializador_json()
+
+# Uma requests.Session por serviço, reaproveitada entre chamadas e entre invocações do mesmo container
+# (conexões keep-alive: DNS, TCP e TLS só na primeira requisição de cada host)
+SESSOES_HTTP: Dict[str, requests.Session] = {}
+_SESSOES_LOCK = threading.Lock()
+# Callbacks por serviço chamados a cada tentativa de requisitar_com_retry com (latência, status ou None)
+OBSERVADORES_REQUISICAO: Dict[str, Any] = {}
+
+def sessao_http(servico: str) -> requests.Session:
+    with _SESSOES_LOCK:
+        sessao = SESSOES_HTTP.get(servico)
+        if sessao is None:
+            sessao = requests.Session()
+            tamanho_pool = max(10, ENVIO_CONCORRENCIA, AIRTABLE_PARTICOES)
+            adaptador = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=tamanho_pool)
+            sessao.mount("https://", adaptador)
+            sessao.mount("http://", adaptador)
+            SESSOES_HTTP[servico] = sessao
+        return sessao
+
+class BackendCacheArquivos:
+    """Cache compartilhado num diretório (file:///dir): stand-in local do S3, com ETag = MD5 do conteúdo."""
+
+    def __init__(self, destino):
+        self.diretorio = destino.path
+
+    def _caminho(self, chave: str) -> str:
+        return os.path.join(self.diretorio, *chave.split("/"))
+
+    def ler(self, chave: str, etag: Optional[str] = None) -> Tuple[Optional[bytes], Optional[str]]:
+        """(conteúdo, etag); (None, etag) = não modificado desde `etag`; (None, None) = ausente."""
+        caminho = self._caminho(chave)
+        if not os.path.exists(caminho):
+            return None, None
+        with open(caminho, 'rb') as f:
+            dados = f.read()
+        atual = hashlib.md5(dados).hexdigest()
+        return (None, atual) if atual == etag else (dados, atual)
+
+    def escrever(self, chave: str, dados: bytes, se_etag: Optional[str] = None) -> Optional[str]:
+        """
+        Grava e devolve o novo etag; None se o objeto mudou desde `se_etag` ou, sem `se_etag`, se ele
+        já existe (criação exclusiva: o link do temporário falha se outro container criou antes).
+        """
+        caminho = self._caminho(chave)
+        os.makedirs(os.path.dirname(caminho), exist_ok=True)
+        if se_etag is not None and self.ler(chave)[1] not in (None, se_etag):
+            return None
+        temporario = f"{caminho}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temporario, 'wb') as f:
+            f.write(dados)
+        if se_etag is None:
+            try:
+                os.link(temporario, caminho)
+            except FileExistsError:
+                return None
+            finally:
+                os.remove(temporario)
+        else:
+            os.replace(temporario, caminho)
+        return hashlib.md5(dados).hexdigest()
+
+class BackendCacheS3:
+    """
+    Cache compartilhado em S3 ou compatível (CACHE_COMPARTILHADO_ENDPOINT): GET com If-None-Match,
+    PUT com If-Match (ou If-None-Match: * na criação).
+    """
+
+    VERSAO_MINIMA = "1.36"
+
+    def __init__(self, destino):
+        if boto3 is None:
+            raise RuntimeError(f"boto3 não instalado (requer boto3/botocore >= {self.VERSAO_MINIMA})")
+        self.bucket = destino.netloc
+        self.prefixo = f"{destino.path.strip('/')}/" if destino.path.strip('/') else ""
+        config = ConfigBotocore(connect_timeout=3, read_timeout=10, retries={"max_attempts": 2},
+                                s3={"addressing_style": "path"} if CACHE_COMPARTILHADO_ENDPOINT else None)
+        self.cliente = boto3.client("s3", endpoint_url=CACHE_COMPARTILHADO_ENDPOINT or None, config=config)
+        # Sem IfMatch/IfNoneMatch no modelo do PutObject o botocore rejeita os parâmetros (ou um S3 antigo os ignora)
+        # e a escrita deixaria de ser condicional: melhor não ter cache compartilhado do que sobrescrever o de outro container
+        parametros = self.cliente.meta.service_model.operation_model("PutObject").input_shape.members
+        if not {"IfMatch", "IfNoneMatch"} <= set(parametros):
+            raise RuntimeError(f"botocore {VERSAO_BOTOCORE} sem escrita condicional no PutObject "
+                               f"(requer boto3/botocore >= {self.VERSAO_MINIMA})")
+
+    @staticmethod
+    def _status(erro: ClientError) -> Tuple[Optional[str], Optional[int]]:
+        return erro.response.get("Error", {}).get("Code"), erro.response.get("ResponseMetadata", {}).get("HTTPStatusCode")
+
+    def ler(self, chave: str, etag: Optional[str] = None) -> Tuple[Optional[bytes], Optional[str]]:
+        parametros = {"Bucket": self.bucket, "Key": f"{self.prefixo}{chave}"}
+        if etag:
+            parametros["IfNoneMatch"] = etag
+        try:
+            resposta = self.cliente.get_object(**parametros)
+        except ClientError as e:
+            codigo, status = self._status(e)
+            if status == 304:
+                return None, etag
+            if status == 404 or codigo == "NoSuchKey":
+                return None, None
+            raise
+        return resposta["Body"].read(), resposta.get("ETag")
+
+    def escrever(self, chave: str, dados: bytes, se_etag: Optional[str] = None) -> Optional[str]:
+        parametros = {"Bucket": self.bucket, "Key": f"{self.prefixo}{chave}", "Body": dados, "ContentType": "application/octet-stream"}
+        if se_etag:
+            parametros["IfMatch"] = se_etag
+        else:
+            parametros["IfNoneMatch"] = "*"  # só cria: se outro container gravou antes, 412 e mescla
+        try:
+            resposta = self.cliente.put_object(**parametros)
+        except ClientError as e:
+            codigo, status = self._status(e)
+            if status in (409, 412) or codigo in ("PreconditionFailed", "ConditionalRequestConflict"):
+                return None
+            raise
+        return resposta.get("ETag")
+
+# Backends do cache compartilhado pelo esquema de CACHE_COMPARTILHADO_URL; um novo backend só precisa de ler/escrever
+BACKENDS_CACHE_COMPARTILHADO = {"s3": BackendCacheS3, "file": BackendCacheArquivos}
+
+class CacheCompartilhado:
+    """
+    Blobs compactos (JSON + zlib) com a versão do formato na chave. Leitura com GET condicional pelo
+    ETag da última leitura (304 devolve o objeto guardado em memória); escrita condicional ao ETag
+    conhecido e, se outro container gravou antes, relê, mescla (`mesclar(remoto, local)`) e tenta de
+    novo. Qualquer falha do backend só é registrada: o cache compartilhado nunca derruba a execução.
+    Um backend que não pode ser montado (esquema desconhecido, boto3 ausente ou sem escrita
+    condicional) desliga o cache no container, com um único aviso.
+    """
+
+    VERSAO = 1
+
+    def __init__(self, url: str = CACHE_COMPARTILHADO_URL):
+        self.url = url
+        self._backend = None
+        self._desligado = False
+        self._conhecidos: Dict[str, Tuple[Optional[str], Any]] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def habilitado(self) -> bool:
+        return bool(self.url) and not self._desligado
+
+    def verificar(self) -> bool:
+        """Monta o backend no início da execução; se não der, desliga o cache compartilhado. Devolve `habilitado`."""
+        if self.habilitado:
+            try:
+                self._obter_backend()
+            except Exception:
+                pass
+        return self.habilitado
+
+    def _obter_backend(self):
+        with self._lock:
+            if self._backend is None:
+                try:
+                    destino = urlparse(self.url)
+                    if destino.scheme not in BACKENDS_CACHE_COMPARTILHADO:
+                        raise ValueError(f"esquema não suportado em CACHE_COMPARTILHADO_URL: {destino.scheme}")
+                    self._backend = BACKENDS_CACHE_COMPARTILHADO[destino.scheme](destino)
+                except Exception as e:
+                    if not self._desligado:
+                        self._desligado = True
+                        logging.warning(f"[CACHE_COMPARTILHADO] Desligado neste container: {str(e)}")
+                    raise
+            return self._backend
+
+    def _chave(self, nome: str) -> str:
+        return f"v{self.VERSAO}/{nome}.json.z"
+
+    def obter(self, nome: str) -> Optional[Any]:
+        """Objeto publicado sob `nome`, ou None se ausente/indisponível. Não altere o objeto devolvido."""
+        if not self.habilitado:
+            return None
+        # O lock só protege _conhecidos: a ida ao backend acontece fora dele
+        with self._lock:
+            conhecido = self._conhecidos.get(nome)
+        try:
+            dados, etag = self._obter_backend().ler(self._chave(nome), conhecido[0] if conhecido else None)
+            if dados is None:
+                if etag is not None and conhecido is not None:
+                    registrar_metrica("cache_compartilhado.nao_modificados")
+                    return conhecido[1]
+                registrar_metrica("cache_compartilhado.ausentes")
+                with self._lock:
+                    self._conhecidos.pop(nome, None)
+                return None
+            objeto = json_decodificar(zlib.decompress(dados))
+        except Exception as e:
+            registrar_metrica("cache_compartilhado.falhas")
+            logging.warning(f"[CACHE_COMPARTILHADO] Falha ao ler {nome}: {str(e)}")
+            return None
+        with self._lock:
+            self._conhecidos[nome] = (etag, objeto)
+        registrar_metrica("cache_compartilhado.lidos")
+        registrar_metrica("cache_compartilhado.bytes_lidos", len(dados))
+        return objeto
+
+    def publicar(self, nome: str, objeto: Any, mesclar=None, tentativas: int = 3) -> bool:
+        """Grava `objeto` sob `nome`; com `mesclar`, o que outro container publicou antes é incorporado."""
+        if not self.habilitado:
+            return False
+        with self._lock:
+            desconhecido = nome not in self._conhecidos
+        if desconhecido:
+            remoto = self.obter(nome)
+            if remoto is not None and mesclar is not None:
+                objeto = mesclar(remoto, objeto)
+        for _ in range(tentativas):
+            dados = zlib.compress(json_codificar(objeto), 6)
+            with self._lock:
+                conhecido = self._conhecidos.get(nome)
+            try:
+                etag = self._obter_backend().escrever(self._chave(nome), dados, conhecido[0] if conhecido else None)
+            except Exception as e:
+                registrar_metrica("cache_compartilhado.falhas")
+                logging.warning(f"[CACHE_COMPARTILHADO] Falha ao gravar {nome}: {str(e)}")
+                return False
+            if etag is not None:
+                with self._lock:
+                    self._conhecidos[nome] = (etag, objeto)
+                registrar_metrica("cache_compartilhado.publicados")
+                registrar_metrica("cache_compartilhado.bytes_gravados", len(dados))
+                return True
+            registrar_metrica("cache_compartilhado.conflitos")
+            remoto = self.obter(nome)
+            if remoto is not None and mesclar is not None:
+                objeto = mesclar(remoto, objeto)
+        logging.warning(f"[CACHE_COMPARTILHADO] {nome} não publicado: conflitos de escrita persistentes")
+        return False
+
+CACHE_COMPARTILHADO = CacheCompartilhado()
+
+def requisitar_com_retry(servico: str, metodo: str, url: str, politica: Optional[PoliticaRetry] = None,
+                         contar_falhas_disjuntor: bool = True, **kwargs) -> Tuple[Optional[requests.Response], Optional[str]]:
+    """
+    Faz a requisição HTTP ao serviço aplicando sua PoliticaRetry e seu circuit breaker.
+    Retorna (response, None) quando houve resposta (qualquer status, inclusive o último retentável
+    após esgotar as tentativas) ou (None, motivo) quando nenhuma resposta pôde ser obtida. O Retry-After
+    é respeitado por inteiro: se passar do teto da política ou do prazo restante, a chamada desiste com
+    motivo "retry_after_excedido" (nada foi aceito pelo servidor; o envio pode ser adiado).
+    Com contar_falhas_disjuntor=False, as falhas não entram no circuit breaker (quem chama decide
+    quanto delas é do serviço); os sucessos continuam entrando.
+    """
+    politica = politica or POLITICAS_RETRY[servico]
+    disjuntor = DISJUNTORES.get(servico)
+    inicio = time.monotonic()
+    espera = politica.base
+    tentativa = 0
+    while True:
+        tentativa += 1
+        if disjuntor is not None and not disjuntor.permitir():
+            registrar_metrica(f"retry.{servico}.circuito_aberto")
+            return None, "circuito_aberto"
+        registrar_metrica(f"retry.{servico}.tentativas")
+        response = None
+        erro = None
+        inicio_tentativa = time.monotonic()
+        try:
+            response = sessao_http(servico).request(metodo, url, **kwargs)
+        except (requests.exceptions.Timeout, requests.exceptions.ConnectionError) as e:
+            erro = str(e)
+        except Exception as e:
+            if disjuntor is not None and contar_falhas_disjuntor:
+                disjuntor.registrar_falha()
+            logging.error("Erro inesperado na requisição %s: %s", servico, e)
+            return None, str(e)
+        observador = OBSERVADORES_REQUISICAO.get(servico)
+        if observador is not None:
+            observador(time.monotonic() - inicio_tentativa, response.status_code if response is not None else None)
+
+        falhou = response is None or response.status_code >= 500 or response.status_code == 429
+        if disjuntor is not None:
+            if not falhou:
+                disjuntor.registrar_sucesso()
+            elif contar_falhas_disjuntor:
+                disjuntor.registrar_falha()
+        if response is not None and response.status_code not in politica.status_retentaveis:
+            return response, None
+
+        motivo = erro or f"status {response.status_code}"
+        if tentativa >= politica.max_tentativas:
+            registrar_metrica(f"retry.{servico}.esgotado")
+            logging.error("Excedido número máximo de tentativas em %s (%s).", servico, motivo)
+            return response, None if response is not None else "max_retries_exceeded"
+        if disjuntor is not None and not disjuntor.disponivel():
+            registrar_metrica(f"retry.{servico}.circuito_aberto")
+            return None, "circuito_aberto"
+        retry_after = interpretar_retry_after(response.headers.get('Retry-After')) if response is not None else None
+        if retry_after is not None and (retry_after > politica.teto or time.monotonic() - inicio + retry_after > politica.prazo):
+            # Retentar antes do Retry-After só gastaria orçamento com outra recusa: o item é adiado por quem chamou
+            registrar_metrica(f"retry.{servico}.retry_after_excedido")
+            logging.error("%s pediu %.1fs de espera (Retry-After), acima do teto/prazo (%s).", servico, retry_after, motivo)
+            return None, "retry_after_excedido"
+        espera = politica.proxima_espera(espera, retry_after)
+        if time.monotonic() - inicio + espera > politica.prazo or (politica.usa_orcamento and not PoliticaRetry._reservar_orcamento(espera)):
+            registrar_metrica(f"retry.{servico}.prazo_esgotado")
+            logging.error("Prazo de retry esgotado em %s (%s).", servico, motivo)
+            return response, None if response is not None else "prazo_esgotado"
+        registrar_metrica(f"retry.{servico}.retentativas")
+        registrar_metrica(f"retry.{servico}.espera_s", espera)
+        logging.warning("%s %s. Retentando em %.1fs...", servico, motivo, espera)
+        time.sleep(espera)
 
 def send_notification(url: str):
-    response = requests.get(url)
-    if response.status_code == 200:
+    response, erro = requisitar_com_retry("pushcut", "GET", url, timeout=20)
+    if response is None:
+        logging.error(f"❌ Erro ao enviar notificação: {erro}")
+    elif response.status_code == 200:
         logging.info(f"✅ Notificação enviada para {url}")
     else:
         logging.error(f"❌ Erro ao enviar notificação: {response.status_code} - {response.text}")
 
+def iniciar_relogio_execucao(agora: Optional[datetime] = None) -> Dict:
+    """
+    Fixa o relógio da execução no fuso de São Paulo: agora, ontem/hoje/amanhã (date e ISO)
+    e a janela de envio permitida do dia. Deve ser chamado no início de cada invocação,
+    já que o módulo sobrevive entre execuções em containers quentes.
+    """
+    global _RELOGIO_EXECUCAO
+    agora = (agora or datetime.now(timezone.utc)).astimezone(FUSO_SAO_PAULO)
+    hoje = agora.date()
+    ontem = hoje - timedelta(days=1)
+    amanha = hoje + timedelta(days=1)
+    inicio_dia = datetime(hoje.year, hoje.month, hoje.day, tzinfo=FUSO_SAO_PAULO)
+    _RELOGIO_EXECUCAO = {
+        "agora": agora,
+        "hoje": hoje,
+        "ontem": ontem,
+        "amanha": amanha,
+        "hoje_iso": hoje.isoformat(),
+        "ontem_iso": ontem.isoformat(),
+        "amanha_iso": amanha.isoformat(),
+        # Data ISO de vencimento -> período; a classificação compara strings, sem parse
+        "periodos_por_data": {
+            (hoje + timedelta(days=deslocamento)).isoformat(): periodo
+            for periodo, deslocamento in JANELAS_PERIODO.items()
+        },
+        "janela_inicio": inicio_dia + timedelta(hours=HORARIO_INICIO),
+        "janela_fim": inicio_dia + timedelta(hours=HORARIO_FIM),
+    }
+    return _RELOGIO_EXECUCAO
+
+def relogio_execucao() -> Dict:
+    """Retorna o relógio da execução corrente, inicializando-o se necessário."""
+    return _RELOGIO_EXECUCAO or iniciar_relogio_execucao()
+
 def verificar_horario_permitido() -> bool:
-    tz = pytz.timezone('America/Sao_Paulo')
-    hora_atual = datetime.now(tz).hour
-    return HORARIO_INICIO <= hora_atual < HORARIO_FIM
+    relogio = relogio_execucao()
+    return relogio["janela_inicio"] <= relogio["agora"] < relogio["janela_fim"]
 
 def formatar_valor_moeda(valor: float) -> str:
     return f"R$ {valor:,.2f}".replace(",", "X").replace(".", ",").replace("X", ".")
@@ -100,6 +963,15 @@ def montar_email_sendgrid(email_destino: str, nome_destino: str, dados: Dict, ti
         'vence_hoje': f"Lembrete: sua parcela vence hoje ({valor_formatado})",
         'vence_amanha': f"Lembrete: sua parcela vence amanhã ({valor_formatado})",
     }
+    # E-mail consolidado: várias parcelas do mesmo destinatário; 'valor' já é o total
+    parcelas_consolidadas = dados.get('parcelas') or []
+    if len(parcelas_consolidadas) > 1:
+        quantidade = len(parcelas_consolidadas)
+        subject_map = {
+            'venceu_ontem': f"{quantidade} parcelas vencidas - ação necessária ({valor_formatado})",
+            'vence_hoje': f"Lembrete: {quantidade} parcelas vencem hoje ({valor_formatado})",
+            'vence_amanha': f"Lembrete: {quantidade} parcelas vencem amanhã ({valor_formatado})",
+        }
     subject_text = subject_map[tipo]
 
     template_id = template_map.get(tipo) or ''
@@ -141,6 +1013,10 @@ def montar_email_sendgrid(email_destino: str, nome_destino: str, dados: Dict, ti
             "subject": subject_text,
             "assunto": subject_text,
         }
+        if len(parcelas_consolidadas) > 1:
+            canonical_data["parcelas"] = parcelas_consolidadas
+            canonical_data["quantidade_parcelas"] = len(parcelas_consolidadas)
+            canonical_data["valor_total"] = valor_formatado
 
         # Mapeamento opcional via env: SENDGRID_TEMPLATE_FIELD_MAP (JSON)
         mapped_data = {}
@@ -180,13 +1056,20 @@ def montar_email_sendgrid(email_destino: str, nome_destino: str, dados: Dict, ti
             pass
     else:
         subject = subject_map[tipo]
+        if len(parcelas_consolidadas) > 1:
+            linhas_parcelas = [f"- {p['valor']} (vencimento {p['data_vencimento']}): {p.get('link_pagamento') or '—'}" for p in parcelas_consolidadas]
+            detalhe = [f"Identificamos {len(parcelas_consolidadas)} parcelas com o mesmo vencimento ({status_label}), total de {valor_formatado}:", *linhas_parcelas]
+        else:
+            detalhe = [
+                f"Identificamos que sua parcela {status_label}.",
+                f"- Valor: {valor_formatado}",
+                f"- Vencimento: {dados.get('data_vencimento')}",
+                f"- Link para pagamento: {dados.get('link_pagamento') or '—'}",
+            ]
         body_lines = [
             f"Olá {nome_destino},",
             "",
-            f"Identificamos que sua parcela {status_label}.",
-            f"- Valor: {valor_formatado}",
-            f"- Vencimento: {dados.get('data_vencimento')}",
-            f"- Link para pagamento: {dados.get('link_pagamento') or '—'}",
+            *detalhe,
             "",
             "Se já realizou o pagamento, desconsidere este e-mail.",
             "",
@@ -199,297 +1082,2081 @@ def montar_email_sendgrid(email_destino: str, nome_destino: str, dados: Dict, ti
     return payload
 
 
+# Falhas em que o SendGrid não aceitou o e-mail e vale tentar na próxima invocação em vez de registrar erro
+MOTIVOS_ADIAR_ENVIO = frozenset({"circuito_aberto", "retry_after_excedido"})
+
 def enviar_email_sendgrid(payload: Dict) -> Tuple[bool, Optional[int], Optional[str], Optional[str]]:
     """Envia o e-mail via SendGrid. Retorna (sucesso, status_code, message_id, error_message)."""
     if MODO_TESTE:
-        logging.info("[TESTE] Envio SendGrid simulado: assunto/templatedata prontos.")
+        log_item(logging.INFO, "envio_simulado", "[TESTE] Envio SendGrid simulado: assunto/templatedata prontos.")
         return True, 202, "TEST-MSG-ID", None
 
     if not SENDGRID_API_KEY:
         logging.error("SENDGRID_API_KEY não configurada.")
+        return False, None, None, "sendgrid_api_key_ausente"
+
+    url = f"{SENDGRID_API_URL}/mail/send"
+    response, erro = requisitar_com_retry("sendgrid", "POST", url, headers=headers_sendgrid, data=json_codificar(payload), timeout=30)
+    if response is None:
+        logging.error("Falha ao enviar e-mail: %s", erro)
+        return False, None, None, erro
+    if response.status_code == 202:
+        # SendGrid normalmente não retorna body; tentar header X-Message-Id
+        msg_id = response.headers.get('X-Message-Id') or response.headers.get('X-Message-ID')
+        return True, response.status_code, msg_id, None
+    logging.error("Falha ao enviar e-mail: %s - %s", response.status_code, response.text)
+    return False, response.status_code, None, response.text
+
+
+def criar_batch_sendgrid() -> Optional[str]:
+    """Cria um batch_id no SendGrid para agrupar (e poder cancelar) envios agendados."""
+    if MODO_TESTE:
+        logging.info("[TESTE] Criação de batch SendGrid simulada.")
+        return "TEST-BATCH-ID"
+    response, erro = requisitar_com_retry("sendgrid", "POST", f"{SENDGRID_API_URL}/mail/batch", headers=headers_sendgrid, timeout=30)
+    if response is None or response.status_code not in (200, 201):
+        detalhe = erro if response is None else f"{response.status_code} - {response.text}"
+        logging.error(f"❌ Falha ao criar batch no SendGrid: {detalhe}")
+        return None
+    return response.json().get("batch_id")
+
+def cancelar_batch_sendgrid(batch_id: str, status: str = "cancel") -> bool:
+    """Cancela (status=cancel) ou pausa (status=pause) os envios agendados de um batch."""
+    if MODO_TESTE:
+        logging.info(f"[TESTE] Cancelamento do batch {batch_id} simulado.")
+        return True
+    payload = {"batch_id": batch_id, "status": status}
+    response, erro = requisitar_com_retry("sendgrid", "POST", f"{SENDGRID_API_URL}/user/scheduled_sends", headers=headers_sendgrid,
+                                          data=json_codificar(payload), timeout=30)
+    if response is None or response.status_code not in (200, 201):
+        detalhe = erro if response is None else f"{response.status_code} - {response.text}"
+        logging.error(f"❌ Falha ao cancelar batch {batch_id}: {detalhe}")
         return False
+    logging.info(f"✅ Batch {batch_id} marcado como '{status}' no SendGrid")
+    return True
+
+def preparar_agendamento(total_envios: int) -> Optional[Dict]:
+    """
+    Monta o agendamento de uma preparação antecipada: batch_id e os horários de send_at,
+    distribuídos uniformemente a partir do início da janela (ou de agora + antecedência mínima).
+    """
+    relogio = relogio_execucao()
+    inicio = max(relogio["janela_inicio"].timestamp(), relogio["agora"].timestamp() + AGENDAMENTO_ANTECEDENCIA_MIN)
+    fim = min(relogio["janela_fim"].timestamp(), inicio + AGENDAMENTO_ESPALHAR_MINUTOS * 60)
+    if fim <= inicio:
+        logging.error("❌ Não há mais janela de envio hoje para agendar.")
+        return None
+    batch_id = criar_batch_sendgrid()
+    if not batch_id:
+        return None
+    return {
+        "batch_id": batch_id,
+        "inicio": inicio,
+        "passo": (fim - inicio) / max(total_envios, 1),
+        "proximo": 0,
+        "lock": threading.Lock(),
+    }
+
+def proximo_send_at(agendamento: Dict) -> int:
+    with agendamento["lock"]:
+        indice = agendamento["proximo"]
+        agendamento["proximo"] += 1
+    return int(agendamento["inicio"] + indice * agendamento["passo"])
+
+def marcar_dia_preparado(batch_id: str) -> None:
+    """Registra que os envios de hoje foram agendados no batch `batch_id` (em /tmp e no cache compartilhado)."""
+    if MODO_TESTE:
+        return
+    marca = {"data": relogio_execucao()["hoje_iso"], "batch_id": batch_id}
+    if AGENDAMENTO_MARCADOR_ARQUIVO:
+        try:
+            temporario = f"{AGENDAMENTO_MARCADOR_ARQUIVO}.tmp"
+            with open(temporario, 'w', encoding='utf-8') as f:
+                json.dump(marca, f)
+            os.replace(temporario, AGENDAMENTO_MARCADOR_ARQUIVO)
+        except Exception as e:
+            logging.error(f"[AGENDAMENTO] Falha ao gravar {AGENDAMENTO_MARCADOR_ARQUIVO}: {str(e)}")
+    CACHE_COMPARTILHADO.publicar(f"preparado_{marca['data']}", marca)
 
-    url = "https://api.sendgrid.com/v3/mail/send"
+def batch_preparado_hoje() -> Optional[str]:
+    """batch_id dos envios de hoje já agendados por uma preparação antecipada, ou None."""
+    if MODO_TESTE:
+        return None
+    hoje_iso = relogio_execucao()["hoje_iso"]
+    if AGENDAMENTO_MARCADOR_ARQUIVO and os.path.exists(AGENDAMENTO_MARCADOR_ARQUIVO):
+        try:
+            with open(AGENDAMENTO_MARCADOR_ARQUIVO, 'r', encoding='utf-8') as f:
+                marca = json.load(f)
+            if marca.get("data") == hoje_iso:
+                return marca.get("batch_id")
+        except Exception as e:
+            logging.warning(f"[AGENDAMENTO] Falha ao ler {AGENDAMENTO_MARCADOR_ARQUIVO}: {str(e)}")
+    marca = CACHE_COMPARTILHADO.obter(f"preparado_{hoje_iso}")
+    return marca.get("batch_id") if marca else None
 
-    # Política simples de retry para 429/5xx
-    tentativas = 0
-    atraso = 1.0
-    while tentativas < 5:
+def desmarcar_dia_preparado(batch_id: str) -> None:
+    """Desfaz a marca de hoje se ela aponta para `batch_id` (batch cancelado: a janela volta a enviar)."""
+    if batch_preparado_hoje() != batch_id:
+        return
+    if AGENDAMENTO_MARCADOR_ARQUIVO and os.path.exists(AGENDAMENTO_MARCADOR_ARQUIVO):
+        os.remove(AGENDAMENTO_MARCADOR_ARQUIVO)
+    CACHE_COMPARTILHADO.publicar(f"preparado_{relogio_execucao()['hoje_iso']}", {})
+
+EMAIL_REGEX = re.compile(r"^[a-z0-9!#$%&'*+/=?^_`{|}~-]+(\.[a-z0-9!#$%&'*+/=?^_`{|}~-]+)*@([a-z0-9]([a-z0-9-]{0,61}[a-z0-9])?\.)+[a-z]{2,}$")
+# Domínios digitados errado com frequência (nunca entregam)
+DOMINIOS_DIGITADOS_ERRADO = frozenset({
+    "gmial.com", "gmai.com", "gmail.con", "gmail.co", "gmail.com.br", "gamil.com", "gnail.com", "gmaill.com",
+    "hotmial.com", "hotmai.com", "hotmail.con", "hotmal.com", "hotmil.com",
+    "outlok.com", "outloo.com", "outlook.con", "yahoo.con", "yaho.com.br", "yahoo.com.b",
+})
+
+def normalizar_email(email: str) -> str:
+    """Normaliza o e-mail do Airtable: remove espaços, 'mailto:', <> e pontuação nas pontas; minúsculas."""
+    email = (email or "").strip()
+    if email.lower().startswith("mailto:"):
+        email = email[7:]
+    return email.strip(" <>.,;").lower()
+
+# Domínio -> motivo da invalidez (None = válido). Só resultados definitivos do DNS entram aqui
+_DOMINIOS_VERIFICADOS: Dict[str, Optional[str]] = {}
+
+def verificar_dominio_dns(dominio: str) -> Optional[str]:
+    """
+    Com dnspython, consulta os registros MX (sem MX, vale o A/AAAA do próprio domínio, o MX implícito
+    da RFC 5321); sem ele, só verifica se o domínio resolve para um host. Retorna o motivo da
+    invalidez, None se o domínio aceita e-mail ou "" se a resposta não foi conclusiva (falha
+    temporária do resolvedor), caso em que o endereço é aceito e nada fica em cache.
+    """
+    if dns is not None:
         try:
-            response = requests.post(url, headers=headers_sendgrid, json=payload, timeout=30)
-            if response.status_code == 202:
-                # SendGrid normalmente não retorna body; tentar header X-Message-Id
-                msg_id = response.headers.get('X-Message-Id') or response.headers.get('X-Message-ID')
-                return True, response.status_code, msg_id, None
-            if response.status_code in (429, 500, 502, 503, 504):
-                retry_after = response.headers.get('Retry-After')
-                espera = float(retry_after) if retry_after and retry_after.isdigit() else atraso
-                logging.warning(f"SendGrid {response.status_code}. Retentando em {espera:.1f}s...")
-                time.sleep(espera)
-                tentativas += 1
-                atraso *= 2
-                continue
-            logging.error(f"Falha ao enviar e-mail: {response.status_code} - {response.text}")
-            return False, response.status_code, None, response.text
-        except (requests.exceptions.Timeout, requests.exceptions.ConnectionError) as e:
-            logging.warning(f"Exceção de rede no envio: {str(e)}. Retentando em {atraso:.1f}s...")
-            time.sleep(atraso)
-            tentativas += 1
-            atraso *= 2
+            dns.resolver.resolve(dominio, "MX", lifetime=5)
+            return None
+        except dns.resolver.NXDOMAIN:
+            return "dominio_inexistente"
+        except dns.resolver.NoAnswer:
+            pass  # sem MX: cai na verificação do host
+        except dns.exception.DNSException:
+            return ""
+    try:
+        socket.getaddrinfo(dominio, 25, proto=socket.IPPROTO_TCP)
+        return None
+    except socket.gaierror as e:
+        if e.errno in (socket.EAI_NONAME, getattr(socket, "EAI_NODATA", socket.EAI_NONAME)):
+            return "dominio_inexistente" if dns is None else "dominio_sem_mx"
+        return ""  # EAI_AGAIN e afins: o resolvedor falhou, não o domínio
+    except OSError:
+        return ""
+
+def validar_email_local(email: str) -> Optional[str]:
+    """Heurísticas locais. Retorna o motivo da invalidez ou None se o endereço parece válido (ou não deu para saber)."""
+    if not EMAIL_REGEX.match(email) or len(email) > 254 or ".." in email:
+        return "sintaxe_invalida"
+    dominio = email.rsplit("@", 1)[1]
+    if dominio in DOMINIOS_DIGITADOS_ERRADO:
+        return "dominio_digitado_errado"
+    if VALIDACAO_EMAIL_DNS:
+        if dominio not in _DOMINIOS_VERIFICADOS:
+            motivo = verificar_dominio_dns(dominio)
+            if motivo == "":
+                registrar_metrica("validacao_email.dns_inconclusivo")
+                return None
+            _DOMINIOS_VERIFICADOS[dominio] = motivo
+        return _DOMINIOS_VERIFICADOS[dominio]
+    return None
+
+def validar_email_sendgrid(email: str) -> Optional[Tuple[bool, str]]:
+    """
+    Consulta a Email Validation API (serviço "sendgrid_validacao": disjuntor e política próprios, sem
+    afetar os envios). Retorna (valido, veredito) ou None se não foi possível validar.
+    """
+    headers = {"Authorization": f"Bearer {SENDGRID_VALIDATION_API_KEY}", "Content-Type": "application/json"}
+    response, erro = requisitar_com_retry("sendgrid_validacao", "POST", f"{SENDGRID_API_URL}/validations/email", headers=headers,
+                                          data=json_codificar({"email": email, "source": "cobranca"}), timeout=10)
+    if response is None or response.status_code != 200:
+        detalhe = erro if response is None else response.status_code
+        log_item(logging.WARNING, "validacao_falha", "[VALIDACAO] Falha ao validar %s no SendGrid: %s", email, detalhe)
+        return None
+    veredito = (response.json().get("result") or {}).get("verdict", "")
+    # "Risky" ainda é enviado; só "Invalid" bloqueia
+    return veredito.lower() != "invalid", veredito.lower()
+
+class CacheVereditosEmail:
+    """Vereditos de validação por e-mail normalizado, com TTL, persistidos em JSON em /tmp."""
+
+    def __init__(self, arquivo: str = VALIDACAO_EMAIL_CACHE_ARQUIVO, ttl: int = VALIDACAO_EMAIL_CACHE_TTL):
+        self.arquivo = arquivo
+        self.ttl = ttl
+        self._vereditos: Dict[str, List] = {}
+        self._carregado = False
+        self._alterado = False
+
+    def _carregar(self) -> None:
+        if self._carregado:
+            return
+        self._carregado = True
+        if not self.arquivo or not os.path.exists(self.arquivo):
+            return
+        try:
+            with open(self.arquivo, 'r', encoding='utf-8') as f:
+                self._vereditos = json.load(f)
         except Exception as e:
-            logging.error(f"Erro inesperado no envio: {str(e)}")
-            return False, None, None, str(e)
-    logging.error("Excedido número máximo de tentativas no SendGrid.")
-    return False, None, None, "max_retries_exceeded"
+            logging.warning(f"[VALIDACAO] Falha ao ler {self.arquivo}: {str(e)}")
+
+    def obter(self, email: str) -> Optional[Tuple[bool, str]]:
+        self._carregar()
+        item = self._vereditos.get(email)
+        if item is None or time.time() - item[2] > self.ttl:
+            return None
+        return item[0], item[1]
+
+    def gravar(self, email: str, valido: bool, motivo: str) -> None:
+        self._carregar()
+        self._vereditos[email] = [valido, motivo, time.time()]
+        self._alterado = True
 
+    def _mesclar(self, vereditos: Dict[str, List]) -> Dict[str, List]:
+        """Incorpora vereditos de outro container mais novos que os locais; devolve todos os vereditos."""
+        for email, item in vereditos.items():
+            atual = self._vereditos.get(email)
+            if atual is None or atual[2] < item[2]:
+                self._vereditos[email] = item
+        return self._vereditos
+
+    def sincronizar_compartilhado(self) -> None:
+        if not CACHE_COMPARTILHADO.habilitado:
+            return
+        self._carregar()
+        vereditos = CACHE_COMPARTILHADO.obter("vereditos_email")
+        if vereditos:
+            self._mesclar(vereditos)
+
+    def invalidos(self) -> set:
+        """Conjunto de supressão: e-mails com veredito inválido ainda vigente."""
+        self._carregar()
+        agora = time.time()
+        return {email for email, (valido, _, gravado_em) in self._vereditos.items() if not valido and agora - gravado_em <= self.ttl}
+
+    def salvar(self) -> None:
+        if not self._alterado:
+            return
+        agora = time.time()
+        vigentes = {email: item for email, item in self._vereditos.items() if agora - item[2] <= self.ttl}
+        if self.arquivo:
+            try:
+                temporario = f"{self.arquivo}.tmp"
+                with open(temporario, 'w', encoding='utf-8') as f:
+                    json.dump(vigentes, f, separators=(',', ':'))
+                os.replace(temporario, self.arquivo)
+            except Exception as e:
+                logging.warning(f"[VALIDACAO] Falha ao gravar {self.arquivo}: {str(e)}")
+        CACHE_COMPARTILHADO.publicar("vereditos_email", vigentes, mesclar=lambda remoto, _local: self._mesclar(remoto))
+        self._alterado = False
+
+CACHE_VEREDITOS_EMAIL = CacheVereditosEmail()
+
+def validar_emails_em_lote(todas_parcelas: Dict[str, List[Tuple[Dict, Dict, str, str]]]) -> Dict[str, Optional[str]]:
+    """
+    Valida uma única vez cada e-mail distinto da execução: heurísticas locais, depois o cache de
+    vereditos e, só para o que não estiver em cache, a Email Validation API do SendGrid (até
+    VALIDACAO_EMAIL_MAX_REMOTAS consultas, VALIDACAO_EMAIL_CONCORRENCIA em paralelo, por no máximo
+    VALIDACAO_EMAIL_PRAZO_SEGUNDOS). Sem resposta da API o e-mail é aceito.
+    Retorna e-mail normalizado -> motivo da invalidez (None = válido).
+    """
+    emails = set()
+    for itens in todas_parcelas.values():
+        for item in itens:
+            email = normalizar_email(item[1]['fields'].get('Email', ''))
+            if email:
+                emails.add(email)
+    resultado: Dict[str, Optional[str]] = {}
+    a_consultar = []
+    for email in emails:
+        motivo = validar_email_local(email)
+        if motivo:
+            resultado[email] = motivo
+            continue
+        em_cache = CACHE_VEREDITOS_EMAIL.obter(email)
+        if em_cache is not None:
+            resultado[email] = None if em_cache[0] else em_cache[1]
+            continue
+        resultado[email] = None
+        a_consultar.append(email)
+    consultas_remotas = 0
+    if SENDGRID_VALIDATION_API_KEY and not MODO_TESTE and a_consultar:
+        a_consultar = a_consultar[:VALIDACAO_EMAIL_MAX_REMOTAS]
+        executor = ThreadPoolExecutor(max_workers=max(1, VALIDACAO_EMAIL_CONCORRENCIA), thread_name_prefix="validacao")
+        disjuntor = DISJUNTORES["sendgrid_validacao"]
+
+        def consultar(email: str) -> Optional[Tuple[bool, str]]:
+            # Com o circuito aberto as consultas restantes nem saem: o e-mail é aceito
+            return validar_email_sendgrid(email) if disjuntor.disponivel() else None
+        futuros = {executor.submit(consultar, email): email for email in a_consultar}
+        concluidos, pendentes = wait(futuros, timeout=VALIDACAO_EMAIL_PRAZO_SEGUNDOS)
+        executor.shutdown(wait=False, cancel_futures=True)
+        if pendentes:
+            registrar_metrica("validacao_email.prazo_esgotado", len(pendentes))
+            logging.warning(f"[VALIDACAO] Prazo de {VALIDACAO_EMAIL_PRAZO_SEGUNDOS:.0f}s esgotado; {len(pendentes)} e-mails aceitos sem validação remota")
+        for futuro in concluidos:
+            remoto = futuro.result()
+            if remoto is None:
+                continue
+            consultas_remotas += 1
+            email = futuros[futuro]
+            CACHE_VEREDITOS_EMAIL.gravar(email, remoto[0], remoto[1])
+            resultado[email] = None if remoto[0] else remoto[1]
+    CACHE_VEREDITOS_EMAIL.salvar()
+    invalidos = sum(1 for motivo in resultado.values() if motivo)
+    registrar_metrica("validacao_email.consultas_remotas", consultas_remotas)
+    registrar_metrica("validacao_email.invalidos", invalidos)
+    logging.info(f"📮 {len(emails)} e-mails distintos validados: {invalidos} inválidos, {consultas_remotas} consultas remotas")
+    return resultado
+
+# Insert de um log durante o envio quando há spool: sem retry, quem falhar vai para o spool
+POLITICA_SUPABASE_ENVIO = PoliticaRetry("supabase", max_tentativas=1, prazo=SUPABASE_TIMEOUT)
+_SPOOL_SUPABASE_LOCK = threading.Lock()
+
+def _inserir_supabase(registros, politica: Optional[PoliticaRetry] = None, timeout: float = 20) -> Tuple[bool, bool, str]:
+    """
+    POST em email_disparo_logs (um objeto ou uma lista, insert em bloco).
+    Retorna (ok, retentável, detalhe); retentável = sem resposta, 5xx ou 429.
+    """
+    url = f"{SUPABASE_URL}/rest/v1/email_disparo_logs"
+    headers = {
+        "apikey": SUPABASE_KEY,
+        "Authorization": f"Bearer {SUPABASE_KEY}",
+        "Content-Type": "application/json",
+        "Prefer": "return=minimal",
+    }
+    resp, erro = requisitar_com_retry("supabase", "POST", url, politica=politica, headers=headers,
+                                      data=json_codificar(registros), timeout=timeout)
+    if resp is None:
+        return False, True, erro or "sem resposta"
+    if resp.status_code in (200, 201, 204):
+        return True, False, ""
+    snippet = resp.text[:300] if resp.text else ""
+    return False, resp.status_code >= 500 or resp.status_code == 429, f"{resp.status_code} {snippet}"
+
+def guardar_no_spool_supabase(registros: List[Dict]) -> None:
+    """Acrescenta registros ao spool NDJSON (uma linha por registro)."""
+    linhas = b"".join(json_codificar(registro) + b"\n" for registro in registros)
+    with _SPOOL_SUPABASE_LOCK:
+        with open(SUPABASE_SPOOL_ARQUIVO, "ab") as f:
+            f.write(linhas)
 
 def log_disparo_supabase(record: Dict) -> None:
-    """Insere um registro de log no Supabase. Silencioso em caso de erro."""
+    """Insere um registro de log no Supabase. Se o insert falhar por indisponibilidade, o registro vai para o spool."""
     if not SUPABASE_URL or not SUPABASE_KEY:
-        logging.info("[LOG] SUPABASE_URL/SUPABASE_KEY ausentes; pulando registro de log.")
+        log_item(logging.INFO, "supabase_ausente", "[LOG] SUPABASE_URL/SUPABASE_KEY ausentes; pulando registro de log.")
         return
     try:
-        url = f"{SUPABASE_URL}/rest/v1/email_disparo_logs"
-        headers = {
-            "apikey": SUPABASE_KEY,
-            "Authorization": f"Bearer {SUPABASE_KEY}",
-            "Content-Type": "application/json",
-            "Prefer": "return=minimal",
-        }
-        resp = requests.post(url, headers=headers, data=json.dumps(record), timeout=20)
-        if resp.status_code not in (200, 201, 204):
-            snippet = resp.text[:300] if resp.text else ""
-            logging.warning(f"[LOG] Falha ao inserir log no Supabase: {resp.status_code} {snippet}")
+        if SUPABASE_SPOOL_ARQUIVO:
+            ok, retentavel, detalhe = _inserir_supabase(record, POLITICA_SUPABASE_ENVIO, SUPABASE_TIMEOUT)
+        else:
+            ok, retentavel, detalhe = _inserir_supabase(record)
+        if ok:
+            return
+        if retentavel and SUPABASE_SPOOL_ARQUIVO:
+            guardar_no_spool_supabase([record])
+            registrar_metrica("supabase.spool")
+            log_item(logging.WARNING, "supabase_spool", "[LOG] Supabase indisponível (%s); log guardado no spool", detalhe)
+        else:
+            logging.warning("[LOG] Falha ao inserir log no Supabase: %s", detalhe)
     except Exception as e:
-        logging.warning(f"[LOG] Exceção ao registrar log no Supabase: {str(e)}")
+        logging.warning("[LOG] Exceção ao registrar log no Supabase: %s", e)
 
-def buscar_todos_clientes_airtable() -> Dict[str, Dict]:
-    logging.info("📥 Buscando clientes do Airtable...")
-    clientes_dict = {}
+def reenviar_spool_supabase(prazo: Optional[float] = None) -> int:
+    """
+    Reenvia o spool em inserts de até SUPABASE_LOTE_REENVIO registros (agrupados pelo mesmo conjunto de
+    campos, como o PostgREST exige). O spool é movido para "<arquivo>.reenvio" antes de ler, então logs
+    novos seguem sendo acrescentados; o que não entrar (falha, circuito aberto, prazo) volta ao spool.
+    Uma linha truncada (invocação morta no meio da escrita) é descartada. Retorna quantos entraram.
+    """
+    if not SUPABASE_SPOOL_ARQUIVO or not SUPABASE_URL or not SUPABASE_KEY:
+        return 0
+    em_reenvio = f"{SUPABASE_SPOOL_ARQUIVO}.reenvio"
+    try:
+        with _SPOOL_SUPABASE_LOCK:
+            if os.path.exists(SUPABASE_SPOOL_ARQUIVO):
+                # Sobras de um reenvio interrompido ficam na frente
+                with open(SUPABASE_SPOOL_ARQUIVO, "rb") as origem, open(em_reenvio, "ab") as destino:
+                    destino.write(origem.read())
+                os.remove(SUPABASE_SPOOL_ARQUIVO)
+            if not os.path.exists(em_reenvio):
+                return 0
+        registros = []
+        with open(em_reenvio, "rb") as f:
+            for linha in f:
+                try:
+                    registros.append(json_decodificar(linha))
+                except Exception:  # ValueError (json/orjson) ou msgspec.DecodeError
+                    registrar_metrica("supabase.spool_descartados")
+    except OSError as e:
+        logging.warning("[LOG] Falha ao ler o spool %s: %s", SUPABASE_SPOOL_ARQUIVO, e)
+        return 0
+    grupos: Dict[Tuple[str, ...], List[Dict]] = {}
+    for registro in registros:
+        grupos.setdefault(tuple(sorted(registro)), []).append(registro)
+    reenviados = 0
+    sobras: List[Dict] = []
+    for grupo in grupos.values():
+        for i in range(0, len(grupo), SUPABASE_LOTE_REENVIO):
+            lote = grupo[i:i + SUPABASE_LOTE_REENVIO]
+            if sobras or (prazo is not None and time.monotonic() >= prazo):
+                sobras.extend(lote)
+                continue
+            ok, retentavel, detalhe = _inserir_supabase(lote)
+            if ok:
+                reenviados += len(lote)
+            elif retentavel:
+                logging.warning("[LOG] Reenvio do spool interrompido: %s", detalhe)
+                sobras.extend(lote)
+            else:
+                # Rejeição do próprio Supabase (ex.: 400 de esquema): reenviar não adianta
+                logging.error("❌ [LOG] Supabase recusou %s logs do spool: %s", len(lote), detalhe)
+                registrar_metrica("supabase.spool_descartados", len(lote))
+    try:
+        if sobras:
+            guardar_no_spool_supabase(sobras)
+        os.remove(em_reenvio)
+    except OSError as e:
+        logging.warning("[LOG] Falha ao atualizar o spool %s: %s", SUPABASE_SPOOL_ARQUIVO, e)
+    registrar_metrica("supabase.reenviados", reenviados)
+    if registros:
+        logging.info("📤 Spool do Supabase: %s de %s logs reenviados, %s pendentes", reenviados, len(registros), len(sobras))
+    return reenviados
+
+# Campo do Airtable com o id do cliente em cada sistema Tenex
+CAMPOS_ID_SISTEMA = {"credilly": "ID Credilly", "turing": "ID Turing"}
+
+class LimitadorTaxa:
+    """Espaça chamadas feitas por várias threads para no máximo `por_segundo` requisições por segundo no total."""
+
+    def __init__(self, por_segundo: float):
+        self.intervalo = 1.0 / por_segundo if por_segundo > 0 else 0.0
+        self._proxima = 0.0
+        self._lock = threading.Lock()
+
+    def aguardar(self) -> None:
+        if not self.intervalo:
+            return
+        with self._lock:
+            agora = time.monotonic()
+            espera = self._proxima - agora
+            self._proxima = max(agora, self._proxima) + self.intervalo
+        if espera > 0:
+            time.sleep(espera)
+
+# Caracteres após o prefixo "rec" dos IDs de registro do Airtable; as fatias dividem este alfabeto
+ALFABETO_RECORD_ID = string.digits + string.ascii_uppercase + string.ascii_lowercase
+
+def formulas_particao_airtable(particoes: int) -> List[Optional[str]]:
+    """
+    filterByFormula de cada fatia: faixas disjuntas do primeiro caractere do RECORD_ID(), que juntas
+    cobrem a tabela inteira sem depender de campos preenchidos. Com 1 partição, uma fatia sem filtro.
+    """
+    if particoes <= 1:
+        return [None]
+    tamanho = -(-len(ALFABETO_RECORD_ID) // min(particoes, len(ALFABETO_RECORD_ID)))
+    return [f"REGEX_MATCH(RECORD_ID(), '^rec[{ALFABETO_RECORD_ID[i:i + tamanho]}]')"
+            for i in range(0, len(ALFABETO_RECORD_ID), tamanho)]
+
+def _paginar_clientes_airtable(formula: Optional[str], limitador: LimitadorTaxa) -> Tuple[List[Dict], bool]:
+    """
+    Pagina uma fatia da tabela de clientes pelo cursor offset. Retorna (registros, completa): em erro,
+    devolve o que já foi lido com completa=False.
+    """
+    registros = []
     offset = None
     while True:
         params = {"pageSize": 100}
+        if formula:
+            params["filterByFormula"] = formula
         if offset:
             params["offset"] = offset
         url = f"{AIRTABLE_BASE_URL}/{CLIENTES_TABLE_ID}"
-        response = requests.get(url, headers=headers_airtable, params=params)
+        limitador.aguardar()
+        response, erro = requisitar_com_retry("airtable", "GET", url, headers=headers_airtable, params=params, timeout=30)
+        if response is None:
+            logging.error(f"❌ Erro ao buscar clientes{f' ({formula})' if formula else ''}: {erro}")
+            return registros, False
         if response.status_code == 200:
-            data = response.json()
-            records = data.get("records", [])
-            for record in records:
-                fields = record['fields']
-                id_credilly = fields.get('ID Credilly', '')
-                if id_credilly:
-                    clientes_dict[f"CRED-{id_credilly}"] = record
-                id_turing = fields.get('ID Turing', '')
-                if id_turing:
-                    clientes_dict[f"TUR-{id_turing}"] = record
+            data = json_decodificar(response.content)
+            registros.extend(data.get("records", []))
             if "offset" not in data:
-                break
+                return registros, True
             offset = data["offset"]
         else:
-            logging.error(f"❌ Erro ao buscar clientes: {response.text}")
-            break
-    logging.info(f"✅ {len(clientes_dict)} IDs de clientes indexados")
-    return clientes_dict
-
-def fetch_tenex_lote(url, api_key, params):
-    logging.info(f"Tentando requisição para {url} com params: {params}")
-    tentativas = 0
-    atraso = 1.0
-    while tentativas < 5:
+            logging.error(f"❌ Erro ao buscar clientes{f' ({formula})' if formula else ''}: {response.text}")
+            return registros, False
+
+# Campos do Airtable lidos pelo pipeline; o snapshot compartilhado guarda só estes
+CAMPOS_AIRTABLE_USADOS = ("Email", "Nome do cliente", *CAMPOS_ID_SISTEMA.values())
+
+def compactar_registro_airtable(record: Dict) -> Dict:
+    fields = record.get('fields', {})
+    return {"id": record.get('id'), "fields": {campo: fields[campo] for campo in CAMPOS_AIRTABLE_USADOS if campo in fields}}
+
+def registrar_resumo_sem_email(sem_email: Dict[str, List[str]]) -> None:
+    """
+    Resumo único da execução com os clientes sem e-mail que ficaram fora da consulta à Tenex: métricas,
+    uma linha de log e um registro agregado em email_disparo_logs (status "sem_email_resumo", com a
+    quantidade e os IDs do Airtable por sistema em request_payload).
+    """
+    ids_airtable = list(dict.fromkeys(id_airtable for ids in sem_email.values() for id_airtable in ids))
+    for sistema, ids in sem_email.items():
+        definir_metrica(f"clientes.sem_email_ignorados.{sistema}", len(ids))
+    if not ids_airtable:
+        return
+    logging.warning(f"📵 {len(ids_airtable)} clientes sem e-mail no Airtable não consultados na Tenex "
+                    f"({', '.join(f'{sistema}: {len(ids)}' for sistema, ids in sem_email.items())})",
+                    extra={"campos": {"evento": "sem_email_resumo", "total": len(ids_airtable), "amostra_airtable_ids": ids_airtable[:50]}})
+    # Os "sem_email" por parcela deixam de existir: uma linha agregada por execução mantém a auditoria
+    log_disparo_supabase({
+        "sistema": ",".join(sistema for sistema, ids in sem_email.items() if ids),
+        "periodo": None,
+        "cliente_airtable_id": None,
+        "cliente_sistema_id": None,
+        "nome": None,
+        "email": None,
+        "valor_parcela": None,
+        "data_vencimento": relogio_execucao()["hoje_iso"],
+        "link_pagamento": None,
+        "status": "sem_email_resumo",
+        "sendgrid_status": None,
+        "sendgrid_message_id": None,
+        "error_message": "clientes_sem_email_ignorados",
+        "request_payload": {
+            "total": len(ids_airtable),
+            "por_sistema": {sistema: {"quantidade": len(ids), "cliente_airtable_ids": ids} for sistema, ids in sem_email.items() if ids},
+        },
+    })
+
+def buscar_todos_clientes_airtable() -> Dict[str, Dict[str, Dict]]:
+    """
+    Pagina a tabela de clientes e indexa cada registro, numa única passada, por sistema e id:
+    {"credilly": {id: registro}, "turing": {id: registro}}. Um cliente nos dois sistemas é o mesmo objeto.
+    Com AIRTABLE_PARTICOES > 1, as fatias são paginadas em paralelo sob um limite de taxa comum e
+    mescladas na ordem das fatias (o índice sai igual a cada execução). Com IGNORAR_CLIENTES_SEM_EMAIL,
+    clientes sem e-mail não entram no índice. Com o cache compartilhado, um snapshot publicado há menos de
+    CACHE_COMPARTILHADO_AIRTABLE_TTL segundos substitui a paginação; senão, o resultado vira o novo snapshot
+    (só se todas as fatias chegaram à última página).
+    """
+    logging.info("📥 Buscando clientes do Airtable...")
+    clientes_por_sistema: Dict[str, Dict[str, Dict]] = {sistema: {} for sistema in CAMPOS_ID_SISTEMA}
+    fatias = None
+    usar_snapshot = CACHE_COMPARTILHADO.habilitado and CACHE_COMPARTILHADO_AIRTABLE_TTL > 0
+    if usar_snapshot:
+        snapshot = CACHE_COMPARTILHADO.obter("airtable_clientes")
+        if snapshot and time.time() - snapshot["gerado_em"] <= CACHE_COMPARTILHADO_AIRTABLE_TTL:
+            fatias = [snapshot["registros"]]
+            logging.info(f"  → snapshot compartilhado de {time.time() - snapshot['gerado_em']:.0f}s atrás ({len(snapshot['registros'])} registros)")
+    if fatias is None:
+        formulas = formulas_particao_airtable(AIRTABLE_PARTICOES)
+        limitador = LimitadorTaxa(AIRTABLE_REQ_POR_SEGUNDO)
+        if len(formulas) == 1:
+            paginadas = [_paginar_clientes_airtable(formulas[0], limitador)]
+        else:
+            logging.info(f"  → {len(formulas)} fatias em paralelo (até {AIRTABLE_REQ_POR_SEGUNDO:g} req/s)")
+            with ThreadPoolExecutor(max_workers=len(formulas), thread_name_prefix="airtable") as executor:
+                paginadas = list(executor.map(lambda formula: _paginar_clientes_airtable(formula, limitador), formulas))
+        fatias = [registros for registros, _ in paginadas]
+        completa = all(completa for _, completa in paginadas)
+        if usar_snapshot and not completa:
+            # Um snapshot parcial (ou vazio) deixaria todos os containers sem esses clientes até o TTL vencer
+            registrar_metrica("cache_compartilhado.snapshot_incompleto")
+            logging.warning("[CACHE_COMPARTILHADO] Paginação do Airtable incompleta; snapshot de clientes não publicado")
+        elif usar_snapshot:
+            CACHE_COMPARTILHADO.publicar("airtable_clientes", {
+                "gerado_em": time.time(),
+                "registros": [compactar_registro_airtable(record) for registros in fatias for record in registros],
+            })
+    sem_email: Dict[str, List[str]] = {sistema: [] for sistema in CAMPOS_ID_SISTEMA}
+    for registros in fatias:
+        for record in registros:
+            fields = record['fields']
+            ignorar = IGNORAR_CLIENTES_SEM_EMAIL and not normalizar_email(fields.get('Email', ''))
+            for sistema, campo in CAMPOS_ID_SISTEMA.items():
+                id_sistema = fields.get(campo, '')
+                if not id_sistema:
+                    continue
+                if ignorar:
+                    sem_email[sistema].append(record.get('id'))
+                else:
+                    clientes_por_sistema[sistema][str(id_sistema)] = record
+    if IGNORAR_CLIENTES_SEM_EMAIL:
+        registrar_resumo_sem_email(sem_email)
+    logging.info(f"✅ {sum(len(clientes) for clientes in clientes_por_sistema.values())} IDs de clientes indexados "
+                 f"({', '.join(f'{sistema}: {len(clientes)}' for sistema, clientes in clientes_por_sistema.items())})")
+    return clientes_por_sistema
+
+class ParcelaTenex(TypedDict, total=False):
+    """Campos da parcela Tenex usados pelo pipeline (os demais são descartados na decodificação tipada)."""
+    data_vencimento: Any
+    status: Any
+    valor: Any
+    pdf_url: Any
+
+class VendaTenex(TypedDict, total=False):
+    id_cliente: Any
+    parcelas: Optional[List[ParcelaTenex]]
+
+class RespostaTenex(TypedDict, total=False):
+    data: Optional[List[VendaTenex]]
+
+_DECODIFICADOR_TENEX = msgspec.json.Decoder(RespostaTenex) if msgspec is not None and SERIALIZADOR_JSON in ('auto', 'msgspec') else None
+
+def decodificar_vendas_tenex(conteudo: bytes) -> List[Dict]:
+    """
+    Lista de vendas de uma resposta Tenex. Com msgspec, decodifica direto nos TypedDicts acima
+    (dicts só com os campos usados); senão, pelo serializador JSON ativo.
+    """
+    if _DECODIFICADOR_TENEX is not None:
         try:
-            response = requests.get(url, auth=(api_key, ''), params=params, timeout=180)
-            logging.info(f"Resposta recebida: {response.status_code}")
-            return response
-        except (requests.exceptions.Timeout, requests.exceptions.ConnectionError) as e:
-            logging.warning(f"Falha na requisição Tenex: {str(e)}. Retentando em {atraso:.1f}s...")
-            time.sleep(atraso)
-            tentativas += 1
-            atraso *= 2
+            return _DECODIFICADOR_TENEX.decode(conteudo).get("data") or []
+        except msgspec.ValidationError as e:
+            logging.warning(f"Resposta Tenex fora do formato esperado ({str(e)}); decodificando sem tipos")
+    return json_decodificar(conteudo).get("data") or []
+
+def fetch_tenex_lote(url, api_key, params, timeout: float = 180, max_tentativas: int = 5, headers: Optional[Dict] = None,
+                     contar_falhas_disjuntor: bool = True):
+    logging.debug("Tentando requisição para %s com params: %s", url, params)
+    base = POLITICAS_RETRY["tenex"]
+    politica = PoliticaRetry("tenex", max_tentativas=max_tentativas, base=base.base, teto=base.teto,
+                             prazo=timeout * max_tentativas, status_retentaveis=base.status_retentaveis)
+    response, erro = requisitar_com_retry("tenex", "GET", url, politica=politica, contar_falhas_disjuntor=contar_falhas_disjuntor,
+                                          auth=(api_key, ''), params=params, headers=headers, timeout=timeout)
+    if response is None:
+        logging.warning("Falha na requisição Tenex: %s", erro)
+        return None
+    logging.debug("Resposta recebida: %s", response.status_code)
+    return response
+
+class LoteadorAdaptativo:
+    """
+    Ajusta o tamanho dos lotes Tenex a partir do que foi observado: lotes rápidos e pequenos
+    crescem; lotes lentos, grandes demais ou que falharam encolhem.
+    """
+
+    def __init__(self, inicial: int = TENEX_LOTE_INICIAL, minimo: int = TENEX_LOTE_MIN, maximo: int = TENEX_LOTE_MAX,
+                 latencia_alvo: float = TENEX_LATENCIA_ALVO, bytes_alvo: int = TENEX_BYTES_ALVO):
+        self.minimo = max(1, minimo)
+        self.maximo = max(self.minimo, maximo)
+        self.latencia_alvo = latencia_alvo
+        self.bytes_alvo = bytes_alvo
+        self.tamanho = min(max(inicial, self.minimo), self.maximo)
+
+    def registrar_sucesso(self, tamanho_lote: int, latencia: float, bytes_resposta: int) -> None:
+        # Razão entre o alvo e o observado; o pior dos dois critérios decide
+        fator = min(self.latencia_alvo / max(latencia, 0.001), self.bytes_alvo / max(bytes_resposta, 1))
+        # Limita a variação por lote para não oscilar (no máximo 1,5x para cima e 0,5x para baixo)
+        fator = min(max(fator, 0.5), 1.5)
+        sugerido = tamanho_lote * fator
+        # Suaviza com o tamanho corrente
+        self.tamanho = int(min(max((self.tamanho + sugerido) / 2, self.minimo), self.maximo))
+
+    def registrar_falha(self) -> None:
+        self.tamanho = max(self.minimo, self.tamanho // 2)
+
+def compactar_parcelas(parcelas: List[Dict]) -> List[Dict]:
+    """Reduz as parcelas de uma venda às pendentes e aos campos usados no envio."""
+    return [
+        {
+            "data_vencimento": parcela.get("data_vencimento"),
+            "status": parcela.get("status"),
+            "valor": parcela.get("valor"),
+            "pdf_url": parcela.get("pdf_url"),
+        }
+        for parcela in parcelas or ()
+        if parcela.get("status", 0) in STATUS_PENDENTES
+    ]
+
+class IndiceVencimentos:
+    """
+    Índice data de vencimento (ISO) -> clientes (sistema, id_cliente) com parcela pendente nessa data.
+    Mantido incrementalmente pelo CacheTenex a cada gravação; permite ler só os dias de interesse
+    da execução em vez de varrer o histórico de todos os clientes.
+    """
+
+    def __init__(self):
+        self._por_data: Dict[str, set] = {}
+        self._datas_por_cliente: Dict[Tuple[str, str], set] = {}
+
+    def atualizar(self, chave: Tuple[str, str], parcelas: List[Dict]) -> None:
+        self.remover(chave)
+        datas = {parcela.get("data_vencimento") for parcela in parcelas if isinstance(parcela.get("data_vencimento"), str)}
+        for data_iso in datas:
+            self._por_data.setdefault(data_iso, set()).add(chave)
+        if datas:
+            self._datas_por_cliente[chave] = datas
+
+    def remover(self, chave: Tuple[str, str]) -> None:
+        for data_iso in self._datas_por_cliente.pop(chave, ()):
+            bucket = self._por_data.get(data_iso)
+            if bucket is not None:
+                bucket.discard(chave)
+                if not bucket:
+                    del self._por_data[data_iso]
+
+    def clientes_na_data(self, data_iso: str) -> set:
+        return self._por_data.get(data_iso, set())
+
+    def podar_antes_de(self, data_iso: str) -> None:
+        """Descarta buckets de datas anteriores a data_iso (nenhuma janela as consulta mais)."""
+        for data_antiga in [d for d in self._por_data if d < data_iso]:
+            for chave in self._por_data.pop(data_antiga):
+                datas = self._datas_por_cliente.get(chave)
+                if datas is not None:
+                    datas.discard(data_antiga)
+                    if not datas:
+                        del self._datas_por_cliente[chave]
+
+    def exportar(self) -> Dict[str, List[List[str]]]:
+        return {data_iso: [list(chave) for chave in chaves] for data_iso, chaves in self._por_data.items()}
+
+    def importar(self, dados: Dict[str, List[List[str]]]) -> None:
+        self._por_data = {}
+        self._datas_por_cliente = {}
+        for data_iso, chaves in dados.items():
+            for sistema, id_cliente in chaves:
+                chave = (sistema, id_cliente)
+                self._por_data.setdefault(data_iso, set()).add(chave)
+                self._datas_por_cliente.setdefault(chave, set()).add(data_iso)
+
+class CacheTenex:
+    """
+    Cache LRU com TTL das parcelas pendentes (compactadas) por (sistema, id_cliente).
+    Guarda também os validadores HTTP (ETag/Last-Modified) de cada lote para requisições
+    condicionais e o índice por data de vencimento. Vive na memória do processo e,
+    opcionalmente, em um arquivo JSON em /tmp.
+    """
+
+    def __init__(self, ttl: int = TENEX_CACHE_TTL, max_clientes: int = TENEX_CACHE_MAX_CLIENTES, arquivo: str = TENEX_CACHE_ARQUIVO):
+        self.ttl = ttl
+        self.max_clientes = max_clientes
+        self.arquivo = arquivo
+        self._itens: "OrderedDict[Tuple[str, str], Tuple[float, List[Dict]]]" = OrderedDict()
+        self._validadores: "OrderedDict[str, Dict[str, str]]" = OrderedDict()
+        self.indice = IndiceVencimentos()
+        self._carregado = False
+        self._alterado = False
+
+    @property
+    def habilitado(self) -> bool:
+        return self.ttl > 0
+
+    def _carregar(self) -> None:
+        if self._carregado:
+            return
+        self._carregado = True
+        if not self.arquivo or not os.path.exists(self.arquivo):
+            return
+        try:
+            with open(self.arquivo, 'r', encoding='utf-8') as f:
+                dados = json.load(f)
+            for sistema, id_cliente, gravado_em, parcelas in dados.get("itens", []):
+                self._itens[(sistema, id_cliente)] = (gravado_em, parcelas)
+            self._validadores.update(dados.get("validadores", {}))
+            if "indice" in dados:
+                self.indice.importar(dados["indice"])
+            else:
+                for chave, (_, parcelas) in self._itens.items():
+                    self.indice.atualizar(chave, parcelas)
+            logging.info(f"[CACHE] {len(self._itens)} clientes Tenex carregados de {self.arquivo}")
         except Exception as e:
-            logging.error(f"Erro inesperado na requisição Tenex: {str(e)}")
+            logging.warning(f"[CACHE] Falha ao ler {self.arquivo}: {str(e)}. Ignorando cache em disco.")
+
+    def _exportar(self) -> Dict:
+        return {
+            "itens": [[sistema, id_cliente, gravado_em, parcelas] for (sistema, id_cliente), (gravado_em, parcelas) in self._itens.items()],
+            "validadores": self._validadores,
+            "indice": self.indice.exportar(),
+        }
+
+    def _mesclar(self, dados: Dict) -> Dict:
+        """Incorpora as entradas de outro container mais novas que as locais; devolve o cache exportado."""
+        for sistema, id_cliente, gravado_em, parcelas in dados.get("itens", []):
+            chave = (sistema, id_cliente)
+            atual = self._itens.get(chave)
+            if atual is None or atual[0] < gravado_em:
+                self._itens[chave] = (gravado_em, parcelas)
+                self.indice.atualizar(chave, parcelas)
+                self._alterado = True
+        for assinatura, validadores in dados.get("validadores", {}).items():
+            self._validadores.setdefault(assinatura, validadores)
+        while len(self._itens) > self.max_clientes:
+            chave_antiga, _ = self._itens.popitem(last=False)
+            self.indice.remover(chave_antiga)
+        return self._exportar()
+
+    def sincronizar_compartilhado(self) -> None:
+        """Traz o que outros containers publicaram no cache compartilhado (GET condicional: barato se nada mudou)."""
+        if not self.habilitado or not CACHE_COMPARTILHADO.habilitado:
+            return
+        self._carregar()
+        dados = CACHE_COMPARTILHADO.obter("tenex")
+        if dados:
+            self._mesclar(dados)
+
+    def salvar(self) -> None:
+        if not self.habilitado:
+            return
+        data_minima = (relogio_execucao()["hoje"] + timedelta(days=min(JANELAS_PERIODO.values()))).isoformat()
+        self.indice.podar_antes_de(data_minima)
+        dados = self._exportar()
+        if self.arquivo:
+            try:
+                temporario = f"{self.arquivo}.tmp"
+                with open(temporario, 'w', encoding='utf-8') as f:
+                    json.dump(dados, f, separators=(',', ':'))
+                os.replace(temporario, self.arquivo)
+            except Exception as e:
+                logging.warning(f"[CACHE] Falha ao gravar {self.arquivo}: {str(e)}")
+        if self._alterado:
+            CACHE_COMPARTILHADO.publicar("tenex", dados, mesclar=lambda remoto, _local: self._mesclar(remoto))
+            self._alterado = False
+
+    def obter(self, sistema: str, id_cliente: str, aceitar_expirado: bool = False) -> Optional[List[Dict]]:
+        """Retorna as parcelas em cache do cliente, ou None se ausentes (ou expiradas, salvo aceitar_expirado)."""
+        self._carregar()
+        item = self._itens.get((sistema, id_cliente))
+        if item is None:
             return None
-    logging.error("Excedido número máximo de tentativas na Tenex.")
-    return None
+        gravado_em, parcelas = item
+        if not aceitar_expirado and time.time() - gravado_em > self.ttl:
+            return None
+        self._itens.move_to_end((sistema, id_cliente))
+        return parcelas
+
+    def gravar(self, sistema: str, id_cliente: str, parcelas: List[Dict]) -> None:
+        self._carregar()
+        chave = (sistema, id_cliente)
+        if self._itens.get(chave, (None, None))[1] is not parcelas:
+            self.indice.atualizar(chave, parcelas)
+        self._itens[chave] = (time.time(), parcelas)
+        self._itens.move_to_end(chave)
+        self._alterado = True
+        while len(self._itens) > self.max_clientes:
+            chave_antiga, _ = self._itens.popitem(last=False)
+            self.indice.remover(chave_antiga)
+
+    def parcelas_nas_datas(self, sistema: str, ids_clientes: set, periodos_por_data: Dict[str, str]):
+        """Gera (periodo, id_cliente, parcela) lendo só os buckets do índice das datas pedidas."""
+        for data_iso, periodo in periodos_por_data.items():
+            for chave in self.indice.clientes_na_data(data_iso):
+                if chave[0] != sistema or chave[1] not in ids_clientes:
+                    continue
+                for parcela in self._itens[chave][1]:
+                    if parcela.get("data_vencimento") == data_iso:
+                        yield periodo, chave[1], parcela
+
+    def renovar(self, sistema: str, id_cliente: str) -> Optional[List[Dict]]:
+        """Marca a entrada como fresca de novo (resposta 304) e devolve as parcelas."""
+        parcelas = self.obter(sistema, id_cliente, aceitar_expirado=True)
+        if parcelas is not None:
+            self.gravar(sistema, id_cliente, parcelas)
+        return parcelas
+
+    @staticmethod
+    def assinatura_lote(sistema: str, ids: List[str]) -> str:
+        return hashlib.sha1(f"{sistema}:{','.join(sorted(ids))}".encode('utf-8')).hexdigest()
+
+    def headers_condicionais(self, sistema: str, ids: List[str]) -> Optional[Dict[str, str]]:
+        """Headers If-None-Match/If-Modified-Since do lote, se houver validadores e todos os clientes ainda estiverem em cache."""
+        validadores = self._validadores.get(self.assinatura_lote(sistema, ids))
+        if not validadores or any((sistema, id_cliente) not in self._itens for id_cliente in ids):
+            return None
+        headers = {}
+        if validadores.get("etag"):
+            headers["If-None-Match"] = validadores["etag"]
+        if validadores.get("last_modified"):
+            headers["If-Modified-Since"] = validadores["last_modified"]
+        return headers or None
+
+    def gravar_validadores(self, sistema: str, ids: List[str], response) -> None:
+        etag = response.headers.get('ETag')
+        last_modified = response.headers.get('Last-Modified')
+        if not etag and not last_modified:
+            return
+        self._validadores[self.assinatura_lote(sistema, ids)] = {"etag": etag, "last_modified": last_modified}
+        while len(self._validadores) > max(1, self.max_clientes // max(TENEX_LOTE_MIN, 1)):
+            self._validadores.popitem(last=False)
+
+CACHE_TENEX = CacheTenex()
+
+class CacheProximoVencimento:
+    """
+    Por (sistema, id_cliente): a partir de que dia o cliente tem parcela pendente em alguma janela
+    (None = nenhuma parcela pendente futura) e até quando essa conclusão vale. Persistido em JSON em /tmp.
+    """
+
+    def __init__(self, revalidar_dias: int = PROXIMO_VENCIMENTO_REVALIDAR_DIAS, arquivo: str = PROXIMO_VENCIMENTO_ARQUIVO):
+        self.revalidar_dias = revalidar_dias
+        self.arquivo = arquivo
+        # "sistema:id_cliente" -> [retomar_em ISO ou None, válido até ISO (exclusivo), gravado em (epoch)]
+        self._itens: Dict[str, List[Optional[str]]] = {}
+        self._carregado = False
+        self._alterado = False
+
+    @property
+    def habilitado(self) -> bool:
+        return self.revalidar_dias > 0
+
+    def _carregar(self) -> None:
+        if self._carregado:
+            return
+        self._carregado = True
+        if not self.arquivo or not os.path.exists(self.arquivo):
+            return
+        try:
+            with open(self.arquivo, 'rb') as f:
+                self._itens = json_decodificar(f.read())
+        except Exception as e:
+            logging.warning(f"[CACHE] Falha ao ler {self.arquivo}: {str(e)}")
+
+    def pular(self, sistema: str, id_cliente: str, hoje_iso: str) -> bool:
+        """True se, com o que se sabia na última consulta, o cliente não tem parcela em nenhuma janela hoje."""
+        self._carregar()
+        item = self._itens.get(f"{sistema}:{id_cliente}")
+        if item is None or hoje_iso >= item[1]:
+            return False
+        return item[0] is None or hoje_iso < item[0]
 
-def buscar_parcelas_por_periodo(clientes_dict: Dict[str, Dict], sistema: str) -> Dict[str, List[Tuple[Dict, Dict, str]]]:
+    def gravar_vendas(self, sistema: str, ids_lote: List[str], vendas: List[Dict]) -> None:
+        """
+        Recalcula os clientes do lote a partir das vendas devolvidas (clientes sem venda: nenhuma parcela).
+        O cliente volta a ser consultado no dia em que o vencimento pendente mais próximo entra na janela
+        mais adiantada (ex.: "vence_amanha" = vencimento - 1 dia).
+        """
+        self._carregar()
+        hoje = relogio_execucao()["hoje"]
+        data_minima = (hoje + timedelta(days=min(JANELAS_PERIODO.values()))).isoformat()
+        antecedencia = timedelta(days=max(JANELAS_PERIODO.values()))
+        proximos: Dict[str, Optional[str]] = {str(id_cliente): None for id_cliente in ids_lote}
+        for venda in vendas:
+            id_cliente = str(venda.get("id_cliente", ""))
+            proximo = proximos.get(id_cliente)
+            for parcela in venda.get("parcelas") or ():
+                data = parcela.get("data_vencimento")
+                if not isinstance(data, str) or parcela.get("status", 0) not in STATUS_PENDENTES:
+                    continue
+                data = data[:10]
+                if data >= data_minima and (proximo is None or data < proximo):
+                    proximo = data
+            proximos[id_cliente] = proximo
+        hoje_iso = hoje.isoformat()
+        agora = time.time()
+        for id_cliente, proximo in proximos.items():
+            chave = f"{sistema}:{id_cliente}"
+            retomar_em = None
+            if proximo is not None:
+                try:
+                    retomar_em = (date.fromisoformat(proximo) - antecedencia).isoformat()
+                except ValueError:
+                    retomar_em = hoje_iso
+            # Validade escalonada pelo hash do cliente, para a revalidação não cair toda no mesmo dia. Clientes
+            # já relevantes (retomar_em <= hoje) também são gravados: a entrada nova prevalece sobre uma antiga
+            # de outro container na mescla do cache compartilhado.
+            dias = 1 + int(hashlib.sha1(chave.encode('utf-8')).hexdigest()[:8], 16) % self.revalidar_dias
+            self._itens[chave] = [retomar_em, (hoje + timedelta(days=dias)).isoformat(), agora]
+            self._alterado = True
+
+    def _mesclar(self, itens: Dict[str, List]) -> Dict[str, List]:
+        """Incorpora as conclusões de outro container mais recentes que as locais; devolve todas."""
+        for chave, item in itens.items():
+            atual = self._itens.get(chave)
+            if atual is None or (atual[2] if len(atual) > 2 else 0) < (item[2] if len(item) > 2 else 0):
+                self._itens[chave] = item
+        return self._itens
+
+    def sincronizar_compartilhado(self) -> None:
+        if not self.habilitado or not CACHE_COMPARTILHADO.habilitado:
+            return
+        self._carregar()
+        itens = CACHE_COMPARTILHADO.obter("proximos_vencimentos")
+        if itens:
+            self._mesclar(itens)
+
+    def salvar(self) -> None:
+        if not self._alterado:
+            return
+        hoje_iso = relogio_execucao()["hoje_iso"]
+        vigentes = {chave: item for chave, item in self._itens.items() if hoje_iso < item[1]}
+        if self.arquivo:
+            try:
+                temporario = f"{self.arquivo}.tmp"
+                with open(temporario, 'wb') as f:
+                    f.write(json_codificar(vigentes))
+                os.replace(temporario, self.arquivo)
+            except Exception as e:
+                logging.warning(f"[CACHE] Falha ao gravar {self.arquivo}: {str(e)}")
+        CACHE_COMPARTILHADO.publicar("proximos_vencimentos", vigentes, mesclar=lambda remoto, _local: self._mesclar(remoto))
+        self._alterado = False
+
+CACHE_PROXIMO_VENCIMENTO = CacheProximoVencimento()
+
+# Status Tenex em que vale dividir o lote e tentar de novo (falha transitória ou lote grande demais)
+TENEX_STATUS_DIVIDIR_LOTE = frozenset({408, 413, 414, 429, 500, 502, 503, 504})
+
+def classificar_parcelas_vendas(vendas: List[Dict], clientes_sistema: Dict[str, Dict], sistema: str,
+                                destino: Dict[str, List[Tuple[Dict, Dict, str, str]]]) -> None:
+    """
+    Classifica em lote as parcelas das vendas Tenex nos períodos do relógio da execução.
+    Compara a data ISO de vencimento com as datas pré-calculadas (sem strptime) e o status
+    contra STATUS_PENDENTES. Lotes muito grandes usam o caminho colunar se o NumPy existir.
+    """
+    periodos_por_data = relogio_execucao()["periodos_por_data"]
+    if np is not None and CLASSIFICACAO_COLUNAR_MIN > 0:
+        total_parcelas = sum(len(venda.get("parcelas") or ()) for venda in vendas)
+        if total_parcelas >= CLASSIFICACAO_COLUNAR_MIN:
+            _classificar_parcelas_colunar(vendas, clientes_sistema, sistema, destino, periodos_por_data)
+            return
+    for venda in vendas:
+        id_cliente = str(venda.get("id_cliente", ""))
+        cliente = clientes_sistema.get(id_cliente)
+        if not cliente:
+            continue
+        for parcela in venda.get("parcelas") or ():
+            periodo = periodos_por_data.get(parcela.get("data_vencimento"))
+            if periodo is None or parcela.get("status", 0) not in STATUS_PENDENTES:
+                continue
+            destino[periodo].append((parcela, cliente, id_cliente, sistema))
+
+def _classificar_parcelas_colunar(vendas: List[Dict], clientes_sistema: Dict[str, Dict], sistema: str,
+                                  destino: Dict[str, List[Tuple[Dict, Dict, str, str]]], periodos_por_data: Dict[str, str]) -> None:
+    """Variante colunar de classificar_parcelas_vendas: máscaras NumPy sobre datas/status achatados."""
+    refs: List[Tuple[Dict, Dict, str]] = []
+    datas: List[str] = []
+    status: List[int] = []
+    for venda in vendas:
+        id_cliente = str(venda.get("id_cliente", ""))
+        cliente = clientes_sistema.get(id_cliente)
+        if not cliente:
+            continue
+        for parcela in venda.get("parcelas") or ():
+            refs.append((parcela, cliente, id_cliente))
+            data = parcela.get("data_vencimento")
+            datas.append(data if isinstance(data, str) else "")
+            st = parcela.get("status", 0)
+            status.append(st if isinstance(st, int) else -1)
+    if not refs:
+        return
+    col_datas = np.array(datas)
+    pendentes = np.isin(np.array(status, dtype=np.int64), list(STATUS_PENDENTES))
+    for data_iso, periodo in periodos_por_data.items():
+        for i in np.flatnonzero(pendentes & (col_datas == data_iso)):
+            parcela, cliente, id_cliente = refs[i]
+            destino[periodo].append((parcela, cliente, id_cliente, sistema))
+
+def buscar_parcelas_por_periodo(clientes_por_sistema: Dict[str, Dict[str, Dict]], sistema: str) -> Dict[str, List[Tuple[Dict, Dict, str, str]]]:
     if sistema == 'credilly':
         url = TENEX_URL_CREDILLY
         api_key = TENEX_API_KEY_CREDILLY
-        prefixo = "CRED"
     elif sistema == 'turing':
         url = TENEX_URL_TURING
         api_key = TENEX_API_KEY_TURING
-        prefixo = "TUR"
     else:
         raise ValueError("sistema inválido. Use 'credilly' ou 'turing'")
     logging.info(f"🔍 Buscando parcelas no sistema {sistema.upper()}...")
-    hoje = datetime.now().date()
-    ontem = hoje - timedelta(days=1)
-    amanha = hoje + timedelta(days=1)
-    parcelas_por_periodo = {"venceu_ontem": [], "vence_hoje": [], "vence_amanha": []}
-    ids_sistema = []
-    for key, cliente in clientes_dict.items():
-        if key.startswith(prefixo):
-            id_cliente = key.replace(f"{prefixo}-", "")
-            ids_sistema.append((id_cliente, cliente))
+    parcelas_por_periodo = {periodo: [] for periodo in JANELAS_PERIODO}
+    clientes_sistema = clientes_por_sistema.get(sistema) or {}
+    # Só os ids: com o índice em disco (ClientesEmDisco) cada registro é lido sob demanda na classificação do lote
+    ids_sistema = list(clientes_sistema)
     logging.info(f"  → {len(ids_sistema)} clientes para verificar no {sistema}")
-    for i in range(0, len(ids_sistema), 100):
-        lote = ids_sistema[i:i+100]
-        params = [("id_cliente", id_cliente) for id_cliente, _ in lote]
-        logging.info(f"Processando lote {i//100+1} de {len(ids_sistema)//100 + 1}")
+    if CACHE_PROXIMO_VENCIMENTO.habilitado:
+        hoje_iso = relogio_execucao()["hoje_iso"]
+        total_clientes = len(ids_sistema)
+        ids_sistema = [id_cliente for id_cliente in ids_sistema
+                       if not CACHE_PROXIMO_VENCIMENTO.pular(sistema, id_cliente, hoje_iso)]
+        registrar_metrica(f"tenex.{sistema}.clientes_sem_vencimento_proximo", total_clientes - len(ids_sistema))
+        logging.info(f"  → {total_clientes - len(ids_sistema)} clientes sem vencimento próximo pulados; {len(ids_sistema)} restantes")
+    if CACHE_TENEX.habilitado:
+        em_cache = set()
+        a_buscar = []
+        for id_cliente in ids_sistema:
+            if CACHE_TENEX.obter(sistema, id_cliente) is None:
+                a_buscar.append(id_cliente)
+            else:
+                em_cache.add(id_cliente)
+        # Clientes em cache: lê apenas os buckets de vencimento das janelas da execução
+        for periodo, id_cliente, parcela in CACHE_TENEX.parcelas_nas_datas(sistema, em_cache, relogio_execucao()["periodos_por_data"]):
+            parcelas_por_periodo[periodo].append((parcela, clientes_sistema[id_cliente], id_cliente, sistema))
+        logging.info(f"  → {len(em_cache)} clientes atendidos pelo cache; {len(a_buscar)} a buscar na Tenex")
+        ids_sistema = a_buscar
+    loteador = LoteadorAdaptativo()
+    disjuntor = DISJUNTORES["tenex"]
+    numero_lote = 0
+
+    def consultar_lote(ids_lote: List[str]) -> Optional[str]:
+        """
+        Consulta e classifica um lote. Retorna None se o lote foi resolvido (inclusive com erro que não
+        adianta repetir) ou o motivo de uma falha que justifica dividir o lote. As falhas não entram no
+        circuit breaker aqui: quem chama registra uma por lote lógico (ver a bissecção abaixo).
+        """
+        nonlocal numero_lote
+        numero_lote += 1
+        params = [("id_cliente", id_cliente) for id_cliente in ids_lote]
+        logging.debug("Processando lote %s (%s clientes)", numero_lote, len(ids_lote))
         try:
-            response = fetch_tenex_lote(url, api_key, params)
-            if response is None:
-                logging.warning(f"Lote {i//100+1} ignorado devido a falha na API")
-                continue
+            headers_cond = CACHE_TENEX.headers_condicionais(sistema, ids_lote) if CACHE_TENEX.habilitado else None
+            inicio_lote = time.monotonic()
+            response = fetch_tenex_lote(url, api_key, params, timeout=TENEX_TIMEOUT, max_tentativas=TENEX_MAX_TENTATIVAS,
+                                        headers=headers_cond, contar_falhas_disjuntor=False)
+            latencia = time.monotonic() - inicio_lote
+            if response is not None and response.status_code == 304 and headers_cond:
+                vendas_cache = [{"id_cliente": id_cliente, "parcelas": CACHE_TENEX.renovar(sistema, id_cliente) or []} for id_cliente in ids_lote]
+                logging.info(f"Lote {numero_lote} não modificado (304); usando cache")
+                if CACHE_PROXIMO_VENCIMENTO.habilitado:
+                    CACHE_PROXIMO_VENCIMENTO.gravar_vendas(sistema, ids_lote, vendas_cache)
+                classificar_parcelas_vendas(vendas_cache, clientes_sistema, sistema, parcelas_por_periodo)
+                return None
+            if response is None or response.status_code in TENEX_STATUS_DIVIDIR_LOTE:
+                return "falha na API" if response is None else f"status {response.status_code}"
             if response.status_code == 200:
-                vendas = response.json().get("data", [])
-                logging.info(f"Resposta JSON: {vendas[:2]}...")
+                vendas = decodificar_vendas_tenex(response.content)
+                logging.debug("Resposta JSON: %s...", vendas[:2])
             else:
-                logging.error(f"❌ Erro ao buscar lote {i//100+1}: {response.status_code}")
-                continue
-            for venda in vendas:
-                id_cliente = str(venda.get("id_cliente", ""))
-                parcelas = venda.get("parcelas", [])
-                cliente_key = f"{prefixo}-{id_cliente}"
-                cliente = clientes_dict.get(cliente_key)
-                if not cliente:
-                    continue
-                for parcela in parcelas:
-                    vencimento_str = parcela.get("data_vencimento", "")
-                    status = parcela.get("status", 0)
-                    if status not in STATUS_PENDENTES:
-                        continue
-                    try:
-                        vencimento = datetime.strptime(vencimento_str, '%Y-%m-%d').date()
-                    except:
-                        continue
-                    if vencimento == ontem:
-                        parcelas_por_periodo["venceu_ontem"].append((parcela, cliente, id_cliente, sistema))
-                    elif vencimento == hoje:
-                        parcelas_por_periodo["vence_hoje"].append((parcela, cliente, id_cliente, sistema))
-                    elif vencimento == amanha:
-                        parcelas_por_periodo["vence_amanha"].append((parcela, cliente, id_cliente, sistema))
+                logging.error(f"❌ Erro ao buscar lote {numero_lote}: {response.status_code}")
+                return None
+            loteador.registrar_sucesso(len(ids_lote), latencia, len(response.content))
+            if CACHE_PROXIMO_VENCIMENTO.habilitado:
+                CACHE_PROXIMO_VENCIMENTO.gravar_vendas(sistema, ids_lote, vendas)
+            if CACHE_TENEX.habilitado:
+                # Agrupa as parcelas pendentes por cliente (um cliente pode ter várias vendas); clientes sem vendas também são cacheados
+                parcelas_por_cliente: Dict[str, List[Dict]] = {id_cliente: [] for id_cliente in ids_lote}
+                for venda in vendas:
+                    parcelas_por_cliente.setdefault(str(venda.get("id_cliente", "")), []).extend(compactar_parcelas(venda.get("parcelas")))
+                for id_cliente, parcelas_cliente in parcelas_por_cliente.items():
+                    CACHE_TENEX.gravar(sistema, id_cliente, parcelas_cliente)
+                CACHE_TENEX.gravar_validadores(sistema, ids_lote, response)
+            classificar_parcelas_vendas(vendas, clientes_sistema, sistema, parcelas_por_periodo)
         except Exception as e:
-            logging.error(f"❌ Erro ao processar lote {i//100+1} após retries: {str(e)}")
-        if i + 100 < len(ids_sistema):
+            logging.error(f"❌ Erro ao processar lote {numero_lote} após retries: {str(e)}")
+        return None
+
+    def isolar_falha(lote: List[str], motivo: str) -> List[str]:
+        """
+        Bissecção de um lote lógico que falhou: as duas metades são consultadas; a que falhar é dividida
+        de novo, até isolar o(s) cliente(s) que derrubam a consulta, que são ignorados sem contar contra a
+        Tenex. Se as duas metades falham juntas, a falha é do serviço: registra uma única falha no circuit
+        breaker para o lote lógico e devolve os clientes que ficaram sem consulta.
+        """
+        loteador.registrar_falha()
+        if disjuntor.estado == disjuntor.SEMIABERTO:
+            # O lote era a sondagem do half-open: a falha reabre o circuito
+            disjuntor.registrar_falha()
+            return lote
+        pendentes = [lote]
+        while pendentes:
+            lote = pendentes.pop()
+            if len(lote) == 1:
+                registrar_metrica(f"tenex.{sistema}.clientes_isolados")
+                logging.warning(f"Cliente {lote[0]} ignorado devido a {motivo}")
+                continue
+            if not disjuntor.disponivel():
+                return [item for restante in pendentes + [lote] for item in restante]
+            metade = len(lote) // 2
+            logging.warning(f"Lote de {len(lote)} clientes falhou ({motivo}); dividindo em {metade} + {len(lote) - metade} clientes")
+            falhas = []
+            for parte in (lote[:metade], lote[metade:]):
+                motivo_parte = consultar_lote(parte)
+                if motivo_parte is not None:
+                    falhas.append(parte)
+                    motivo = motivo_parte
+            if len(falhas) == 2:
+                disjuntor.registrar_falha()
+                registrar_metrica(f"tenex.{sistema}.lotes_falha_servico")
+                return [item for restante in pendentes + falhas for item in restante]
+            pendentes.extend(falhas)
+        return []
+
+    ids_sistema = list(ids_sistema)
+    posicao = 0
+    nao_consultados: List[str] = []
+    # Clientes que já voltaram uma vez para o fim da fila após falha do serviço (não voltam de novo)
+    repetidos: set = set()
+    espera_circuito = 0.0
+    while posicao < len(ids_sistema):
+        if not disjuntor.disponivel():
+            espera = disjuntor.segundos_para_sondagem()
+            if espera_circuito + espera > TENEX_ESPERA_CIRCUITO_MAX:
+                nao_consultados.extend(ids_sistema[posicao:])
+                logging.error(f"❌ Tenex com circuito aberto após {espera_circuito:.0f}s de espera; encerrando a busca em {sistema}")
+                break
+            logging.warning(f"⏸️ Tenex com circuito aberto; aguardando {espera:.1f}s para a sondagem")
+            registrar_metrica(f"tenex.{sistema}.espera_circuito_s", espera)
+            espera_circuito += espera
+            time.sleep(espera)
+            continue
+        lote = ids_sistema[posicao:posicao + loteador.tamanho]
+        posicao += len(lote)
+        motivo = consultar_lote(lote)
+        if motivo is not None:
+            if len(lote) == 1:
+                # Lote lógico de um cliente só: não há como separar cliente de serviço; conta como falha do serviço
+                disjuntor.registrar_falha()
+                falharam = lote
+            else:
+                falharam = isolar_falha(lote, motivo)
+            # Falha do serviço: os clientes voltam uma vez para o fim da fila (depois da sondagem, se o circuito abrir)
+            for id_cliente in falharam:
+                if id_cliente in repetidos:
+                    nao_consultados.append(id_cliente)
+                else:
+                    repetidos.add(id_cliente)
+                    ids_sistema.append(id_cliente)
+        if posicao < len(ids_sistema):
             time.sleep(0.1)
+    if nao_consultados:
+        # Nada é guardado para depois: a próxima execução consulta o sistema inteiro de novo
+        registrar_metrica(f"tenex.{sistema}.clientes_nao_consultados", len(nao_consultados))
+        logging.error(f"❌ {len(nao_consultados)} clientes de {sistema} não consultados nesta execução por falha da Tenex")
+    CACHE_TENEX.salvar()
+    CACHE_PROXIMO_VENCIMENTO.salvar()
     for periodo, parcelas in parcelas_por_periodo.items():
         logging.info(f"  → {len(parcelas)} parcelas em '{periodo}'")
     return parcelas_por_periodo
 
-def processar_parcelas_periodo(parcelas: List[Tuple[Dict, Dict, str, str]], tipo: str, limite: Optional[int]) -> Dict:
-    stats = {"total": len(parcelas), "enviados": 0, "ja_enviados": 0, "sem_email": 0, "erros": 0}
-    if limite:
-        parcelas = parcelas[:limite]
-        logging.info(f"📋 Limitando {tipo} a {limite} e-mails")
-
-    for item in parcelas:
-        # Backward-compat: alguns itens antigos podem não ter sistema; default credilly
-        if len(item) == 3:
-            parcela, cliente, cliente_id = item
-            sistema_origem = 'credilly'
+class ArmazemExecucao:
+    """
+    Conjunto de trabalho da execução em SQLite: clientes (por sistema/id), parcelas classificadas
+    (por período, vencimento e status) e desfechos de envio. Durável (WAL) quando é o armazém do dia,
+    que também serve de checkpoint para retomar e de artefato de depuração; descartável (sem journal)
+    quando só recebe a descarga de memória.
+    """
+
+    ESQUEMA = (
+        "CREATE TABLE IF NOT EXISTS execucao (chave TEXT PRIMARY KEY, valor TEXT)",
+        "CREATE TABLE IF NOT EXISTS clientes (sistema TEXT, id_sistema TEXT, registro TEXT, PRIMARY KEY (sistema, id_sistema))",
+        "CREATE TABLE IF NOT EXISTS parcelas (id INTEGER PRIMARY KEY, periodo TEXT, ordem_periodo INTEGER, seq INTEGER,"
+        " prioridade REAL, sistema TEXT, id_cliente TEXT, email TEXT, data_vencimento TEXT, status INTEGER, item TEXT)",
+        "CREATE INDEX IF NOT EXISTS idx_parcelas_periodo ON parcelas (periodo, seq)",
+        "CREATE INDEX IF NOT EXISTS idx_parcelas_vencimento ON parcelas (data_vencimento, status)",
+        "CREATE TABLE IF NOT EXISTS envios (parcela_id INTEGER PRIMARY KEY, periodo TEXT, desfecho TEXT, registrado_em TEXT)",
+        "CREATE INDEX IF NOT EXISTS idx_envios_desfecho ON envios (desfecho)",
+    )
+
+    def __init__(self, arquivo: str, duravel: bool = True):
+        self.arquivo = arquivo
+        self.duravel = duravel
+        if not duravel and os.path.exists(arquivo):
+            os.remove(arquivo)
+        self.conexao = sqlite3.connect(arquivo, check_same_thread=False, isolation_level=None)
+        if duravel:
+            self.conexao.execute("PRAGMA journal_mode=WAL")
+            self.conexao.execute("PRAGMA synchronous=NORMAL")
         else:
-            parcela, cliente, cliente_id, sistema_origem = item
-        nome = cliente['fields'].get('Nome do cliente', 'Sem nome')
-        email = cliente['fields'].get('Email', '')
-        if not email:
-            logging.warning(f"⚠️ Cliente {nome} sem e-mail, ID Airtable: {cliente.get('id', 'desconhecido')}")
-            stats["sem_email"] += 1
-            # log sem_email
-            log_disparo_supabase({
-                "sistema": sistema_origem,
-                "periodo": tipo,
-                "cliente_airtable_id": cliente.get('id'),
-                "cliente_sistema_id": cliente_id,
-                "nome": nome,
-                "email": None,
-                "valor_parcela": float(parcela.get("valor", 0) or 0),
-                "data_vencimento": parcela.get('data_vencimento'),
-                "link_pagamento": parcela.get("pdf_url", ""),
-                "status": "sem_email",
-                "sendgrid_status": None,
-                "sendgrid_message_id": None,
-                "error_message": "cliente_sem_email",
-                "request_payload": None,
-            })
-            continue
+            self.conexao.execute("PRAGMA journal_mode=OFF")
+            self.conexao.execute("PRAGMA synchronous=OFF")
+        for comando in self.ESQUEMA:
+            self.conexao.execute(comando)
+        self.lock = threading.Lock()
+        # Desfechos são gravados por outra conexão: no WAL não interferem no cursor que lê a fila
+        self._conexao_desfechos: Optional[sqlite3.Connection] = None
+
+    def executar_em_lote(self, comando: str, linhas) -> None:
+        with self.lock:
+            self.conexao.execute("BEGIN")
+            try:
+                self.conexao.executemany(comando, linhas)
+            except Exception:
+                self.conexao.execute("ROLLBACK")
+                raise
+            self.conexao.execute("COMMIT")
+
+    def obter_estado(self, chave: str) -> Optional[str]:
+        linha = self.conexao.execute("SELECT valor FROM execucao WHERE chave = ?", (chave,)).fetchone()
+        return linha[0] if linha else None
 
-        vencimento_str = parcela.get('data_vencimento', '')
+    def definir_estado(self, chave: str, valor: str) -> None:
+        with self.lock:
+            self.conexao.execute("INSERT OR REPLACE INTO execucao VALUES (?, ?)", (chave, valor))
+
+    def iniciar_dia(self, hoje_iso: str) -> bool:
+        """
+        Retorna True se há uma execução de hoje a retomar (fase de envio iniciada e não concluída,
+        inclusive se a invocação anterior morreu no meio). Senão, zera o armazém para uma execução nova.
+        """
+        if self.obter_estado("data") == hoje_iso and self.obter_estado("fase") in ("envio", "interrompida"):
+            return True
+        with self.lock:
+            self.conexao.execute("BEGIN")
+            for tabela in ("execucao", "clientes", "parcelas", "envios"):
+                self.conexao.execute(f"DELETE FROM {tabela}")
+            self.conexao.execute("INSERT INTO execucao VALUES ('data', ?)", (hoje_iso,))
+            self.conexao.execute("INSERT INTO execucao VALUES ('fase', 'coleta')")
+            self.conexao.execute("COMMIT")
+        return False
+
+    def registrar_desfechos(self, desfechos: List[Tuple[int, str, str]]) -> None:
+        """desfechos: (parcela_id, período, desfecho). Uma parcela guarda só o desfecho mais recente. Só no armazém durável."""
+        if not self.duravel:
+            return
+        agora = datetime.now(timezone.utc).isoformat()
+        with self.lock:
+            if self._conexao_desfechos is None:
+                self._conexao_desfechos = sqlite3.connect(self.arquivo, check_same_thread=False, isolation_level=None, timeout=30)
+                self._conexao_desfechos.execute("PRAGMA synchronous=NORMAL")
+            self._conexao_desfechos.execute("BEGIN")
+            self._conexao_desfechos.executemany("INSERT OR REPLACE INTO envios VALUES (?, ?, ?, ?)",
+                                                [(parcela_id, periodo, desfecho, agora) for parcela_id, periodo, desfecho in desfechos])
+            self._conexao_desfechos.execute("COMMIT")
+
+    def fechar(self) -> None:
+        """Consolida o WAL no arquivo principal, deixando um único .sqlite autocontido para inspeção."""
         try:
-            dados = {
-                'cliente': nome,
-                'valor': parcela.get("valor", 0),
-                'data_vencimento': formatar_data_brasileira(vencimento_str),
-                'link_pagamento': parcela.get("pdf_url", ""),
-                'status': 'venceu ontem' if tipo == 'venceu_ontem' else 'hoje' if tipo == 'vence_hoje' else 'amanhã',
-            }
+            if self._conexao_desfechos is not None:
+                self._conexao_desfechos.close()
+            if self.duravel:
+                self.conexao.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            self.conexao.close()
+        except sqlite3.Error as e:
+            logging.warning(f"[ARMAZEM] Falha ao fechar {self.arquivo}: {str(e)}")
+
+def abrir_armazem_execucao() -> Optional[ArmazemExecucao]:
+    """Abre o armazém durável da execução (ARMAZEM_EXECUCAO_ARQUIVO), ou None se desabilitado ou ilegível."""
+    if not ARMAZEM_EXECUCAO_ARQUIVO:
+        return None
+    try:
+        return ArmazemExecucao(ARMAZEM_EXECUCAO_ARQUIVO)
+    except sqlite3.Error as e:
+        logging.warning(f"[ARMAZEM] Falha ao abrir {ARMAZEM_EXECUCAO_ARQUIVO}: {str(e)}. Seguindo em memória.")
+        if os.path.exists(ARMAZEM_EXECUCAO_ARQUIVO):
+            os.remove(ARMAZEM_EXECUCAO_ARQUIVO)
+        return None
 
-            payload = montar_email_sendgrid(email, nome, dados, tipo)
-            sucesso, status_code, message_id, error_message = enviar_email_sendgrid(payload)
-            if sucesso:
-                stats["enviados"] += 1
+def armazem_descarga(nome: str) -> ArmazemExecucao:
+    """Armazém descartável para a descarga de memória quando não há armazém da execução."""
+    return ArmazemExecucao(os.path.join(MEMORIA_DIRETORIO_DESCARGA, nome), duravel=False)
+
+class ClientesEmDisco(Mapping):
+    """Clientes de um sistema (id -> registro Airtable) guardados no armazém; mesma interface de leitura do dicionário."""
+
+    def __init__(self, armazem: ArmazemExecucao, sistema: str):
+        self._armazem = armazem
+        self._sistema = sistema
+        self._total = armazem.conexao.execute("SELECT COUNT(*) FROM clientes WHERE sistema = ?", (sistema,)).fetchone()[0]
+
+    def __getitem__(self, id_sistema: str) -> Dict:
+        linha = self._armazem.conexao.execute("SELECT registro FROM clientes WHERE sistema = ? AND id_sistema = ?",
+                                              (self._sistema, id_sistema)).fetchone()
+        if linha is None:
+            raise KeyError(id_sistema)
+        return json_decodificar(linha[0])
+
+    def __iter__(self):
+        return (linha[0] for linha in self._armazem.conexao.execute("SELECT id_sistema FROM clientes WHERE sistema = ? ORDER BY rowid", (self._sistema,)))
+
+    def __len__(self) -> int:
+        return self._total
+
+    def items(self):
+        consulta = "SELECT id_sistema, registro FROM clientes WHERE sistema = ? ORDER BY rowid"
+        return ((id_sistema, json_decodificar(registro)) for id_sistema, registro in self._armazem.conexao.execute(consulta, (self._sistema,)))
+
+def guardar_clientes(armazem: ArmazemExecucao, clientes_por_sistema: Dict[str, Dict[str, Dict]]) -> Dict[str, ClientesEmDisco]:
+    """Grava o índice de clientes no armazém e devolve, por sistema, a visão em disco que o substitui."""
+    armazem.executar_em_lote("INSERT OR REPLACE INTO clientes VALUES (?, ?, ?)",
+                             ((sistema, id_sistema, json_codificar(registro))
+                              for sistema, clientes in clientes_por_sistema.items() for id_sistema, registro in clientes.items()))
+    return {sistema: ClientesEmDisco(armazem, sistema) for sistema in clientes_por_sistema}
+
+class PeriodoEmDisco(Sequence):
+    """Visão das parcelas pendentes de um período em ParcelasEmDisco; aceita len, iteração, fatia [:n] e extend."""
+
+    def __init__(self, parcelas: "ParcelasEmDisco", periodo: str, limite: Optional[int] = None):
+        self._parcelas = parcelas
+        self._periodo = periodo
+        self._limite = limite
+
+    def __len__(self) -> int:
+        return self._parcelas.contar(self._periodo, self._limite)
+
+    def __iter__(self):
+        return self._parcelas.iterar(self._periodo, self._limite)
+
+    def __getitem__(self, indice):
+        if isinstance(indice, slice) and indice.start is None and indice.step is None and indice.stop is not None:
+            limite = indice.stop if self._limite is None else min(indice.stop, self._limite)
+            return PeriodoEmDisco(self._parcelas, self._periodo, limite)
+        return list(self)[indice]
+
+    def extend(self, itens) -> None:
+        self._parcelas.adicionar(self._periodo, itens)
+
+class ParcelasEmDisco(Mapping):
+    """
+    Parcelas classificadas (período -> itens) no armazém, lidas como o dicionário de listas do
+    pipeline. Só enxerga as pendentes (sem desfecho ou adiadas), o que torna a retomada uma simples
+    releitura. A fila de envio sai ordenada por prioridade direto do disco, sem materializar tudo.
+    `limite` nas fatias vale sobre a ordem de classificação do dia (seq), inclusive numa retomada.
+    """
+
+    PENDENTE = "id NOT IN (SELECT parcela_id FROM envios WHERE desfecho != 'adiados')"
+
+    def __init__(self, armazem: ArmazemExecucao):
+        self._armazem = armazem
+        self._ordem_periodos = {periodo: i for i, periodo in enumerate(JANELAS_PERIODO)}
+        self._proximo_seq = {periodo: 0 for periodo in JANELAS_PERIODO}
+        for periodo, maximo in armazem.conexao.execute("SELECT periodo, MAX(seq) FROM parcelas GROUP BY periodo"):
+            if periodo in self._proximo_seq:
+                self._proximo_seq[periodo] = maximo + 1
+
+    def adicionar(self, periodo: str, itens) -> None:
+        linhas = []
+        for item in itens:
+            parcela = item[0]
+            linhas.append((periodo, self._ordem_periodos[periodo], self._proximo_seq[periodo], prioridade_envio(periodo, parcela),
+                           item[3] if len(item) > 3 else 'credilly', item[2], normalizar_email(item[1]['fields'].get('Email', '')),
+                           parcela.get("data_vencimento"), parcela.get("status"), json_codificar(item)))
+            self._proximo_seq[periodo] += 1
+        self._armazem.executar_em_lote("INSERT INTO parcelas (periodo, ordem_periodo, seq, prioridade, sistema, id_cliente,"
+                                       " email, data_vencimento, status, item) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", linhas)
+
+    def _limite_seq(self, periodo: str, limite: Optional[int]) -> int:
+        return self._proximo_seq[periodo] if limite is None else limite
+
+    def contar(self, periodo: str, limite: Optional[int] = None) -> int:
+        consulta = f"SELECT COUNT(*) FROM parcelas WHERE periodo = ? AND seq < ? AND {self.PENDENTE}"
+        return self._armazem.conexao.execute(consulta, (periodo, self._limite_seq(periodo, limite))).fetchone()[0]
+
+    def iterar(self, periodo: str, limite: Optional[int] = None):
+        consulta = f"SELECT item FROM parcelas WHERE periodo = ? AND seq < ? AND {self.PENDENTE} ORDER BY seq"
+        for (item,) in self._armazem.conexao.execute(consulta, (periodo, self._limite_seq(periodo, limite))):
+            yield tuple(json_decodificar(item))
+
+    def fila_ordenada(self, limites: Dict[str, Optional[int]], consolidar: bool = False):
+        """
+        Entradas (prioridade, período, itens, ids das parcelas) em ordem decrescente de prioridade; empates
+        na ordem de inserção, como o sort em memória. Com `consolidar`, cada entrada reúne as parcelas do
+        mesmo e-mail no período (prioridade como em prioridade_grupo).
+        """
+        filtros = " OR ".join("(periodo = ? AND seq < ?)" for _ in self._proximo_seq)
+        parametros = []
+        for periodo in self._proximo_seq:
+            parametros.extend((periodo, self._limite_seq(periodo, limites.get(periodo))))
+        if not consolidar:
+            self._armazem.conexao.execute("CREATE INDEX IF NOT EXISTS idx_parcelas_fila ON parcelas (prioridade DESC, ordem_periodo, seq)")
+            consulta = (f"SELECT prioridade, periodo, item, id FROM parcelas WHERE ({filtros}) AND {self.PENDENTE}"
+                        " ORDER BY prioridade DESC, ordem_periodo, seq")
+            for prioridade, periodo, item, parcela_id in self._armazem.conexao.execute(consulta, parametros):
+                yield prioridade, periodo, [tuple(json_decodificar(item))], [parcela_id]
+            return
+        agregado = "SUM" if ORDENAR_POR_VALOR else "MAX"
+        consulta = (f"SELECT {agregado}(prioridade), periodo, GROUP_CONCAT(id) FROM parcelas WHERE ({filtros}) AND {self.PENDENTE}"
+                    " GROUP BY periodo, CASE WHEN email = '' THEN 'id:' || id ELSE email END"
+                    " ORDER BY 1 DESC, MIN(ordem_periodo), MIN(seq)")
+        for prioridade, periodo, ids in self._armazem.conexao.execute(consulta, parametros):
+            ids = [int(parcela_id) for parcela_id in ids.split(",")]
+            linhas = self._armazem.conexao.execute(
+                f"SELECT id, item FROM parcelas WHERE id IN ({','.join('?' * len(ids))}) ORDER BY seq", ids).fetchall()
+            yield prioridade, periodo, [tuple(json_decodificar(item)) for _, item in linhas], [parcela_id for parcela_id, _ in linhas]
+
+    def registrar_desfechos(self, desfechos: List[Tuple[int, str, str]]) -> None:
+        self._armazem.registrar_desfechos(desfechos)
+
+    def __getitem__(self, periodo: str) -> PeriodoEmDisco:
+        if periodo not in self._proximo_seq:
+            raise KeyError(periodo)
+        return PeriodoEmDisco(self, periodo)
+
+    def __iter__(self):
+        return iter(self._proximo_seq)
+
+    def __len__(self) -> int:
+        return len(self._proximo_seq)
+
+def descarregar_parcelas_se_preciso(todas_parcelas, estagio: str):
+    """Move as parcelas classificadas para o disco se o RSS passou de MEMORIA_LIMITE_MB. Retorna o container a usar daqui em diante."""
+    if isinstance(todas_parcelas, ParcelasEmDisco) or not memoria_acima_do_limite():
+        return todas_parcelas
+    em_disco = ParcelasEmDisco(armazem_descarga("parcelas_descarga.sqlite"))
+    total = 0
+    for periodo in list(todas_parcelas):
+        itens = todas_parcelas.pop(periodo)
+        em_disco.adicionar(periodo, itens)
+        total += len(itens)
+    registrar_metrica("memoria.descargas")
+    logging.warning(f"💾 RSS acima de {MEMORIA_LIMITE_MB:.0f} MB após {estagio}; {total} parcelas movidas para SQLite em {MEMORIA_DIRETORIO_DESCARGA}")
+    return em_disco
+
+def carregar_checkpoint_adiados() -> Optional[Dict[str, List[Tuple[Dict, Dict, str, str]]]]:
+    """Lê os envios adiados por circuito aberto numa invocação anterior de hoje. Checkpoints de outros dias são descartados."""
+    if not CHECKPOINT_ARQUIVO or not os.path.exists(CHECKPOINT_ARQUIVO):
+        return None
+    try:
+        with open(CHECKPOINT_ARQUIVO, 'r', encoding='utf-8') as f:
+            dados = json.load(f)
+        os.remove(CHECKPOINT_ARQUIVO)
+    except Exception as e:
+        logging.warning(f"[CHECKPOINT] Falha ao ler {CHECKPOINT_ARQUIVO}: {str(e)}")
+        return None
+    if dados.get("data") != relogio_execucao()["hoje_iso"]:
+        logging.info("[CHECKPOINT] Checkpoint de outro dia descartado.")
+        return None
+    adiados = {periodo: [] for periodo in JANELAS_PERIODO}
+    for periodo, itens in dados.get("itens", {}).items():
+        if periodo in adiados:
+            adiados[periodo].extend(tuple(item) for item in itens)
+    return adiados
+
+def salvar_checkpoint_adiados(adiados: Dict[str, List[Tuple[Dict, Dict, str, str]]]) -> None:
+    """Grava os envios adiados para que a próxima invocação do dia os retome."""
+    if not CHECKPOINT_ARQUIVO or not any(adiados.values()):
+        return
+    try:
+        temporario = f"{CHECKPOINT_ARQUIVO}.tmp"
+        with open(temporario, 'w', encoding='utf-8') as f:
+            json.dump({"data": relogio_execucao()["hoje_iso"], "itens": adiados}, f)
+        os.replace(temporario, CHECKPOINT_ARQUIVO)
+        logging.warning(f"[CHECKPOINT] {sum(len(v) for v in adiados.values())} envios adiados gravados em {CHECKPOINT_ARQUIVO}")
+    except Exception as e:
+        logging.error(f"[CHECKPOINT] Falha ao gravar {CHECKPOINT_ARQUIVO}: {str(e)}")
+
+def registro_log_parcela(item: Tuple[Dict, Dict, str, str], tipo: str, email: Optional[str], status: str, **extras) -> Dict:
+    """Registro de log do Supabase para uma parcela; `extras` sobrescreve os campos do SendGrid/erro."""
+    parcela, cliente, cliente_id = item[0], item[1], item[2]
+    registro = {
+        "sistema": item[3] if len(item) > 3 else 'credilly',
+        "periodo": tipo,
+        "cliente_airtable_id": cliente.get('id'),
+        "cliente_sistema_id": cliente_id,
+        "nome": cliente['fields'].get('Nome do cliente', 'Sem nome'),
+        "email": email,
+        "valor_parcela": float(parcela.get("valor", 0) or 0),
+        "data_vencimento": parcela.get('data_vencimento'),
+        "link_pagamento": parcela.get("pdf_url", ""),
+        "status": status,
+        "sendgrid_status": None,
+        "sendgrid_message_id": None,
+        "error_message": None,
+        "request_payload": None,
+    }
+    registro.update(extras)
+    return registro
+
+def campos_log_bcc() -> Dict:
+    """Campos de BCC dos registros de envio (agendado/enviado/erro) no Supabase."""
+    bcc_aplicado = bool(BCC_ARQUIVO_EMAIL and BCC_SAMPLE_PERCENT and BCC_SAMPLE_PERCENT > 0)
+    return {
+        "bcc_aplicado": bcc_aplicado,
+        "bcc_email": BCC_ARQUIVO_EMAIL or None,
+        "bcc_sample_percent": BCC_SAMPLE_PERCENT if bcc_aplicado else None,
+    }
+
+def processar_item_envio(item: Tuple[Dict, Dict, str, str], tipo: str, agendamento: Optional[Dict] = None,
+                         vereditos_email: Optional[Dict[str, Optional[str]]] = None) -> str:
+    """
+    Envia (ou registra a impossibilidade de enviar) o e-mail de uma parcela.
+    Retorna a chave de stats do desfecho: enviados, sem_email, email_invalido, erros ou adiados.
+    """
+    parcela, cliente = item[0], item[1]
+    nome = cliente['fields'].get('Nome do cliente', 'Sem nome')
+    email = cliente['fields'].get('Email', '')
+    if not email:
+        log_item(logging.WARNING, "sem_email", "⚠️ Cliente %s sem e-mail, ID Airtable: %s", nome, cliente.get('id', 'desconhecido'),
+                 campos={"cliente_airtable_id": cliente.get('id'), "periodo": tipo})
+        log_disparo_supabase(registro_log_parcela(item, tipo, None, "sem_email", error_message="cliente_sem_email"))
+        return "sem_email"
+    motivo_invalido = None
+    if vereditos_email is not None:
+        # Só com a validação ligada (opt-in) o endereço é normalizado: segue para o envio a forma validada
+        email = normalizar_email(email)
+        motivo_invalido = vereditos_email.get(email)
+    if motivo_invalido:
+        log_item(logging.WARNING, "email_invalido", "⚠️ Cliente %s com e-mail inválido (%s): %s", nome, motivo_invalido, email,
+                 campos={"cliente_airtable_id": cliente.get('id'), "periodo": tipo, "motivo": motivo_invalido})
+        log_disparo_supabase(registro_log_parcela(item, tipo, email, "email_invalido", error_message=motivo_invalido))
+        return "email_invalido"
+
+    vencimento_str = parcela.get('data_vencimento', '')
+    try:
+        dados = {
+            'cliente': nome,
+            'valor': parcela.get("valor", 0),
+            'data_vencimento': formatar_data_brasileira(vencimento_str),
+            'link_pagamento': parcela.get("pdf_url", ""),
+            'status': 'venceu ontem' if tipo == 'venceu_ontem' else 'hoje' if tipo == 'vence_hoje' else 'amanhã',
+        }
+
+        payload = montar_email_sendgrid(email, nome, dados, tipo)
+        if agendamento:
+            payload["send_at"] = proximo_send_at(agendamento)
+            payload["batch_id"] = agendamento["batch_id"]
+        sucesso, status_code, message_id, error_message = enviar_email_sendgrid(payload)
+        if not sucesso and error_message in MOTIVOS_ADIAR_ENVIO:
+            # Nada foi enviado: o item volta para o checkpoint em vez de virar erro
+            return "adiados"
+        request_payload = {
+            "tipo": tipo,
+            "assunto_ou_template": payload.get('template_id') or payload.get('personalizations', [{}])[0].get('subject'),
+        }
+        if agendamento:
+            request_payload["batch_id"] = payload["batch_id"]
+            request_payload["send_at"] = payload["send_at"]
+
+        # log envio/erro
+        status = ("agendado" if agendamento else "enviado") if sucesso else "erro"
+        log_disparo_supabase(registro_log_parcela(
+            item, tipo, email, status,
+            sendgrid_status=status_code,
+            sendgrid_message_id=message_id,
+            error_message=error_message,
+            request_payload=request_payload,
+            **campos_log_bcc(),
+        ))
+        return "enviados" if sucesso else "erros"
+    except Exception as e:
+        logging.error(f"❌ Erro ao processar parcela: {str(e)}")
+        # log erro inesperado
+        log_disparo_supabase(registro_log_parcela(item, tipo, email, "erro", error_message=str(e)))
+        return "erros"
+
+def processar_grupo_envio(itens: List[Tuple[Dict, Dict, str, str]], tipo: str, agendamento: Optional[Dict] = None,
+                          vereditos_email: Optional[Dict[str, Optional[str]]] = None) -> str:
+    """
+    Envia um único e-mail para as parcelas de um mesmo destinatário (e-mail normalizado) no período,
+    com a lista de parcelas, links e o valor total, e registra cada parcela com o message id comum.
+    Retorna o desfecho do grupo, como processar_item_envio.
+    """
+    itens = sorted(itens, key=lambda item: item[0].get('data_vencimento') or '')
+    nome = itens[0][1]['fields'].get('Nome do cliente', 'Sem nome')
+    email = itens[0][1]['fields'].get('Email', '')
+    motivo_invalido = None
+    if vereditos_email is not None:
+        email = normalizar_email(email)
+        motivo_invalido = vereditos_email.get(email)
+    if motivo_invalido:
+        log_item(logging.WARNING, "email_invalido", "⚠️ Cliente %s com e-mail inválido (%s): %s (%s parcelas)", nome, motivo_invalido, email, len(itens),
+                 campos={"periodo": tipo, "motivo": motivo_invalido, "parcelas": len(itens)})
+        for item in itens:
+            log_disparo_supabase(registro_log_parcela(item, tipo, email, "email_invalido", error_message=motivo_invalido))
+        return "email_invalido"
+    try:
+        parcelas = [{
+            "valor": formatar_valor_moeda(float(item[0].get("valor", 0) or 0)),
+            "data_vencimento": formatar_data_brasileira(item[0].get('data_vencimento', '')),
+            "link_pagamento": item[0].get("pdf_url", ""),
+        } for item in itens]
+        dados = {
+            'cliente': nome,
+            'valor': sum(float(item[0].get("valor", 0) or 0) for item in itens),
+            'data_vencimento': parcelas[0]['data_vencimento'],
+            'link_pagamento': parcelas[0]['link_pagamento'],
+            'parcelas': parcelas,
+        }
+        payload = montar_email_sendgrid(email, nome, dados, tipo)
+        if agendamento:
+            payload["send_at"] = proximo_send_at(agendamento)
+            payload["batch_id"] = agendamento["batch_id"]
+        sucesso, status_code, message_id, error_message = enviar_email_sendgrid(payload)
+        if not sucesso and error_message in MOTIVOS_ADIAR_ENVIO:
+            return "adiados"
+        request_payload = {
+            "tipo": tipo,
+            "assunto_ou_template": payload.get('template_id') or payload.get('personalizations', [{}])[0].get('subject'),
+            "parcelas_consolidadas": len(itens),
+        }
+        if agendamento:
+            request_payload["batch_id"] = payload["batch_id"]
+            request_payload["send_at"] = payload["send_at"]
+        status = ("agendado" if agendamento else "enviado") if sucesso else "erro"
+        for item in itens:
+            log_disparo_supabase(registro_log_parcela(
+                item, tipo, email, status,
+                sendgrid_status=status_code,
+                sendgrid_message_id=message_id,
+                error_message=error_message,
+                request_payload=request_payload,
+                **campos_log_bcc(),
+            ))
+        if sucesso:
+            registrar_metrica("envio.emails_consolidados", len(itens) - 1)
+        return "enviados" if sucesso else "erros"
+    except Exception as e:
+        logging.error(f"❌ Erro ao processar parcelas consolidadas de {email}: {str(e)}")
+        for item in itens:
+            log_disparo_supabase(registro_log_parcela(item, tipo, email, "erro", error_message=str(e)))
+        return "erros"
+
+def prioridade_envio(tipo: str, parcela: Dict) -> float:
+    """Prioridade de um envio na fila única: peso do período, opcionalmente multiplicado pelo valor da parcela."""
+    peso = PESOS_PERIODO.get(tipo, 1.0)
+    if ORDENAR_POR_VALOR:
+        try:
+            return peso * float(parcela.get("valor", 0) or 0)
+        except (TypeError, ValueError):
+            return 0.0
+    return peso
+
+class EnviadosDoDia:
+    """
+    Parcelas enviadas (ou agendadas) hoje, no cache compartilhado: uma invocação paralela, um
+    shard sobreposto ou um retry em outro container pula o que outra já enviou ou está enviando
+    ("ja_enviados"). Antes de cada lote de RESERVAR_LOTE entradas da fila o conjunto é relido
+    (GET condicional: 304 enquanto ninguém mudou) e as chaves do lote que ninguém tem são
+    publicadas com escrita condicional ao ETag lido; se outra invocação gravou antes, relê, deixa
+    para ela o que ela reservou e tenta de novo. O que não terminou em "enviados" é liberado e
+    publicado no fim da fila. A mescla é a união, menos o que esta invocação liberou.
+    """
+
+    RESERVAR_LOTE = 50
+
+    def __init__(self):
+        self._chaves: set = set()
+        self._minhas: set = set()  # reservadas por esta execução: não contam como ja_enviados aqui
+        self._liberadas: set = set()  # reservas devolvidas ainda não publicadas
+        self._nome = ""
+        self._lock = threading.Lock()
+
+    @property
+    def habilitado(self) -> bool:
+        # Envios simulados (MODO_TESTE) não podem marcar parcelas como enviadas para a produção
+        return CACHE_COMPARTILHADO.habilitado and not MODO_TESTE
+
+    @staticmethod
+    def chave(item: Tuple[Dict, Dict, str, str]) -> str:
+        parcela = item[0]
+        sistema = item[3] if len(item) > 3 else 'credilly'
+        bruto = f"{sistema}|{item[2]}|{parcela.get('data_vencimento')}|{parcela.get('pdf_url') or ''}|{parcela.get('valor')}"
+        return hashlib.sha1(bruto.encode('utf-8')).hexdigest()[:16]
+
+    def carregar(self, hoje_iso: str) -> None:
+        with self._lock:
+            if self._nome != f"enviados_{hoje_iso}":
+                self._nome = f"enviados_{hoje_iso}"
+                self._chaves = set()
+                self._liberadas = set()
+            # O que uma execução anterior deste container enviou já é ja_enviados para esta
+            self._minhas = set()
+        self.reler()
+
+    def reler(self) -> None:
+        remoto = CACHE_COMPARTILHADO.obter(self._nome)
+        with self._lock:
+            self._chaves.update(set(remoto or ()) - self._liberadas)
+
+    def _mesclar(self, remoto, _local) -> List[str]:
+        with self._lock:
+            self._chaves.update(set(remoto) - self._liberadas)
+            return sorted(self._chaves)
+
+    def contem(self, item: Tuple[Dict, Dict, str, str]) -> bool:
+        """True se outra invocação (ou uma execução anterior) enviou ou reservou a parcela hoje."""
+        chave = self.chave(item)
+        return chave in self._chaves and chave not in self._minhas
+
+    def reservar(self, itens: List[Tuple[Dict, Dict, str, str]]) -> None:
+        """
+        Reserva para esta execução as parcelas de `itens` que ninguém tem; as que outra invocação
+        reservou antes passam a `contem`. Se a publicação falhar, as reservas ficam só locais (envia).
+        """
+        chaves = {self.chave(item) for item in itens}
+        self.reler()
+        with self._lock:
+            novas = chaves - self._chaves
+            if not novas:
+                return
+            self._chaves |= novas
+            self._minhas |= novas
+            objeto = sorted(self._chaves)
+
+        def mesclar(remoto, local):
+            # A escrita condicional perdeu: o que a outra invocação publicou nesse meio-tempo é dela
+            with self._lock:
+                self._minhas -= novas & set(remoto)
+            return self._mesclar(remoto, local)
+        if CACHE_COMPARTILHADO.publicar(self._nome, objeto, mesclar=mesclar):
+            registrar_metrica("envio.reservas_publicadas")
+
+    def liberar(self, itens: List[Tuple[Dict, Dict, str, str]]) -> None:
+        """Devolve as reservas de parcelas que esta execução não enviou (publicadas em `publicar`)."""
+        with self._lock:
+            for chave in {self.chave(item) for item in itens} & self._minhas:
+                self._minhas.discard(chave)
+                self._chaves.discard(chave)
+                self._liberadas.add(chave)
+
+    def publicar(self) -> None:
+        """Publica as reservas liberadas; chamado no fim da fila."""
+        with self._lock:
+            if not self._liberadas:
+                return
+            liberadas = set(self._liberadas)
+        self.reler()
+        with self._lock:
+            objeto = sorted(self._chaves)
+        if CACHE_COMPARTILHADO.publicar(self._nome, objeto, mesclar=self._mesclar):
+            with self._lock:
+                self._liberadas -= liberadas
+
+ENVIADOS_DO_DIA = EnviadosDoDia()
+
+def sincronizar_caches_compartilhados() -> None:
+    """Traz para os caches locais o que outros containers publicaram (início da execução e pré-aquecimento)."""
+    if not CACHE_COMPARTILHADO.habilitado:
+        return
+    CACHE_TENEX.sincronizar_compartilhado()
+    CACHE_PROXIMO_VENCIMENTO.sincronizar_compartilhado()
+    CACHE_VEREDITOS_EMAIL.sincronizar_compartilhado()
+
+class ControladorConcorrencia:
+    """
+    Limite AIMD de envios simultâneos ao SendGrid. Cada resposta saudável soma 1/limite
+    (≈ +1 por rodada de respostas). 429, 5xx e falha de conexão multiplicam o limite por `fator`
+    na hora, no máximo uma vez por latência de base, para uma rajada de 429 não derrubar o limite
+    até 1. Latência alta sozinha não corta nada: as respostas saudáveis são agrupadas em janelas
+    de `janela`; uma janela está congestionada se o p90 dela passar de `tolerancia` x a base e de
+    base + `folga`, e só `congestionadas` janelas seguidas multiplicam o limite por `fator`. A base
+    é a média móvel exponencial das medianas das janelas. O limite corrente fica na métrica
+    envio.concorrencia_limite.
+    """
+
+    ALFA_BASE = 0.2
+
+    def __init__(self, maximo: int, inicial: int = ENVIO_CONCORRENCIA_INICIAL,
+                 tolerancia: float = ENVIO_LATENCIA_TOLERANCIA, fator: float = ENVIO_FATOR_REDUCAO,
+                 janela: int = ENVIO_LATENCIA_JANELA, folga: float = ENVIO_LATENCIA_FOLGA_S,
+                 congestionadas: int = ENVIO_JANELAS_CONGESTIONADAS):
+        self.maximo = max(1, maximo)
+        self.limite = float(min(max(1, inicial), self.maximo))
+        self.tolerancia = tolerancia
+        self.fator = fator
+        self.janela = max(1, janela)
+        self.folga = folga
+        self.congestionadas = max(1, congestionadas)
+        self.latencia_base: Optional[float] = None
+        self.em_voo = 0
+        self._amostras: List[float] = []
+        self._janelas_congestionadas = 0
+        self._ultima_reducao = 0.0
+        self._condicao = threading.Condition()
+        definir_metrica("envio.concorrencia_limite", self.limite)
+
+    def adquirir(self) -> None:
+        with self._condicao:
+            while self.em_voo >= int(self.limite):
+                self._condicao.wait()
+            self.em_voo += 1
+
+    def liberar(self) -> None:
+        with self._condicao:
+            self.em_voo -= 1
+            self._condicao.notify_all()
+
+    def _reduzir(self) -> None:
+        self.limite = max(1.0, self.limite * self.fator)
+        self._janelas_congestionadas = 0
+        registrar_metrica("envio.concorrencia_reducoes")
+
+    def _fechar_janela(self) -> bool:
+        """Fecha a janela de amostras; True se ela completou a sequência de janelas congestionadas."""
+        amostras = sorted(self._amostras)
+        self._amostras = []
+        mediana = amostras[len(amostras) // 2]
+        p90 = amostras[min(len(amostras) - 1, int(len(amostras) * 0.9))]
+        base = self.latencia_base
+        if base is None:
+            self.latencia_base = mediana
+            return False
+        if p90 > base * self.tolerancia and p90 > base + self.folga:
+            self._janelas_congestionadas += 1
+            registrar_metrica("envio.concorrencia_janelas_congestionadas")
+        else:
+            self._janelas_congestionadas = 0
+        self.latencia_base = base + self.ALFA_BASE * (mediana - base)
+        return self._janelas_congestionadas >= self.congestionadas
+
+    def observar(self, latencia: float, status: Optional[int]) -> None:
+        sobrecarga = status is None or status == 429 or status >= 500
+        with self._condicao:
+            if sobrecarga:
+                # 429 e falhas costumam voltar rápido; não entram nas janelas de latência
+                agora = time.monotonic()
+                if agora - self._ultima_reducao < (self.latencia_base or latencia):
+                    return
+                self._ultima_reducao = agora
+                self._reduzir()
             else:
-                stats["erros"] += 1
-
-            # log envio/erro
-            log_disparo_supabase({
-                "sistema": sistema_origem,
-                "periodo": tipo,
-                "cliente_airtable_id": cliente.get('id'),
-                "cliente_sistema_id": cliente_id,
-                "nome": nome,
-                "email": email,
-                "valor_parcela": float(parcela.get("valor", 0) or 0),
-                "data_vencimento": parcela.get('data_vencimento'),
-                "link_pagamento": parcela.get("pdf_url", ""),
-                "status": "enviado" if sucesso else "erro",
-                "sendgrid_status": status_code,
-                "sendgrid_message_id": message_id,
-                "error_message": error_message,
-                "bcc_aplicado": bool(BCC_ARQUIVO_EMAIL and BCC_SAMPLE_PERCENT and BCC_SAMPLE_PERCENT > 0),
-                "bcc_email": BCC_ARQUIVO_EMAIL or None,
-                "bcc_sample_percent": BCC_SAMPLE_PERCENT if (BCC_SAMPLE_PERCENT and BCC_SAMPLE_PERCENT > 0) else None,
-                "request_payload": {
-                    "tipo": tipo,
-                    "assunto_ou_template": payload.get('template_id') or payload.get('personalizations', [{}])[0].get('subject'),
-                },
-            })
-        except Exception as e:
-            logging.error(f"❌ Erro ao processar parcela: {str(e)}")
-            stats["erros"] += 1
-            # log erro inesperado
-            log_disparo_supabase({
-                "sistema": sistema_origem,
-                "periodo": tipo,
-                "cliente_airtable_id": cliente.get('id'),
-                "cliente_sistema_id": cliente_id,
-                "nome": nome,
-                "email": email,
-                "valor_parcela": float(parcela.get("valor", 0) or 0),
-                "data_vencimento": parcela.get('data_vencimento'),
-                "link_pagamento": parcela.get("pdf_url", ""),
-                "status": "erro",
-                "sendgrid_status": None,
-                "sendgrid_message_id": None,
-                "error_message": str(e),
-                "request_payload": None,
-            })
+                self._amostras.append(latencia)
+                if len(self._amostras) >= self.janela and self._fechar_janela():
+                    self._ultima_reducao = time.monotonic()
+                    self._reduzir()
+                else:
+                    self.limite = min(float(self.maximo), self.limite + 1.0 / self.limite)
+            definir_metrica("envio.concorrencia_limite", round(self.limite, 2))
+            self._condicao.notify_all()
 
-        if PAUSAR_ENTRE_ENVIO > 0:
-            time.sleep(PAUSAR_ENTRE_ENVIO)
+def prioridade_grupo(tipo: str, itens: List[Tuple[Dict, Dict, str, str]]) -> float:
+    """Prioridade de um e-mail consolidado: soma das parcelas se ordenando por valor (valor total); senão, o peso do período."""
+    prioridades = [prioridade_envio(tipo, item[0]) for item in itens]
+    return sum(prioridades) if ORDENAR_POR_VALOR else max(prioridades)
 
-    return stats
+def agrupar_por_destinatario(tipo: str, itens) -> List[Tuple[float, str, List[Tuple[Dict, Dict, str, str]], List[Optional[int]]]]:
+    """Entradas da fila com os itens de um período agrupados por e-mail normalizado; itens sem e-mail ficam sozinhos."""
+    grupos: Dict[str, List[Tuple[Dict, Dict, str, str]]] = {}
+    for i, item in enumerate(itens):
+        email = normalizar_email(item[1]['fields'].get('Email', ''))
+        grupos.setdefault(email or f"#{i}", []).append(item)
+    return [(prioridade_grupo(tipo, grupo), tipo, grupo, [None] * len(grupo)) for grupo in grupos.values()]
+
+def processar_fila_prioridade(todas_parcelas: Dict[str, List[Tuple[Dict, Dict, str, str]]],
+                              adiados: Optional[Dict[str, List[Tuple[Dict, Dict, str, str]]]] = None,
+                              agendamento: Optional[Dict] = None,
+                              vereditos_email: Optional[Dict[str, Optional[str]]] = None,
+                              prazo: Optional[float] = None) -> Dict[str, Dict]:
+    """
+    Processa todos os períodos numa fila única ordenada por prioridade (ver prioridade_envio),
+    com ENVIO_CONCORRENCIA workers compartilhados entre os períodos (com ENVIO_CONCORRENCIA_ADAPTATIVA,
+    quantos enviam ao mesmo tempo é decidido pelo ControladorConcorrencia). Cada entrada da fila é um
+    e-mail: uma parcela ou, com CONSOLIDAR_POR_DESTINATARIO, as parcelas do mesmo destinatário no
+    período. Se o circuito do SendGrid abrir ou o prazo (time.monotonic) acabar, o que sobrou da
+    fila vai para `adiados`. Retorna as stats por período (contadas por parcela).
+    """
+    limites = {"venceu_ontem": LIMITE_VENCIDAS, "vence_hoje": LIMITE_HOJE, "vence_amanha": LIMITE_AMANHA}
+    stats_geral = {}
+    total_fila = 0
+    for tipo, parcelas in todas_parcelas.items():
+        stats_geral[tipo] = {"total": len(parcelas), "enviados": 0, "ja_enviados": 0, "sem_email": 0, "email_invalido": 0, "erros": 0, "adiados": 0}
+        limite = limites.get(tipo)
+        if limite:
+            logging.info(f"📋 Limitando {tipo} a {limite} e-mails")
+        total_fila += min(len(parcelas), limite) if limite else len(parcelas)
+    if isinstance(todas_parcelas, ParcelasEmDisco):
+        fila = todas_parcelas.fila_ordenada(limites, consolidar=CONSOLIDAR_POR_DESTINATARIO)
+    else:
+        lista = []
+        for tipo, parcelas in todas_parcelas.items():
+            limite = limites.get(tipo)
+            selecionadas = parcelas[:limite] if limite else parcelas
+            if CONSOLIDAR_POR_DESTINATARIO:
+                lista.extend(agrupar_por_destinatario(tipo, selecionadas))
+            else:
+                lista.extend((prioridade_envio(tipo, item[0]), tipo, [item], [None]) for item in selecionadas)
+        # sorted é estável: em empate de prioridade, mantém a ordem original
+        lista.sort(key=lambda entrada: -entrada[0])
+        fila = iter(lista)
+
+    lock = threading.Lock()
+    interrompido = [None]
+    disjuntor_sendgrid = DISJUNTORES["sendgrid"]
+    # Entradas já tiradas da fila e reservadas no ENVIADOS_DO_DIA, ainda não entregues a um worker
+    reservadas: deque = deque()
+
+    def proximo_da_fila() -> Optional[Tuple[str, List[Tuple[Dict, Dict, str, str]], List[Optional[int]]]]:
+        with lock:
+            if interrompido[0]:
+                return None
+            if not disjuntor_sendgrid.disponivel():
+                interrompido[0] = "circuito do SendGrid aberto"
+                return None
+            if prazo is not None and time.monotonic() >= prazo:
+                interrompido[0] = "prazo da execução esgotado"
+                return None
+            if ENVIADOS_DO_DIA.habilitado:
+                if not reservadas:
+                    # Uma ida ao cache compartilhado por lote; os outros workers esperam no lock
+                    lote = list(islice(fila, EnviadosDoDia.RESERVAR_LOTE))
+                    if lote:
+                        ENVIADOS_DO_DIA.reservar([item for _, _, itens, _ in lote for item in itens])
+                    reservadas.extend(lote)
+                entrada = reservadas.popleft() if reservadas else None
+            else:
+                entrada = next(fila, None)
+            if entrada is None:
+                return None
+            _, tipo, itens, parcela_ids = entrada
+            return tipo, itens, parcela_ids
+
+    controlador: Optional[ControladorConcorrencia] = None
+    if ENVIADOS_DO_DIA.habilitado:
+        ENVIADOS_DO_DIA.carregar(relogio_execucao()["hoje_iso"])
+
+    def descartar_ja_enviados(tipo: str, itens: List[Tuple[Dict, Dict, str, str]], parcela_ids: List[Optional[int]]):
+        """Contabiliza como ja_enviados as parcelas que outra invocação enviou hoje; devolve as demais."""
+        repetidos = {i for i, item in enumerate(itens) if ENVIADOS_DO_DIA.contem(item)}
+        if not repetidos:
+            return itens, parcela_ids
+        ids_repetidos = [parcela_ids[i] for i in repetidos if parcela_ids[i] is not None]
+        if ids_repetidos:
+            todas_parcelas.registrar_desfechos([(parcela_id, tipo, "ja_enviados") for parcela_id in ids_repetidos])
+        with lock:
+            stats_geral[tipo]["ja_enviados"] += len(repetidos)
+        restantes = [i for i in range(len(itens)) if i not in repetidos]
+        return [itens[i] for i in restantes], [parcela_ids[i] for i in restantes]
+
+    def worker() -> None:
+        while True:
+            if controlador is not None:
+                controlador.adquirir()
+            try:
+                proximo = proximo_da_fila()
+                if proximo is None:
+                    return
+                tipo, itens, parcela_ids = proximo
+                if ENVIADOS_DO_DIA.habilitado:
+                    ENVIADOS_DO_DIA.reler()
+                    itens, parcela_ids = descartar_ja_enviados(tipo, itens, parcela_ids)
+                    if not itens:
+                        continue
+                if len(itens) == 1:
+                    desfecho = processar_item_envio(itens[0], tipo, agendamento, vereditos_email)
+                else:
+                    desfecho = processar_grupo_envio(itens, tipo, agendamento, vereditos_email)
+            finally:
+                if controlador is not None:
+                    controlador.liberar()
+            if desfecho not in ("enviados", "ja_enviados") and ENVIADOS_DO_DIA.habilitado:
+                ENVIADOS_DO_DIA.liberar(itens)
+            ids_armazem = [parcela_id for parcela_id in parcela_ids if parcela_id is not None]
+            if ids_armazem:
+                todas_parcelas.registrar_desfechos([(parcela_id, tipo, desfecho) for parcela_id in ids_armazem])
+            with lock:
+                stats_geral[tipo][desfecho] += len(itens)
+                if desfecho == "adiados" and adiados is not None:
+                    adiados.setdefault(tipo, []).extend(itens)
+            if PAUSAR_ENTRE_ENVIO > 0:
+                time.sleep(PAUSAR_ENTRE_ENVIO)
+
+    concorrencia = max(1, min(ENVIO_CONCORRENCIA, total_fila))
+    if concorrencia == 1:
+        worker()
+    else:
+        if ENVIO_CONCORRENCIA_ADAPTATIVA:
+            controlador = ControladorConcorrencia(concorrencia)
+            OBSERVADORES_REQUISICAO["sendgrid"] = controlador.observar
+        try:
+            with ThreadPoolExecutor(max_workers=concorrencia, thread_name_prefix="envio") as executor:
+                for futuro in [executor.submit(worker) for _ in range(concorrencia)]:
+                    futuro.result()
+        finally:
+            OBSERVADORES_REQUISICAO.pop("sendgrid", None)
+        if controlador is not None:
+            logging.info(f"🎚️ Concorrência adaptativa: limite final {controlador.limite:.1f} de {concorrencia}, "
+                         f"latência de base {(controlador.latencia_base or 0) * 1000:.0f}ms")
+    restantes = list(reservadas) + list(fila) if interrompido[0] else []
+    if ENVIADOS_DO_DIA.habilitado:
+        ENVIADOS_DO_DIA.liberar([item for _, _, itens, _ in restantes for item in itens])
+        ENVIADOS_DO_DIA.publicar()
+
+    if interrompido[0]:
+        for _, tipo, itens, _ in restantes:
+            stats_geral[tipo]["adiados"] += len(itens)
+            if adiados is not None:
+                adiados.setdefault(tipo, []).extend(itens)
+        if isinstance(todas_parcelas, ParcelasEmDisco):
+            todas_parcelas.registrar_desfechos([(parcela_id, tipo, "adiados") for _, tipo, _, parcela_ids in restantes
+                                                for parcela_id in parcela_ids if parcela_id is not None])
+        logging.error(f"❌ {interrompido[0]}; {sum(len(itens) for _, _, itens, _ in restantes)} envios adiados")
+    return stats_geral
 
 def enviar_teste_template_unico(email_destino: str, tipo: str) -> None:
     """Envia um único e-mail usando o fluxo de template, sem Airtable/Tenex."""
     nome = "Teste"
+    hoje_iso = relogio_execucao()["hoje_iso"]
     dados = {
         'cliente': nome,
         'valor': 123.45,
-        'data_vencimento': formatar_data_brasileira(datetime.now().strftime('%Y-%m-%d')),
+        'data_vencimento': formatar_data_brasileira(hoje_iso),
         'link_pagamento': 'https://exemplo.com/pagar',
         'status': 'venceu ontem' if tipo == 'venceu_ontem' else 'hoje' if tipo == 'vence_hoje' else 'amanhã',
     }
@@ -503,7 +3170,7 @@ def enviar_teste_template_unico(email_destino: str, tipo: str) -> None:
         "nome": nome,
         "email": email_destino,
         "valor_parcela": float(dados['valor']),
-        "data_vencimento": datetime.now().strftime('%Y-%m-%d'),
+        "data_vencimento": hoje_iso,
         "link_pagamento": dados['link_pagamento'],
         "status": "enviado" if sucesso else "erro",
         "sendgrid_status": status_code,
@@ -525,12 +3192,12 @@ def enviar_teste_template_unico(email_destino: str, tipo: str) -> None:
 
 def enviar_teste_com_dados_reais(email_destino: str, periodo_preferencial: Optional[str] = None) -> None:
     """Busca dados reais (Airtable + Tenex), escolhe uma parcela e envia para o email_destino."""
-    clientes_dict = buscar_todos_clientes_airtable()
-    if not clientes_dict:
+    clientes_por_sistema = buscar_todos_clientes_airtable()
+    if not clientes_por_sistema['credilly']:
         logging.error("[TESTE-REAIS] Nenhum cliente encontrado no Airtable")
         return
 
-    parcelas_por_periodo = buscar_parcelas_por_periodo(clientes_dict, 'credilly')
+    parcelas_por_periodo = buscar_parcelas_por_periodo(clientes_por_sistema, 'credilly')
 
     ordem = [periodo_preferencial] if periodo_preferencial in ("venceu_ontem", "vence_hoje", "vence_amanha") else ["vence_hoje", "venceu_ontem", "vence_amanha"]
     escolhido = None
@@ -545,7 +3212,7 @@ def enviar_teste_com_dados_reais(email_destino: str, periodo_preferencial: Optio
         logging.error("[TESTE-REAIS] Não há parcelas disponíveis em ontem/hoje/amanhã")
         return
 
-    parcela, cliente, cliente_id = escolhido
+    parcela, cliente, cliente_id, _sistema = escolhido
     nome = cliente['fields'].get('Nome do cliente', 'Sem nome')
     vencimento_str = parcela.get('data_vencimento', '')
     dados = {
@@ -585,29 +3252,104 @@ def enviar_teste_com_dados_reais(email_destino: str, periodo_preferencial: Optio
     else:
         logging.error(f"[TESTE-REAIS] Falha ao enviar para {email_destino}: {error_message}")
 
-def processar_envio_email():
+def processar_envio_email(preparar: bool = False, prazo: Optional[float] = None) -> Optional[str]:
+    """
+    Executa o pipeline completo. Com preparar=True, agenda os envios do dia no SendGrid
+    (send_at + batch_id) em vez de enviá-los agora, marca o dia como preparado e retorna o batch_id.
+    Num dia já preparado, nem a invocação normal na janela nem outra preparação buscam e enviam as
+    parcelas de novo: só é retomado o que a preparação deixou pendente (adiados/checkpoint), e a
+    preparação repetida devolve o batch_id existente. Cancelar o batch (acao=cancelar_agendamento)
+    desfaz a marca. `prazo` (time.monotonic) limita a fase de envio; o restante vai para o checkpoint.
+    """
     inicio = time.time()
     logging.info("\n" + "="*60)
     logging.info("📧 SISTEMA DE E-MAILS - MÚLTIPLOS PERÍODOS")
     logging.info("="*60)
-    logging.info(f"📅 Data/Hora: {datetime.now().strftime('%d/%m/%Y %H:%M:%S')}")
-    logging.info(f"🔧 Modo: {'TESTE' if MODO_TESTE else 'PRODUÇÃO'}")
+    logging.info(f"📅 Data/Hora: {relogio_execucao()['agora'].strftime('%d/%m/%Y %H:%M:%S')}")
+    modo = 'TESTE' if MODO_TESTE else 'CARGA' if MODO_CARGA else 'PRODUÇÃO'
+    logging.info(f"🔧 Modo: {modo}{' (preparação antecipada)' if preparar else ''}")
     logging.info(f"📊 Sistemas: {'Credilly' if PROCESSAR_CREDILLY else ''} {'Turing' if PROCESSAR_TURING else ''}")
     logging.info("="*60 + "\n")
-    clientes_dict = buscar_todos_clientes_airtable()
-    if not clientes_dict:
-        logging.error("❌ Nenhum cliente encontrado no Airtable")
-        return
-    todas_parcelas = {"venceu_ontem": [], "vence_hoje": [], "vence_amanha": []}
-    if PROCESSAR_CREDILLY:
-        parcelas_credilly = buscar_parcelas_por_periodo(clientes_dict, 'credilly')
-        for periodo, parcelas in parcelas_credilly.items():
-            todas_parcelas[periodo].extend(parcelas)
-    if PROCESSAR_TURING:
-        parcelas_turing = buscar_parcelas_por_periodo(clientes_dict, 'turing')
-        for periodo, parcelas in parcelas_turing.items():
-            todas_parcelas[periodo].extend(parcelas)
-    stats_geral = {"venceu_ontem": processar_parcelas_periodo(todas_parcelas["venceu_ontem"], "venceu_ontem", LIMITE_VENCIDAS), "vence_hoje": processar_parcelas_periodo(todas_parcelas["vence_hoje"], "vence_hoje", LIMITE_HOJE), "vence_amanha": processar_parcelas_periodo(todas_parcelas["vence_amanha"], "vence_amanha", LIMITE_AMANHA)}
+    sincronizar_caches_compartilhados()
+    armazem = abrir_armazem_execucao()
+    if armazem is not None:
+        todas_parcelas = ParcelasEmDisco(armazem) if armazem.iniciar_dia(relogio_execucao()["hoje_iso"]) else None
+    else:
+        todas_parcelas = carregar_checkpoint_adiados()
+    batch_preparado = batch_preparado_hoje() if todas_parcelas is None else None
+    if todas_parcelas is not None:
+        logging.info(f"♻️ Retomando {sum(len(v) for v in todas_parcelas.values())} envios pendentes da execução anterior")
+    elif batch_preparado:
+        logging.info(f"🗓️ Envios de hoje já agendados no batch {batch_preparado}; nada a enviar nesta invocação")
+        registrar_metrica("agendamento.dia_ja_preparado")
+        if armazem is not None:
+            armazem.fechar()
+        return batch_preparado
+    else:
+        with medir_estagio("airtable"):
+            clientes_por_sistema = buscar_todos_clientes_airtable()
+        if not any(clientes_por_sistema.values()):
+            logging.error("❌ Nenhum cliente encontrado no Airtable")
+            if armazem is not None:
+                armazem.fechar()
+            return
+        if armazem is not None:
+            clientes_por_sistema = guardar_clientes(armazem, clientes_por_sistema)
+        elif memoria_acima_do_limite():
+            logging.warning(f"💾 RSS acima de {MEMORIA_LIMITE_MB:.0f} MB após o Airtable; índice de clientes movido para SQLite")
+            registrar_metrica("memoria.descargas")
+            clientes_por_sistema = guardar_clientes(armazem_descarga("clientes_descarga.sqlite"), clientes_por_sistema)
+        todas_parcelas = ParcelasEmDisco(armazem) if armazem is not None else {periodo: [] for periodo in JANELAS_PERIODO}
+        if PROCESSAR_CREDILLY:
+            with medir_estagio("tenex_credilly"):
+                parcelas_credilly = buscar_parcelas_por_periodo(clientes_por_sistema, 'credilly')
+            for periodo, parcelas in parcelas_credilly.items():
+                todas_parcelas[periodo].extend(parcelas)
+            del parcelas_credilly
+            todas_parcelas = descarregar_parcelas_se_preciso(todas_parcelas, "tenex_credilly")
+        if PROCESSAR_TURING:
+            with medir_estagio("tenex_turing"):
+                parcelas_turing = buscar_parcelas_por_periodo(clientes_por_sistema, 'turing')
+            for periodo, parcelas in parcelas_turing.items():
+                todas_parcelas[periodo].extend(parcelas)
+            del parcelas_turing
+            todas_parcelas = descarregar_parcelas_se_preciso(todas_parcelas, "tenex_turing")
+        # Só os registros referenciados pelas parcelas continuam necessários
+        clientes_por_sistema = None
+    agendamento = None
+    if preparar:
+        limites = {"venceu_ontem": LIMITE_VENCIDAS, "vence_hoje": LIMITE_HOJE, "vence_amanha": LIMITE_AMANHA}
+        total_envios = sum(len(todas_parcelas[p][:limites[p]] if limites[p] else todas_parcelas[p]) for p in todas_parcelas)
+        agendamento = preparar_agendamento(total_envios)
+        if agendamento is None:
+            if armazem is not None:
+                armazem.fechar()
+            return None
+        logging.info(f"🗓️ Agendando {total_envios} envios no batch {agendamento['batch_id']}")
+    vereditos = None
+    if VALIDAR_EMAILS:
+        with medir_estagio("validacao_email"):
+            vereditos = validar_emails_em_lote(todas_parcelas)
+    adiados = {periodo: [] for periodo in JANELAS_PERIODO}
+    if armazem is not None:
+        armazem.definir_estado("fase", "envio")
+    inicio_envio = time.monotonic()
+    with medir_estagio("envio"):
+        stats_geral = processar_fila_prioridade(todas_parcelas, adiados, agendamento, vereditos, prazo)
+    if agendamento:
+        marcar_dia_preparado(agendamento["batch_id"])
+    duracao_envio = time.monotonic() - inicio_envio
+    if duracao_envio > 0:
+        processados_envio = sum(s["enviados"] + s["erros"] for s in stats_geral.values())
+        definir_metrica("envio.por_segundo", round(processados_envio / duracao_envio, 2))
+    if armazem is not None:
+        armazem.definir_estado("fase", "interrompida" if any(adiados.values()) else "concluida")
+        armazem.fechar()
+        logging.info(f"[ARMAZEM] Dados da execução em {armazem.arquivo}")
+    else:
+        salvar_checkpoint_adiados(adiados)
+    # Logs que ficaram no spool durante o envio (desta execução ou de anteriores)
+    reenviar_spool_supabase(prazo)
     tempo_total = time.time() - inicio
     logging.info("\n" + "="*60)
     logging.info("📊 RELATÓRIO FINAL")
@@ -622,20 +3364,100 @@ def processar_envio_email():
             logging.info(f"   ✅ Enviados: {stats['enviados']}")
             logging.info(f"   ⏭️ Já enviados hoje: {stats['ja_enviados']}")
             logging.info(f"   📵 Sem e-mail: {stats['sem_email']}")
+            logging.info(f"   🚫 E-mail inválido: {stats['email_invalido']}")
             logging.info(f"   ❌ Erros: {stats['erros']}")
+            if stats.get('adiados'):
+                logging.info(f"   ⏸️ Adiados: {stats['adiados']}")
             total_enviados += stats['enviados']
             total_processados += stats['total']
     logging.info(f"\n📊 TOTAIS:")
     logging.info(f"   Parcelas processadas: {total_processados}")
     logging.info(f"   E-mails enviados: {total_enviados}")
     logging.info("="*60)
+    emitir_metricas()
     if MODO_TESTE:
         logging.info("\n⚠️ ATENÇÃO: Executado em modo TESTE - nenhum e-mail foi enviado!")
     else:
         send_notification(NOTIFICATION_FINALIZADO_URL)
+    return agendamento["batch_id"] if agendamento else None
+
+def aquecer_container() -> Dict:
+    """
+    Prepara um container quente sem enviar e-mails: abre as conexões keep-alive de cada serviço
+    (DNS + TCP + TLS) pelas sessões HTTP, carrega de /tmp o cache Tenex (com o índice de
+    vencimentos) e os vereditos de e-mail (conjunto de supressão), mesclando o que houver no cache
+    compartilhado, e esvazia o spool de logs do Supabase. Retorna um resumo por item.
+    """
+    destinos = {
+        "sendgrid": SENDGRID_API_URL,
+        "airtable": AIRTABLE_API_URL,
+        "tenex": TENEX_URL_CREDILLY,
+        "tenex_turing": TENEX_URL_TURING if PROCESSAR_TURING else "",
+        "supabase": SUPABASE_URL,
+    }
+    resumo: Dict[str, object] = {}
+    for servico, url in destinos.items():
+        if not url:
+            continue
+        inicio = time.monotonic()
+        try:
+            # Qualquer resposta (mesmo 401/404) deixa a conexão aberta no pool da sessão
+            response = sessao_http(servico.split("_")[0]).head(url, timeout=5)
+            resumo[servico] = f"{response.status_code} em {(time.monotonic() - inicio) * 1000:.0f}ms"
+        except requests.exceptions.RequestException as e:
+            resumo[servico] = f"falha: {str(e)[:120]}"
+    CACHE_TENEX._carregar()
+    sincronizar_caches_compartilhados()
+    resumo["cache_tenex_clientes"] = len(CACHE_TENEX._itens)
+    if CACHE_PROXIMO_VENCIMENTO.habilitado:
+        CACHE_PROXIMO_VENCIMENTO._carregar()
+        resumo["clientes_sem_vencimento_proximo"] = len(CACHE_PROXIMO_VENCIMENTO._itens)
+    resumo["vereditos_email_invalidos"] = len(CACHE_VEREDITOS_EMAIL.invalidos())
+    resumo["logs_supabase_reenviados"] = reenviar_spool_supabase()
+    logging.info(f"🔥 Container aquecido: {json.dumps(resumo, ensure_ascii=False)}")
+    return resumo
 
 def lambda_handler(event, context):
+    try:
+        return executar_evento(event, context)
+    finally:
+        descarregar_logs()
+
+def executar_evento(event, context):
     logging.info("Script iniciado em Lambda")
+    if MEMORIA_TRACEMALLOC and not tracemalloc.is_tracing():
+        tracemalloc.start()
+    iniciar_relogio_execucao()
+    reiniciar_metricas()
+    PoliticaRetry.reiniciar_orcamento()
+    CACHE_COMPARTILHADO.verificar()
+    if MODO_CARGA:
+        urls_producao = urls_producao_configuradas()
+        if urls_producao:
+            logging.error(f"MODO_CARGA=true com URLs de produção configuradas: {urls_producao}")
+            return {'statusCode': 400, 'body': 'MODO_CARGA exige endpoints de ensaio'}
+    # Pré-aquecimento agendado antes da janela de envio: {"warmup": true}
+    if isinstance(event, dict) and event.get('warmup'):
+        return {'statusCode': 200, 'body': json.dumps(aquecer_container(), ensure_ascii=False)}
+    acao = event.get('acao') if isinstance(event, dict) else None
+    prazo = None
+    if context is not None and hasattr(context, 'get_remaining_time_in_millis'):
+        prazo = time.monotonic() + context.get_remaining_time_in_millis() / 1000.0 - ENVIO_MARGEM_SEGUNDOS
+    # Cancela (ou pausa) um batch agendado: {"acao": "cancelar_agendamento", "batch_id": "...", "status": "cancel|pause"}
+    if acao == 'cancelar_agendamento':
+        batch_id = event.get('batch_id')
+        if not batch_id:
+            return {'statusCode': 400, 'body': 'batch_id ausente'}
+        ok = cancelar_batch_sendgrid(batch_id, event.get('status', 'cancel'))
+        if ok and event.get('status', 'cancel') == 'cancel':
+            desmarcar_dia_preparado(batch_id)
+        return {'statusCode': 200 if ok else 502, 'body': f"Batch {batch_id} {'cancelado' if ok else 'não cancelado'}"}
+    # Preparação antecipada fora do pico: agenda os envios do dia com send_at/batch_id
+    if acao == 'preparar_envios':
+        batch_id = processar_envio_email(preparar=True, prazo=prazo)
+        if not batch_id:
+            return {'statusCode': 500, 'body': 'Falha ao preparar envios agendados'}
+        return {'statusCode': 200, 'body': json.dumps({'batch_id': batch_id})}
     # Disparo único com dados reais (Airtable + Tenex)
     if os.environ.get('TESTE_DADOS_REAIS', 'false').lower() == 'true':
         email_teste = os.environ.get('EMAIL_TESTE_DESTINO')
@@ -657,10 +3479,10 @@ def lambda_handler(event, context):
             return {'statusCode': 400, 'body': 'TIPO_TESTE inválido'}
         enviar_teste_template_unico(email_teste, tipo_teste)
         return {'statusCode': 200, 'body': 'Envio único processado'}
-    if not verificar_horario_permitido() and not MODO_TESTE:
+    if not verificar_horario_permitido() and not MODO_TESTE and not MODO_CARGA:
         logging.warning(f"⚠️ Fora do horário permitido ({HORARIO_INICIO}h-{HORARIO_FIM}h)")
         return {'statusCode': 200, 'body': 'Fora do horário'}
-    processar_envio_email()
+    processar_envio_email(prazo=prazo)
     return {'statusCode': 200, 'body': 'Processamento concluído'}
 
 if __name__ == "__main__":
@@ -0,0 +1,394 @@
+#!/usr/bin/env python3
+"""
+Simulador local para ensaios de carga da Lambda (MODO_CARGA).
+
+Sobe um servidor HTTP único que imita Airtable, Tenex, SendGrid, Supabase e Pushcut com
+latência configurável, aponta as URLs base da Lambda para ele e executa o lambda_handler
+completo — paginação, lotes Tenex, classificação, validação, fila de envio e logs — com
+dados sintéticos no volume de produção (ou acima). Não faz parte do pacote da Lambda.
+
+Com --cache-compartilhado, o mesmo servidor também faz o papel de um S3 (bucket em memória,
+ETag, If-None-Match, inclusive no PUT só-criação, e If-Match) para o cache compartilhado da Lambda, e
+--containers N executa N invocações em processos separados, cada uma com o próprio /tmp, como containers frios distintos.
+
+Uso:
+    python simulador_local.py --clientes 20000 --latencia-ms 40
+    python simulador_local.py --clientes 20000 --escala 10 --semente 7 --exportar /tmp/carga_10x
+    python simulador_local.py --dados /tmp/carga_10x
+    python simulador_local.py --clientes 20000 --cache-compartilhado --containers 3
+"""
+
+import argparse
+import hashlib
+import json
+import logging
+import os
+import random
+import re
+import string
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from collections import Counter
+from datetime import date, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List
+from urllib.parse import parse_qs, urlparse
+
+
+# Distribuições do gerador sintético (aproximam o que se vê em produção)
+PROPORCAO_SEM_EMAIL = 0.08
+PROPORCAO_EMAIL_MALFORMADO = 0.02
+PROPORCAO_DOIS_SISTEMAS = 0.10
+PROPORCAO_TURING = 0.25
+STATUS_VENCIDAS = ((2, 0.80), (3, 0.15), (5, 0.05))  # pagas, em atraso, renegociadas
+STATUS_A_VENCER = ((1, 0.90), (5, 0.05), (2, 0.05))  # em aberto, renegociadas, antecipadas
+# Bucket do S3 simulado (cache compartilhado); o restante do caminho é a chave do objeto
+BUCKET_SIMULADO = "cache-carga"
+
+
+def _sortear_status(rnd: random.Random, distribuicao) -> int:
+    valores, pesos = zip(*distribuicao)
+    return rnd.choices(valores, weights=pesos)[0]
+
+
+def _gerar_venda(rnd: random.Random, id_cliente: int, hoje: date) -> Dict:
+    """Venda parcelada mensalmente; o início é sorteado para que parte das parcelas caia em torno de hoje."""
+    total_parcelas = rnd.choice((6, 10, 12, 18, 24))
+    inicio = hoje - timedelta(days=rnd.randint(0, 30 * total_parcelas))
+    valor = round(rnd.uniform(80, 900), 2)
+    parcelas = []
+    for numero in range(total_parcelas):
+        vencimento = inicio + timedelta(days=30 * numero)
+        distribuicao = STATUS_VENCIDAS if vencimento < hoje else STATUS_A_VENCER
+        parcelas.append({
+            "numero": numero + 1,
+            "data_vencimento": vencimento.isoformat(),
+            "status": _sortear_status(rnd, distribuicao),
+            "valor": valor,
+            "pdf_url": f"https://boletos.exemplo.com.br/{id_cliente}/{vencimento.isoformat()}.pdf",
+        })
+    return {"id_cliente": id_cliente, "parcelas": parcelas}
+
+
+def gerar_dados(total_clientes: int, hoje: date, semente: int = 42) -> Dict:
+    """
+    Clientes Airtable e vendas Tenex (credilly e turing) sintéticos e determinísticos:
+    a mesma semente, total e data geram exatamente o mesmo conjunto.
+    """
+    rnd = random.Random(f"{semente}:{total_clientes}:{hoje.isoformat()}")
+    registros = []
+    vendas = {"credilly": {}, "turing": {}}
+    for i in range(total_clientes):
+        campos = {"Nome do cliente": f"Cliente {i}"}
+        sorteio_email = rnd.random()
+        if sorteio_email >= PROPORCAO_SEM_EMAIL + PROPORCAO_EMAIL_MALFORMADO:
+            campos["Email"] = f"cliente{i}@exemplo.com.br"
+        elif sorteio_email >= PROPORCAO_SEM_EMAIL:
+            campos["Email"] = f"cliente{i}.exemplo.com.br"
+        sorteio_sistema = rnd.random()
+        if sorteio_sistema < PROPORCAO_DOIS_SISTEMAS:
+            sistemas = ("credilly", "turing")
+        elif sorteio_sistema < PROPORCAO_DOIS_SISTEMAS + PROPORCAO_TURING:
+            sistemas = ("turing",)
+        else:
+            sistemas = ("credilly",)
+        for sistema in sistemas:
+            campos["ID Credilly" if sistema == "credilly" else "ID Turing"] = str(i)
+            vendas[sistema][str(i)] = [_gerar_venda(rnd, i, hoje) for _ in range(rnd.choices((1, 2, 3), weights=(0.8, 0.15, 0.05))[0])]
+        id_registro = "rec" + "".join(rnd.choices(string.digits + string.ascii_letters, k=14))
+        registros.append({"id": id_registro, "fields": campos})
+    return {"registros": registros, "vendas": vendas}
+
+
+def exportar_dados(dados: Dict, diretorio: str) -> None:
+    """Grava o conjunto em JSONL: clientes.jsonl (registros Airtable) e vendas_<sistema>.jsonl (vendas Tenex)."""
+    os.makedirs(diretorio, exist_ok=True)
+    with open(os.path.join(diretorio, "clientes.jsonl"), "w", encoding="utf-8") as f:
+        for registro in dados["registros"]:
+            f.write(json.dumps(registro, ensure_ascii=False) + "\n")
+    for sistema, vendas_sistema in dados["vendas"].items():
+        with open(os.path.join(diretorio, f"vendas_{sistema}.jsonl"), "w", encoding="utf-8") as f:
+            for vendas_cliente in vendas_sistema.values():
+                for venda in vendas_cliente:
+                    f.write(json.dumps(venda, ensure_ascii=False) + "\n")
+
+
+def importar_dados(diretorio: str) -> Dict:
+    """Lê um conjunto gravado por exportar_dados."""
+    dados = {"registros": [], "vendas": {"credilly": {}, "turing": {}}}
+    with open(os.path.join(diretorio, "clientes.jsonl"), "r", encoding="utf-8") as f:
+        dados["registros"] = [json.loads(linha) for linha in f if linha.strip()]
+    for sistema in dados["vendas"]:
+        caminho = os.path.join(diretorio, f"vendas_{sistema}.jsonl")
+        if not os.path.exists(caminho):
+            continue
+        with open(caminho, "r", encoding="utf-8") as f:
+            for linha in f:
+                if linha.strip():
+                    venda = json.loads(linha)
+                    dados["vendas"][sistema].setdefault(str(venda["id_cliente"]), []).append(venda)
+    return dados
+
+
+class ServidorSimulado(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    dados: Dict = {}
+    latencia: float = 0.0
+    contadores: Counter = Counter()
+    trava = threading.Lock()
+    objetos: Dict[str, bytes] = {}
+
+    def log_message(self, formato, *args):
+        pass
+
+    def _responder(self, status: int, corpo=None, headers: Dict = None) -> None:
+        conteudo = json.dumps(corpo).encode() if corpo is not None else b""
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(conteudo)))
+        for nome, valor in (headers or {}).items():
+            self.send_header(nome, valor)
+        self.end_headers()
+        self.wfile.write(conteudo)
+
+    def _responder_s3(self, status: int, conteudo: bytes = b"", headers: Dict = None) -> None:
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(conteudo)))
+        for nome, valor in (headers or {}).items():
+            self.send_header(nome, valor)
+        self.end_headers()
+        self.wfile.write(conteudo)
+
+    def _erro_s3(self, status: int, codigo: str) -> None:
+        corpo = f"<?xml version=\"1.0\" encoding=\"UTF-8\"?><Error><Code>{codigo}</Code><Message>{codigo}</Message></Error>"
+        self._responder_s3(status, corpo.encode(), {"Content-Type": "application/xml"})
+
+    def _get_s3(self, chave: str) -> None:
+        self._contar("s3.get")
+        with self.trava:
+            conteudo = self.objetos.get(chave)
+        if conteudo is None:
+            return self._erro_s3(404, "NoSuchKey")
+        etag = f'"{hashlib.md5(conteudo).hexdigest()}"'
+        if self.headers.get("If-None-Match") == etag:
+            self._contar("s3.get_304")
+            return self._responder_s3(304, b"", {"ETag": etag})
+        self._responder_s3(200, conteudo, {"ETag": etag, "Content-Type": "application/octet-stream"})
+
+    def do_PUT(self):
+        caminho = urlparse(self.path).path
+        conteudo = self._ler_corpo()
+        if not caminho.startswith(f"/{BUCKET_SIMULADO}/"):
+            return self._responder(404, {"erro": caminho})
+        self._contar("s3.put")
+        se_etag = self.headers.get("If-Match")
+        so_criar = self.headers.get("If-None-Match") == "*"
+        with self.trava:
+            atual = self.objetos.get(caminho)
+            if se_etag and (atual is None or f'"{hashlib.md5(atual).hexdigest()}"' != se_etag):
+                conflito = True
+            elif so_criar and atual is not None:
+                conflito = True
+            else:
+                conflito = False
+                self.objetos[caminho] = conteudo
+        if conflito:
+            self._contar("s3.put_412")
+            return self._erro_s3(412, "PreconditionFailed")
+        self._responder_s3(200, b"", {"ETag": f'"{hashlib.md5(conteudo).hexdigest()}"'})
+
+    def _contar(self, rota: str) -> None:
+        with self.trava:
+            self.contadores[rota] += 1
+
+    def _ler_corpo(self) -> bytes:
+        tamanho = int(self.headers.get("Content-Length") or 0)
+        return self.rfile.read(tamanho) if tamanho else b""
+
+    def do_GET(self):
+        time.sleep(self.latencia)
+        url = urlparse(self.path)
+        params = parse_qs(url.query)
+        if url.path.startswith("/airtable/"):
+            self._contar("airtable")
+            inicio = int(params.get("offset", ["0"])[0])
+            tamanho = int(params.get("pageSize", ["100"])[0])
+            registros = self.dados["registros"]
+            # Só entende o filtro de fatias da Lambda: REGEX_MATCH(RECORD_ID(), '<regex>')
+            filtro = re.fullmatch(r"REGEX_MATCH\(RECORD_ID\(\), '(.+)'\)", params.get("filterByFormula", [""])[0])
+            if filtro:
+                padrao = re.compile(filtro.group(1))
+                registros = [registro for registro in registros if padrao.search(registro["id"])]
+            corpo = {"records": registros[inicio:inicio + tamanho]}
+            if inicio + tamanho < len(registros):
+                corpo["offset"] = str(inicio + tamanho)
+            return self._responder(200, corpo)
+        if url.path.startswith("/tenex/"):
+            sistema = url.path.split("/")[2]
+            self._contar(f"tenex.{sistema}")
+            vendas = self.dados["vendas"].get(sistema, {})
+            corpo = [venda for id_cliente in params.get("id_cliente", []) for venda in vendas.get(id_cliente, [])]
+            return self._responder(200, {"data": corpo})
+        if url.path.startswith("/pushcut/"):
+            self._contar("pushcut")
+            return self._responder(200, {})
+        if url.path.startswith(f"/{BUCKET_SIMULADO}/"):
+            return self._get_s3(url.path)
+        self._responder(404, {"erro": url.path})
+
+    def do_HEAD(self):
+        # Pré-aquecimento ({"warmup": true}) só abre a conexão
+        self._contar("head")
+        self.send_response(200)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def do_POST(self):
+        time.sleep(self.latencia)
+        caminho = urlparse(self.path).path
+        self._ler_corpo()
+        if caminho.endswith("/mail/send"):
+            self._contar("sendgrid.mail_send")
+            return self._responder(202, None, {"X-Message-Id": uuid.uuid4().hex})
+        if caminho.endswith("/mail/batch"):
+            self._contar("sendgrid.batch")
+            return self._responder(201, {"batch_id": uuid.uuid4().hex})
+        if caminho.endswith("/user/scheduled_sends"):
+            self._contar("sendgrid.scheduled_sends")
+            return self._responder(201, {})
+        if caminho.endswith("/validations/email"):
+            self._contar("sendgrid.validacao")
+            return self._responder(200, {"result": {"verdict": "Valid"}})
+        if caminho.startswith("/supabase/"):
+            self._contar("supabase")
+            return self._responder(201, None)
+        if caminho.startswith("/pushcut/"):
+            self._contar("pushcut")
+            return self._responder(200, {})
+        self._responder(404, {"erro": caminho})
+
+
+def configurar_ambiente(base: str, cache_compartilhado: bool = False) -> None:
+    """Aponta a Lambda para o simulador. Precisa rodar antes de importar lambda_function."""
+    if cache_compartilhado:
+        os.environ.update({
+            "CACHE_COMPARTILHADO_URL": f"s3://{BUCKET_SIMULADO}/lambda",
+            "CACHE_COMPARTILHADO_ENDPOINT": base,
+            "TENEX_CACHE_TTL": os.environ.get("TENEX_CACHE_TTL", "3600"),
+        })
+        for chave, valor in (("AWS_ACCESS_KEY_ID", "carga"), ("AWS_SECRET_ACCESS_KEY", "carga"), ("AWS_DEFAULT_REGION", "us-east-1")):
+            os.environ.setdefault(chave, valor)
+    os.environ.update({
+        "MODO_CARGA": "true",
+        "MODO_TESTE": "false",
+        "PROCESSAR_TURING": "true",
+        "AIRTABLE_API_URL": f"{base}/airtable",
+        "TENEX_URL_CREDILLY": f"{base}/tenex/credilly/",
+        "TENEX_URL_TURING": f"{base}/tenex/turing/",
+        "SENDGRID_API_URL": f"{base}/sendgrid/v3",
+        "SUPABASE_URL": f"{base}/supabase",
+        "NOTIFICATION_FINALIZADO_URL": f"{base}/pushcut/notificacao",
+    })
+    for chave in ("AIRTABLE_API_KEY", "TENEX_API_KEY_TURING", "SENDGRID_API_KEY", "SUPABASE_KEY"):
+        os.environ.setdefault(chave, "carga")
+
+
+# Arquivos da Lambda em /tmp; cada container simulado recebe cópias num diretório próprio
+ARQUIVOS_TMP_LAMBDA = {
+    "ARMAZEM_EXECUCAO_ARQUIVO": "execucao.sqlite",
+    "CHECKPOINT_ARQUIVO": "envio_checkpoint.json",
+    "VALIDACAO_EMAIL_CACHE_ARQUIVO": "email_vereditos.json",
+    "TENEX_CACHE_ARQUIVO": "tenex_cache.json",
+    "PROXIMO_VENCIMENTO_ARQUIVO": "proximos_vencimentos.json",
+    "SUPABASE_SPOOL_ARQUIVO": "supabase_spool.ndjson",
+}
+
+
+def executar_lambda(limite_segundos: float) -> int:
+    """Roda uma invocação com o ambiente já configurado e imprime resultado e métricas."""
+    import lambda_function
+
+    inicio = time.monotonic()
+    resultado = lambda_function.lambda_handler({}, ContextoSimulado(limite_segundos))
+    duracao = time.monotonic() - inicio
+    print(f"Resultado: {resultado}")
+    print(f"Duração: {duracao:.2f}s")
+    for nome, valor in sorted(lambda_function.METRICAS.items()):
+        print(f"  {nome}: {valor}")
+    return 0
+
+
+def executar_containers(total: int, base: str, args) -> None:
+    """Uma invocação por processo, em sequência, cada uma com um /tmp vazio (container frio)."""
+    for numero in range(1, total + 1):
+        diretorio = tempfile.mkdtemp(prefix=f"container{numero}_")
+        ambiente = dict(os.environ, MEMORIA_DIRETORIO_DESCARGA=diretorio)
+        ambiente.update({variavel: os.path.join(diretorio, nome) for variavel, nome in ARQUIVOS_TMP_LAMBDA.items()})
+        print(f"=== Container {numero} ({diretorio}) ===", flush=True)
+        comando = [sys.executable, os.path.abspath(__file__), "--conectar", base, "--limite-segundos", str(args.limite_segundos)]
+        subprocess.run(comando, env=ambiente, check=False)
+
+
+class ContextoSimulado:
+    """Imita o context da Lambda (get_remaining_time_in_millis) com um tempo limite fixo."""
+
+    def __init__(self, limite_segundos: float):
+        self._fim = time.monotonic() + limite_segundos
+
+    def get_remaining_time_in_millis(self) -> int:
+        return int(max(0.0, self._fim - time.monotonic()) * 1000)
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="Ensaio de carga da Lambda contra serviços simulados")
+    parser.add_argument("--clientes", type=int, default=5000, help="Clientes no volume 1x")
+    parser.add_argument("--escala", type=int, default=1, choices=(1, 10, 100), help="Multiplicador de volume")
+    parser.add_argument("--semente", type=int, default=42)
+    parser.add_argument("--hoje", type=date.fromisoformat, default=date.today(), help="Data base dos vencimentos (AAAA-MM-DD)")
+    parser.add_argument("--dados", help="Diretório com JSONL gerado antes (ignora --clientes/--escala/--semente)")
+    parser.add_argument("--exportar", help="Grava o conjunto gerado em JSONL neste diretório e sai")
+    parser.add_argument("--latencia-ms", type=float, default=20.0)
+    parser.add_argument("--limite-segundos", type=float, default=900.0, help="Tempo limite simulado da Lambda")
+    parser.add_argument("--porta", type=int, default=0)
+    parser.add_argument("--cache-compartilhado", action="store_true", help="Liga o cache compartilhado contra o S3 simulado")
+    parser.add_argument("--containers", type=int, default=1, help="Invocações em processos separados, cada uma com /tmp próprio")
+    parser.add_argument("--conectar", help=argparse.SUPPRESS)  # processo filho de --containers: só executa a Lambda
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.WARNING, format="%(asctime)s %(levelname)s %(message)s")
+    if args.conectar:
+        return executar_lambda(args.limite_segundos)
+    if args.dados:
+        ServidorSimulado.dados = importar_dados(args.dados)
+    else:
+        ServidorSimulado.dados = gerar_dados(args.clientes * args.escala, args.hoje, args.semente)
+    if args.exportar:
+        exportar_dados(ServidorSimulado.dados, args.exportar)
+        print(f"{len(ServidorSimulado.dados['registros'])} clientes gravados em {args.exportar}")
+        return 0
+    ServidorSimulado.latencia = args.latencia_ms / 1000
+    servidor = ThreadingHTTPServer(("127.0.0.1", args.porta), ServidorSimulado)
+    servidor.daemon_threads = True
+    threading.Thread(target=servidor.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{servidor.server_address[1]}"
+    configurar_ambiente(base, args.cache_compartilhado)
+
+    print(f"{len(ServidorSimulado.dados['registros'])} clientes simulados")
+    if args.containers > 1:
+        executar_containers(args.containers, base, args)
+    else:
+        executar_lambda(args.limite_segundos)
+    servidor.shutdown()
+
+    print("Requisições recebidas pelo simulador:")
+    for rota, total in sorted(ServidorSimulado.contadores.items()):
+        print(f"  {rota}: {total}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,35 @@
+"""
+Apoio dos testes unitários: importa o lambda_function com os logs silenciados e oferece um relógio falso.
+
+Rodar da raiz do repositório, com as dependências do pacote no caminho:
+    PYTHONPATH=.lambda_build python -m unittest discover -s tests
+"""
+
+import os
+import sys
+
+os.environ.setdefault("LOG_NIVEL", "CRITICAL")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import lambda_function  # noqa: E402
+
+
+class RelogioFalso:
+    """Faz o papel do módulo time no lambda_function: o tempo só anda com sleep (ou avancar)."""
+
+    def __init__(self, inicio: float = 1000.0):
+        self.agora = inicio
+        self.esperas = []
+
+    def monotonic(self) -> float:
+        return self.agora
+
+    def time(self) -> float:
+        return self.agora
+
+    def sleep(self, segundos: float) -> None:
+        self.esperas.append(segundos)
+        self.agora += segundos
+
+    def avancar(self, segundos: float) -> None:
+        self.agora += segundos
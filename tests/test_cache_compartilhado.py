@@ -0,0 +1,162 @@
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from apoio import lambda_function as lf
+
+
+def uniao(remoto, local):
+    return sorted(set(remoto) | set(local))
+
+
+def item(numero: int):
+    parcela = {"data_vencimento": "2026-03-10", "pdf_url": f"https://boletos/{numero}.pdf", "valor": 100 + numero}
+    return parcela, {"fields": {"Email": f"cliente{numero}@exemplo.com"}}, "vence_hoje", "credilly"
+
+
+class BaseCacheArquivos(unittest.TestCase):
+    """Dois CacheCompartilhado no mesmo diretório fazem o papel de dois containers."""
+
+    def setUp(self):
+        self.diretorio = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.diretorio, True)
+        self.a = lf.CacheCompartilhado(f"file://{self.diretorio}")
+        self.b = lf.CacheCompartilhado(f"file://{self.diretorio}")
+        lf.reiniciar_metricas()
+
+
+class TestCacheCompartilhado(BaseCacheArquivos):
+
+    def test_publica_e_le(self):
+        self.assertTrue(self.a.publicar("x", [1, 2]))
+        self.assertEqual(self.b.obter("x"), [1, 2])
+        # Segunda leitura sem mudança: GET condicional, objeto guardado
+        self.assertEqual(self.b.obter("x"), [1, 2])
+        self.assertEqual(lf.METRICAS.get("cache_compartilhado.nao_modificados"), 1)
+
+    def test_criacao_exclusiva(self):
+        backend = self.a._obter_backend()
+        self.assertIsNotNone(backend.escrever("v1/x.json.z", b"a"))
+        self.assertIsNone(backend.escrever("v1/x.json.z", b"b"))
+        self.assertEqual(backend.ler("v1/x.json.z")[0], b"a")
+
+    def test_quem_nao_conhece_o_objeto_mescla_antes_de_gravar(self):
+        self.assertIsNone(self.b.obter("x"))
+        self.assertTrue(self.a.publicar("x", [1]))
+        self.assertTrue(self.b.publicar("x", [2], mesclar=uniao))
+        self.assertEqual(self.a.obter("x"), [1, 2])
+
+    def test_escrita_condicional_ao_etag_lido(self):
+        self.a.publicar("x", [1])
+        self.assertEqual(self.b.obter("x"), [1])
+        self.a.publicar("x", [1, 3], mesclar=uniao)
+        # O ETag que b conhece ficou velho: não sobrescreve o [1, 3] de a
+        self.assertTrue(self.b.publicar("x", [1, 2], mesclar=uniao))
+        self.assertEqual(self.a.obter("x"), [1, 2, 3])
+
+    def test_sem_mesclar_o_objeto_local_prevalece_depois_do_conflito(self):
+        self.a.publicar("x", [1])
+        self.assertEqual(self.b.obter("x"), [1])
+        self.a.publicar("x", [3])
+        self.assertTrue(self.b.publicar("x", [2]))
+        self.assertEqual(self.a.obter("x"), [2])
+
+    def test_conflitos_persistentes_desistem(self):
+        self.a.publicar("x", [1])
+        self.assertEqual(self.b.obter("x"), [1])
+        backend = self.b._obter_backend()
+        with mock.patch.object(backend, "escrever", return_value=None):
+            self.assertFalse(self.b.publicar("x", [2], mesclar=uniao))
+        self.assertEqual(lf.METRICAS.get("cache_compartilhado.conflitos"), 3)
+
+    def test_backend_invalido_desliga_com_um_unico_aviso(self):
+        cache = lf.CacheCompartilhado("ftp://servidor/cache")
+        with self.assertLogs(level="WARNING") as logs:
+            self.assertFalse(cache.verificar())
+            self.assertFalse(cache.verificar())
+            self.assertIsNone(cache.obter("x"))
+            self.assertFalse(cache.publicar("x", [1]))
+        self.assertEqual(len(logs.records), 1)
+        self.assertFalse(cache.habilitado)
+
+    @unittest.skipIf(lf.boto3 is not None, "boto3 instalado")
+    def test_s3_sem_boto3_desliga(self):
+        cache = lf.CacheCompartilhado("s3://bucket/prefixo")
+        with self.assertLogs(level="WARNING"):
+            self.assertFalse(cache.verificar())
+
+
+class TestEnviadosDoDia(BaseCacheArquivos):
+
+    def setUp(self):
+        super().setUp()
+        patcher = mock.patch.object(lf, "MODO_TESTE", False)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.enviados_a = lf.EnviadosDoDia()
+        self.enviados_b = lf.EnviadosDoDia()
+
+    def em(self, cache):
+        return mock.patch.object(lf, "CACHE_COMPARTILHADO", cache)
+
+    def test_reservas_de_outra_invocacao_contam_como_ja_enviadas(self):
+        with self.em(self.a):
+            self.enviados_a.carregar("2026-03-10")
+            self.enviados_a.reservar([item(i) for i in range(10)])
+            self.assertFalse(any(self.enviados_a.contem(item(i)) for i in range(10)))
+        with self.em(self.b):
+            self.enviados_b.carregar("2026-03-10")
+            self.enviados_b.reservar([item(i) for i in range(5, 15)])
+            self.assertEqual([i for i in range(15) if self.enviados_b.contem(item(i))], list(range(10)))
+
+    def test_escrita_condicional_perdida_deixa_a_reserva_para_a_outra(self):
+        with self.em(self.a):
+            self.enviados_a.carregar("2026-03-10")
+            self.enviados_a.reservar([item(100)])
+        with self.em(self.b):
+            self.enviados_b.carregar("2026-03-10")
+        lote = [item(i) for i in range(4)]
+        # a publica entre a releitura de b e a escrita de b: a escrita de b perde e b relê
+        reler_b = self.enviados_b.reler
+
+        def reler_e_perder_a_corrida():
+            reler_b()
+            with self.em(self.a):
+                self.enviados_a.reservar(lote[:2])
+        with self.em(self.b), mock.patch.object(self.enviados_b, "reler", reler_e_perder_a_corrida):
+            self.enviados_b.reservar(lote)
+        self.assertEqual([self.enviados_b.contem(i) for i in lote], [True, True, False, False])
+        self.assertEqual(lf.METRICAS.get("cache_compartilhado.conflitos"), 1)
+        with self.em(self.a):
+            self.enviados_a.reler()
+        self.assertEqual([self.enviados_a.contem(i) for i in lote], [False, False, True, True])
+
+    def test_liberacao_publicada_devolve_a_parcela(self):
+        with self.em(self.a):
+            self.enviados_a.carregar("2026-03-10")
+            self.enviados_a.reservar([item(1), item(2)])
+            self.enviados_a.liberar([item(2)])
+            self.enviados_a.publicar()
+        with self.em(self.b):
+            self.enviados_b.carregar("2026-03-10")
+        self.assertTrue(self.enviados_b.contem(item(1)))
+        self.assertFalse(self.enviados_b.contem(item(2)))
+
+    def test_execucao_seguinte_do_container_ve_os_proprios_envios(self):
+        with self.em(self.a):
+            self.enviados_a.carregar("2026-03-10")
+            self.enviados_a.reservar([item(1)])
+            self.enviados_a.carregar("2026-03-10")
+        self.assertTrue(self.enviados_a.contem(item(1)))
+
+    def test_novo_dia_recomeca_o_conjunto(self):
+        with self.em(self.a):
+            self.enviados_a.carregar("2026-03-10")
+            self.enviados_a.reservar([item(1)])
+            self.enviados_a.carregar("2026-03-11")
+        self.assertFalse(self.enviados_a.contem(item(1)))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,85 @@
+import random
+import unittest
+from unittest import mock
+
+from apoio import RelogioFalso, lambda_function as lf
+
+
+class TestControladorConcorrencia(unittest.TestCase):
+
+    def setUp(self):
+        self.relogio = RelogioFalso()
+        patcher = mock.patch.object(lf, "time", self.relogio)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.controlador = lf.ControladorConcorrencia(16, inicial=4, tolerancia=2.0, fator=0.5, janela=10,
+                                                     folga=0.05, congestionadas=2)
+
+    def observar(self, latencias, status=202):
+        for latencia in latencias:
+            self.controlador.observar(latencia, status)
+
+    def test_aumento_aditivo_ate_o_teto(self):
+        self.observar([0.1] * 4)
+        # +1/limite por resposta: uma rodada de `limite` respostas soma ≈ 1
+        self.assertAlmostEqual(self.controlador.limite, 5.0, delta=0.1)
+        self.observar([0.1] * 500)
+        self.assertEqual(self.controlador.limite, 16)
+
+    def test_base_e_a_media_movel_das_medianas(self):
+        self.observar([0.1] * 10)
+        self.assertAlmostEqual(self.controlador.latencia_base, 0.1)
+        self.observar([0.2] * 10)
+        self.assertAlmostEqual(self.controlador.latencia_base, 0.1 + lf.ControladorConcorrencia.ALFA_BASE * 0.1)
+
+    def test_pico_isolado_nao_reduz(self):
+        self.observar([0.1] * 10)
+        limite = self.controlador.limite
+        self.observar([0.1] * 5 + [1.0] + [0.1] * 4)
+        self.assertGreater(self.controlador.limite, limite)
+
+    def test_uma_janela_congestionada_nao_reduz(self):
+        self.observar([0.1] * 10)
+        limite = self.controlador.limite
+        self.observar([0.5] * 10)
+        self.assertGreater(self.controlador.limite, limite)
+        self.observar([0.1] * 10)
+        self.assertEqual(self.controlador._janelas_congestionadas, 0)
+
+    def test_janelas_congestionadas_seguidas_reduzem_pelo_fator(self):
+        self.observar([0.1] * 10)
+        self.observar([0.5] * 10)
+        self.observar([0.5] * 9)
+        antes = self.controlador.limite
+        self.observar([0.5])
+        self.assertAlmostEqual(self.controlador.limite, antes * 0.5)
+        self.assertEqual(self.controlador._janelas_congestionadas, 0)
+
+    def test_jitter_de_milissegundos_nao_reduz(self):
+        random.seed(7)
+        self.controlador = lf.ControladorConcorrencia(8, inicial=8, janela=20)
+        self.observar(random.uniform(0.0005, 0.004) for _ in range(5000))
+        self.assertEqual(self.controlador.limite, 8)
+
+    def test_429_reduz_na_hora_uma_vez_por_latencia_de_base(self):
+        self.observar([0.1] * 10)
+        antes = self.controlador.limite
+        self.controlador.observar(0.1, 429)
+        self.assertAlmostEqual(self.controlador.limite, antes * 0.5)
+        # Rajada de 429 dentro da mesma latência de base: um corte só
+        self.controlador.observar(0.1, 429)
+        self.controlador.observar(0.1, 503)
+        self.assertAlmostEqual(self.controlador.limite, antes * 0.5)
+        self.relogio.avancar(0.2)
+        self.controlador.observar(0.1, None)
+        self.assertAlmostEqual(self.controlador.limite, antes * 0.25)
+
+    def test_limite_nunca_fica_abaixo_de_um(self):
+        for _ in range(20):
+            self.relogio.avancar(1)
+            self.controlador.observar(0.1, 500)
+        self.assertEqual(self.controlador.limite, 1.0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,85 @@
+import unittest
+from unittest import mock
+
+from apoio import RelogioFalso, lambda_function as lf
+
+
+class TestDisjuntorServico(unittest.TestCase):
+
+    def setUp(self):
+        self.relogio = RelogioFalso()
+        patcher = mock.patch.object(lf, "time", self.relogio)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.disjuntor = lf.DisjuntorServico("teste", janela=10, min_chamadas=4, taxa_falha=0.5, tempo_aberto=30)
+
+    def abrir(self):
+        for _ in range(4):
+            self.disjuntor.registrar_falha()
+        self.assertEqual(self.disjuntor.estado, lf.DisjuntorServico.ABERTO)
+
+    def test_fica_fechado_abaixo_do_minimo_de_chamadas(self):
+        for _ in range(3):
+            self.disjuntor.registrar_falha()
+        self.assertEqual(self.disjuntor.estado, lf.DisjuntorServico.FECHADO)
+        self.assertTrue(self.disjuntor.permitir())
+
+    def test_fica_fechado_abaixo_da_taxa_de_falha(self):
+        for _ in range(6):
+            self.disjuntor.registrar_sucesso()
+        for _ in range(4):
+            self.disjuntor.registrar_falha()
+        self.assertEqual(self.disjuntor.estado, lf.DisjuntorServico.FECHADO)
+
+    def test_abre_ao_atingir_a_taxa_de_falha(self):
+        self.disjuntor.registrar_sucesso()
+        self.disjuntor.registrar_falha()
+        self.disjuntor.registrar_sucesso()
+        self.disjuntor.registrar_falha()
+        self.assertEqual(self.disjuntor.estado, lf.DisjuntorServico.ABERTO)
+
+    def test_aberto_recusa_ate_o_fim_do_tempo_aberto(self):
+        self.abrir()
+        self.assertFalse(self.disjuntor.disponivel())
+        self.assertFalse(self.disjuntor.permitir())
+        self.assertEqual(self.disjuntor.segundos_para_sondagem(), 30)
+        self.relogio.avancar(29.5)
+        self.assertFalse(self.disjuntor.permitir())
+        self.assertAlmostEqual(self.disjuntor.segundos_para_sondagem(), 0.5)
+        self.relogio.avancar(0.5)
+        self.assertTrue(self.disjuntor.disponivel())
+        self.assertEqual(self.disjuntor.segundos_para_sondagem(), 0)
+
+    def test_semiaberto_deixa_passar_uma_unica_sondagem(self):
+        self.abrir()
+        self.relogio.avancar(30)
+        self.assertTrue(self.disjuntor.permitir())
+        self.assertEqual(self.disjuntor.estado, lf.DisjuntorServico.SEMIABERTO)
+        self.assertFalse(self.disjuntor.disponivel())
+        self.assertFalse(self.disjuntor.permitir())
+
+    def test_sondagem_ok_fecha_e_zera_a_janela(self):
+        self.abrir()
+        self.relogio.avancar(30)
+        self.assertTrue(self.disjuntor.permitir())
+        self.disjuntor.registrar_sucesso()
+        self.assertEqual(self.disjuntor.estado, lf.DisjuntorServico.FECHADO)
+        # As falhas de antes da abertura não contam mais: a janela recomeça só com a sondagem
+        for _ in range(2):
+            self.disjuntor.registrar_falha()
+        self.assertEqual(self.disjuntor.estado, lf.DisjuntorServico.FECHADO)
+        self.disjuntor.registrar_falha()
+        self.assertEqual(self.disjuntor.estado, lf.DisjuntorServico.ABERTO)
+
+    def test_sondagem_com_falha_reabre_por_mais_um_tempo_aberto(self):
+        self.abrir()
+        self.relogio.avancar(30)
+        self.assertTrue(self.disjuntor.permitir())
+        self.disjuntor.registrar_falha()
+        self.assertEqual(self.disjuntor.estado, lf.DisjuntorServico.ABERTO)
+        self.assertEqual(self.disjuntor.segundos_para_sondagem(), 30)
+        self.assertFalse(self.disjuntor.permitir())
+
+
+if __name__ == "__main__":
+    unittest.main()
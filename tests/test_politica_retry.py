@@ -0,0 +1,132 @@
+import random
+import unittest
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime
+from unittest import mock
+
+from apoio import RelogioFalso, lambda_function as lf
+
+
+class RespostaFalsa:
+
+    def __init__(self, status_code: int, retry_after: str = None):
+        self.status_code = status_code
+        self.headers = {"Retry-After": retry_after} if retry_after is not None else {}
+        self.text = ""
+
+
+class SessaoFalsa:
+    """Devolve as respostas na ordem dada e anota o instante (relógio falso) de cada requisição."""
+
+    def __init__(self, relogio: RelogioFalso, respostas):
+        self.relogio = relogio
+        self.respostas = list(respostas)
+        self.instantes = []
+
+    def request(self, metodo, url, **kwargs):
+        self.instantes.append(self.relogio.agora)
+        return self.respostas.pop(0)
+
+
+class TestInterpretarRetryAfter(unittest.TestCase):
+
+    def test_segundos(self):
+        self.assertEqual(lf.interpretar_retry_after("7"), 7.0)
+        self.assertEqual(lf.interpretar_retry_after(" 2.5 "), 2.5)
+        self.assertEqual(lf.interpretar_retry_after("-3"), 0.0)
+
+    def test_http_date(self):
+        quando = datetime.now(timezone.utc) + timedelta(seconds=120)
+        segundos = lf.interpretar_retry_after(format_datetime(quando, usegmt=True))
+        self.assertAlmostEqual(segundos, 120, delta=2)
+        passado = datetime.now(timezone.utc) - timedelta(hours=1)
+        self.assertEqual(lf.interpretar_retry_after(format_datetime(passado, usegmt=True)), 0.0)
+
+    def test_ausente_ou_invalido(self):
+        self.assertIsNone(lf.interpretar_retry_after(None))
+        self.assertIsNone(lf.interpretar_retry_after(""))
+        self.assertIsNone(lf.interpretar_retry_after("amanhã"))
+
+
+class TestPoliticaRetry(unittest.TestCase):
+
+    def test_jitter_fica_entre_a_base_e_o_teto(self):
+        politica = lf.PoliticaRetry("teste", base=1.0, teto=8.0)
+        random.seed(3)
+        espera = politica.base
+        for _ in range(200):
+            anterior = espera
+            espera = politica.proxima_espera(espera)
+            self.assertGreaterEqual(espera, 1.0)
+            self.assertLessEqual(espera, min(8.0, anterior * 3))
+
+    def test_retry_after_nunca_e_encurtado(self):
+        politica = lf.PoliticaRetry("teste", base=1.0, teto=5.0)
+        self.assertEqual(politica.proxima_espera(1.0, retry_after=12.0), 12.0)
+        self.assertEqual(politica.proxima_espera(1.0, retry_after=0.0), 0.0)
+
+
+class TestRequisitarComRetry(unittest.TestCase):
+
+    def setUp(self):
+        self.relogio = RelogioFalso()
+        for patcher in (mock.patch.object(lf, "time", self.relogio),
+                        mock.patch.object(lf, "RETRY_ORCAMENTO_EXECUCAO", 100.0)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        lf.PoliticaRetry.reiniciar_orcamento()
+        self.addCleanup(lf.PoliticaRetry.reiniciar_orcamento)
+        self.politica = lf.PoliticaRetry("teste", max_tentativas=4, base=1.0, teto=10.0, prazo=30.0)
+
+    def requisitar(self, *respostas):
+        sessao = SessaoFalsa(self.relogio, respostas)
+        with mock.patch.object(lf, "sessao_http", lambda servico: sessao):
+            resultado = lf.requisitar_com_retry("teste", "GET", "http://teste", politica=self.politica)
+        return resultado, sessao
+
+    def test_espera_exatamente_o_retry_after(self):
+        (resposta, erro), sessao = self.requisitar(RespostaFalsa(429, "4"), RespostaFalsa(200))
+        self.assertEqual((resposta.status_code, erro), (200, None))
+        self.assertEqual(self.relogio.esperas, [4.0])
+        self.assertEqual(sessao.instantes[1] - sessao.instantes[0], 4.0)
+
+    def test_retry_after_acima_do_teto_desiste_sem_esperar(self):
+        (resposta, erro), sessao = self.requisitar(RespostaFalsa(429, "60"), RespostaFalsa(200))
+        self.assertEqual((resposta, erro), (None, "retry_after_excedido"))
+        self.assertEqual(self.relogio.esperas, [])
+        self.assertEqual(len(sessao.instantes), 1)
+
+    def test_retry_after_alem_do_prazo_desiste(self):
+        self.politica.max_tentativas = 10
+        (_, erro), _ = self.requisitar(*[RespostaFalsa(503, "9") for _ in range(5)])
+        # 3 x 9s cabem nos 30s de prazo; a quarta espera passaria dele
+        self.assertEqual(erro, "retry_after_excedido")
+        self.assertEqual(self.relogio.esperas, [9.0, 9.0, 9.0])
+
+    def test_esgota_as_tentativas_e_devolve_a_ultima_resposta(self):
+        (resposta, erro), sessao = self.requisitar(*[RespostaFalsa(500) for _ in range(4)])
+        self.assertEqual((resposta.status_code, erro), (500, None))
+        self.assertEqual(len(sessao.instantes), 4)
+        self.assertEqual(len(self.relogio.esperas), 3)
+
+    def test_nao_retenta_status_nao_retentavel(self):
+        (resposta, erro), sessao = self.requisitar(RespostaFalsa(400), RespostaFalsa(200))
+        self.assertEqual((resposta.status_code, erro), (400, None))
+        self.assertEqual(len(sessao.instantes), 1)
+
+    def test_orcamento_da_execucao_limita_as_esperas(self):
+        with mock.patch.object(lf, "RETRY_ORCAMENTO_EXECUCAO", 5.0):
+            (resposta, erro), _ = self.requisitar(RespostaFalsa(429, "3"), RespostaFalsa(429, "3"), RespostaFalsa(200))
+        self.assertEqual((resposta.status_code, erro), (429, None))
+        self.assertEqual(self.relogio.esperas, [3.0])
+
+    def test_politica_fora_do_orcamento_nao_o_consome(self):
+        self.politica.usa_orcamento = False
+        with mock.patch.object(lf, "RETRY_ORCAMENTO_EXECUCAO", 5.0):
+            (resposta, _), _ = self.requisitar(RespostaFalsa(429, "3"), RespostaFalsa(429, "3"), RespostaFalsa(200))
+        self.assertEqual(resposta.status_code, 200)
+        self.assertEqual(self.relogio.esperas, [3.0, 3.0])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,74 @@
+import hashlib
+import unittest
+from datetime import date, datetime, timedelta
+
+from apoio import lambda_function as lf
+
+
+def rodar_em(dia: date) -> str:
+    lf.iniciar_relogio_execucao(datetime(dia.year, dia.month, dia.day, 9, tzinfo=lf.FUSO_SAO_PAULO))
+    return dia.isoformat()
+
+
+def venda(id_cliente: str, *parcelas):
+    return {"id_cliente": id_cliente, "parcelas": [{"data_vencimento": data, "status": status} for data, status in parcelas]}
+
+
+class TestCacheProximoVencimento(unittest.TestCase):
+    """A validade das conclusões (TTL do cache negativo) é contada em dias do relógio da execução."""
+
+    HOJE = date(2026, 3, 10)
+
+    def setUp(self):
+        self.addCleanup(lf.iniciar_relogio_execucao)
+        self.cache = lf.CacheProximoVencimento(revalidar_dias=5, arquivo="")
+
+    def dias_validos(self, chave: str) -> int:
+        return 1 + int(hashlib.sha1(chave.encode('utf-8')).hexdigest()[:8], 16) % 5
+
+    def test_desabilitado_com_zero_dias(self):
+        self.assertFalse(lf.CacheProximoVencimento(revalidar_dias=0, arquivo="").habilitado)
+
+    def test_cliente_desconhecido_nao_e_pulado(self):
+        self.assertFalse(self.cache.pular("credilly", "1", rodar_em(self.HOJE)))
+
+    def test_sem_parcela_pendente_pula_ate_expirar(self):
+        rodar_em(self.HOJE)
+        self.cache.gravar_vendas("credilly", ["1"], [venda("1", ("2026-02-01", 2))])
+        dias = self.dias_validos("credilly:1")
+        for dia in range(dias):
+            self.assertTrue(self.cache.pular("credilly", "1", rodar_em(self.HOJE + timedelta(days=dia))))
+        self.assertFalse(self.cache.pular("credilly", "1", rodar_em(self.HOJE + timedelta(days=dias))))
+
+    def test_cliente_do_lote_sem_venda_conta_como_sem_parcela(self):
+        rodar_em(self.HOJE)
+        self.cache.gravar_vendas("turing", ["7"], [])
+        self.assertTrue(self.cache.pular("turing", "7", self.HOJE.isoformat()))
+        self.assertFalse(self.cache.pular("credilly", "7", self.HOJE.isoformat()))
+
+    def test_parcela_futura_volta_a_ser_consultada_um_dia_antes_do_vencimento(self):
+        rodar_em(self.HOJE)
+        self.cache.gravar_vendas("credilly", ["2"], [venda("2", ("2026-03-13T00:00:00", 1), ("2026-04-13", 1))])
+        self.assertTrue(self.cache.pular("credilly", "2", "2026-03-11"))
+        # "vence_amanha" é a janela mais adiantada: o vencimento de 13/03 entra nela em 12/03
+        self.assertFalse(self.cache.pular("credilly", "2", "2026-03-12"))
+
+    def test_parcela_em_janela_hoje_nao_e_pulada(self):
+        rodar_em(self.HOJE)
+        self.cache.gravar_vendas("credilly", ["3"], [venda("3", ("2026-03-09", 3))])
+        self.assertFalse(self.cache.pular("credilly", "3", self.HOJE.isoformat()))
+
+    def test_mescla_fica_com_a_conclusao_mais_recente(self):
+        rodar_em(self.HOJE)
+        self.cache.gravar_vendas("credilly", ["4"], [])
+        gravado_em = self.cache._itens["credilly:4"][2]
+        mais_nova = ["2026-03-20", "2026-03-30", gravado_em + 1]
+        mais_velha = [None, "2026-03-30", gravado_em - 1]
+        self.cache._mesclar({"credilly:4": mais_velha})
+        self.assertIsNone(self.cache._itens["credilly:4"][0])
+        self.cache._mesclar({"credilly:4": mais_nova})
+        self.assertEqual(self.cache._itens["credilly:4"], mais_nova)
+
+
+if __name__ == "__main__":
+    unittest.main()